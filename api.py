@@ -0,0 +1,234 @@
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import parse_qsl
+import asyncpg
+from aiohttp import web
+from config import (BOT_TOKEN, WEBAPP_AUTH_TTL, WEBAPP_AUTH_CACHE_SIZE, API_FEED_PAGE_SIZE,
+                    API_MAX_UPLOAD_SIZE, API_GZIP_MIN_SIZE)
+from services.cache import LRUCache
+from services.matching import START_CURSOR
+from services.photos import UploadTooLarge, UnsupportedImage
+import logging
+
+logger = logging.getLogger(__name__)
+
+GENDERS = ("Male", "Female", "Bi", "Lesbian", "Gay")
+INTERESTS = ("Music", "Sports", "Travel", "Movies", "Books")
+PUBLIC_FIELDS = ("user_id", "nickname", "age", "country", "city", "gender", "interests", "photo_url")
+MAX_BULK_LIKES = 50
+MIN_AGE, MAX_AGE = 18, 120
+
+class InitDataValidator:
+    """Checks Telegram Mini App initData signatures.
+
+    The initData string stays the same for a whole Mini App session, so the
+    verified user is cached by the raw string and the HMAC runs once per session.
+    An entry lives only until auth_date + ttl, the moment the string itself expires.
+    """
+
+    def __init__(self, bot_token=BOT_TOKEN, ttl=WEBAPP_AUTH_TTL, cache_size=WEBAPP_AUTH_CACHE_SIZE):
+        self.secret = hmac.new(b"WebAppData", (bot_token or "").encode(), hashlib.sha256).digest()
+        self.ttl = ttl
+        self.cache = LRUCache(cache_size, ttl)
+
+    def validate(self, init_data):
+        """Telegram user dict for a valid initData string, None otherwise."""
+        if not init_data:
+            return None
+        user = self.cache.get(init_data)
+        if user is not None:
+            return user
+        fields = dict(parse_qsl(init_data, keep_blank_values=True))
+        received_hash = fields.pop("hash", "")
+        check_string = "\n".join(f"{key}={value}" for key, value in sorted(fields.items()))
+        expected_hash = hmac.new(self.secret, check_string.encode(), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(expected_hash, received_hash):
+            return None
+        try:
+            auth_date = int(fields.get("auth_date", 0))
+            user = json.loads(fields["user"])
+        except (KeyError, ValueError):
+            return None
+        if not self.ttl:
+            self.cache.set(init_data, user)
+            return user
+        remaining = self.ttl - (time.time() - auth_date)
+        if remaining <= 0:
+            return None
+        self.cache.set(init_data, user, ttl=remaining)
+        return user
+
+def public_profile(user, with_coins=False):
+    profile = {name: getattr(user, name) for name in PUBLIC_FIELDS}
+    if with_coins:
+        profile["coins"] = user.coins
+    return profile
+
+def json_response(request, data, status=200):
+    """JSON response with a strong ETag; answers 304 when the client copy is current."""
+    body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.method == "GET" and etag in request.headers.get("If-None-Match", ""):
+        return web.Response(status=304, headers=headers)
+    response = web.Response(body=body, status=status, content_type="application/json", headers=headers)
+    if len(body) >= API_GZIP_MIN_SIZE:
+        # Сжимаем только если клиент прислал Accept-Encoding: gzip/deflate
+        response.enable_compression()
+    return response
+
+def encode_cursor(cursor):
+    return f"{cursor[0]}.{cursor[1]}" if cursor else None
+
+def decode_cursor(raw):
+    if not raw:
+        return START_CURSOR
+    overlap, user_id = raw.split(".")
+    return int(overlap), int(user_id)
+
+def parse_profile(data, photos=None):
+    """Validate a registration payload; raises HTTPBadRequest with the first problem found.
+
+    A photo is accepted only as a URL issued by /api/upload (photos.is_stored).
+    """
+    def text(name, max_length):
+        value = str(data.get(name) or "").strip()
+        if not value or len(value) > max_length:
+            raise web.HTTPBadRequest(text=f"{name} must be 1-{max_length} characters")
+        return value
+
+    try:
+        age = int(data.get("age"))
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text="age must be a number")
+    if not MIN_AGE <= age <= MAX_AGE:
+        raise web.HTTPBadRequest(text=f"age must be between {MIN_AGE} and {MAX_AGE}")
+    gender = data.get("gender")
+    if gender not in GENDERS:
+        raise web.HTTPBadRequest(text="unknown gender")
+    interests = data.get("interests")
+    if isinstance(interests, str):
+        interests = [interests]
+    if not interests or not isinstance(interests, list) or not set(interests) <= set(INTERESTS):
+        raise web.HTTPBadRequest(text="interests must be a non-empty list of known interests")
+    photo_url = data.get("photo") or data.get("photo_url") or None
+    if photo_url is not None and (photos is None or not photos.is_stored(photo_url)):
+        raise web.HTTPBadRequest(text="photo must be uploaded through /api/upload")
+    return {
+        "nickname": text("nickname", 50),
+        "age": age,
+        "country": text("country", 100),
+        "city": text("city", 100),
+        "gender": gender,
+        "interests": list(dict.fromkeys(interests)),
+        "photo_url": photo_url,
+    }
+
+@web.middleware
+async def auth_middleware(request, handler):
+    if not request.path.startswith("/api/"):
+        return await handler(request)
+    init_data = request.headers.get("X-Telegram-Init-Data", "")
+    authorization = request.headers.get("Authorization", "")
+    if not init_data and authorization.startswith("tma "):
+        init_data = authorization[4:]
+    tg_user = request.app["init_data"].validate(init_data)
+    if tg_user is None:
+        raise web.HTTPUnauthorized(text="invalid initData")
+    request["user_id"] = int(tg_user["id"])
+    if request.app["activity"]:
+        request.app["activity"].touch(request["user_id"])
+    return await handler(request)
+
+async def handle_get_user(request):
+    user = await request.app["user_manager"].get_user(request["user_id"])
+    return json_response(request, public_profile(user, with_coins=True) if user else None)
+
+async def handle_register(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="invalid JSON")
+    if not isinstance(data, dict):
+        raise web.HTTPBadRequest(text="invalid JSON")
+    profile = parse_profile(data, request.app["photos"])
+    user_manager = request.app["user_manager"]
+    user_id = request["user_id"]
+    if await user_manager.get_user(user_id):
+        if profile["photo_url"] is None:
+            # Редактирование без нового фото сохраняет старое
+            del profile["photo_url"]
+        await user_manager.update_user(user_id, **profile)
+        request.app["matching"].invalidate(user_id)
+        status = 200
+    else:
+        await user_manager.create_user(user_id, **profile)
+        status = 201
+    user = await user_manager.get_user(user_id)
+    return json_response(request, public_profile(user, with_coins=True), status=status)
+
+async def handle_upload(request):
+    """Stream the photo field to the content-addressed store without buffering it in memory."""
+    reader = await request.multipart()
+    field = await reader.next()
+    while field is not None and field.name != "photo":
+        field = await reader.next()
+    if field is None:
+        raise web.HTTPBadRequest(text="photo field is missing")
+    try:
+        url, thumbnails = await request.app["photos"].save_stream(field)
+    except UploadTooLarge:
+        raise web.HTTPRequestEntityTooLarge(max_size=API_MAX_UPLOAD_SIZE, actual_size=API_MAX_UPLOAD_SIZE + 1)
+    except UnsupportedImage as e:
+        raise web.HTTPUnsupportedMediaType(text=str(e))
+    logger.info(f"User {request['user_id']} uploaded {url}")
+    return json_response(request, {"url": url, "thumbnails": thumbnails}, status=201)
+
+async def handle_feed(request):
+    user = await request.app["user_manager"].get_user(request["user_id"])
+    if not user:
+        raise web.HTTPNotFound(text="register first")
+    try:
+        cursor = decode_cursor(request.query.get("cursor"))
+        limit = min(max(int(request.query.get("limit", API_FEED_PAGE_SIZE)), 1), API_FEED_PAGE_SIZE * 5)
+    except ValueError:
+        raise web.HTTPBadRequest(text="invalid cursor or limit")
+    users, next_cursor = await request.app["matching"].get_feed_page(
+        user.user_id, user.city, user.gender, user.interests, cursor, limit)
+    return json_response(request, {"users": [public_profile(u) for u in users], "next_cursor": encode_cursor(next_cursor)})
+
+async def handle_likes(request):
+    """Bulk likes: {"user_ids": [...]} -> {"matches": [...], "invalid": [...]}."""
+    try:
+        data = await request.json()
+        target_ids = [int(target_id) for target_id in data["user_ids"]]
+    except (ValueError, KeyError, TypeError):
+        raise web.HTTPBadRequest(text="expected {\"user_ids\": [...]}")
+    if len(target_ids) > MAX_BULK_LIKES:
+        raise web.HTTPBadRequest(text=f"at most {MAX_BULK_LIKES} likes per request")
+    matching = request.app["matching"]
+    matches, invalid = [], []
+    for target_id in dict.fromkeys(target_ids):
+        # Каждый лайк — своя транзакция: несуществующий id не откатывает и не роняет остальные
+        try:
+            if await matching.add_like(request["user_id"], target_id):
+                matches.append(target_id)
+        except asyncpg.ForeignKeyViolationError:
+            invalid.append(target_id)
+    return json_response(request, {"matches": matches, "invalid": invalid})
+
+def setup_api(app, user_manager, matching, photos, validator=None, activity=None):
+    app["user_manager"] = user_manager
+    app["matching"] = matching
+    app["photos"] = photos
+    app["init_data"] = validator or InitDataValidator()
+    # Запросы Mini App тоже отмечают пользователя активным
+    app["activity"] = activity
+    app.middlewares.append(auth_middleware)
+    app.router.add_get("/api/user", handle_get_user)
+    app.router.add_post("/api/register", handle_register)
+    app.router.add_post("/api/upload", handle_upload)
+    app.router.add_get("/api/feed", handle_feed)
+    app.router.add_post("/api/likes", handle_likes)
@@ -0,0 +1,122 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from typing import NamedTuple
+from aiohttp import web
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_ROUTE = "/webapp/static/"
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+# Файлы, в которых ссылки на статику заменяются на имена с хэшем
+REWRITTEN_EXTENSIONS = (".css", ".js", ".html")
+REFERENCE = re.compile(r"(?<![\w./-])(?:/webapp/)?static/([\w./-]+)")
+
+class Asset(NamedTuple):
+    content_type: str
+    etag: str
+    cache_control: str
+    variants: dict  # кодировка ("br", "gzip", "identity") -> тело
+
+def fingerprint(path, body):
+    stem, extension = os.path.splitext(path)
+    return f"{stem}.{hashlib.blake2b(body, digest_size=6).hexdigest()}{extension}"
+
+def compress_variants(body, content_type):
+    variants = {"identity": body}
+    if not content_type.startswith(COMPRESSIBLE_TYPES):
+        return variants
+    compressed = gzip.compress(body, compresslevel=9, mtime=0)
+    if len(compressed) < len(body):
+        variants["gzip"] = compressed
+    if brotli is not None:
+        compressed = brotli.compress(body, quality=11)
+        if len(compressed) < len(body):
+            variants["br"] = compressed
+    return variants
+
+def make_asset(body, content_type, cache_control):
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    return Asset(content_type, etag, cache_control, compress_variants(body, content_type))
+
+class AssetBundle:
+    """Mini App assets loaded once at startup and served from memory.
+
+    Every file under webapp/static is published under a fingerprinted name
+    (app.<hash>.js) with an immutable Cache-Control; references in index.html,
+    CSS and JS are rewritten to those names. Original names and index.html
+    stay available with ETag revalidation.
+    """
+
+    def __init__(self, root="webapp", exclude=("uploads",)):
+        self.root = root
+        self.static_dir = os.path.join(root, "static")
+        self.exclude = set(exclude)
+        self.assets = {}
+        self.fingerprints = {}
+        self.index = None
+
+    def build(self):
+        files = []
+        for directory, dirnames, filenames in os.walk(self.static_dir):
+            dirnames[:] = [d for d in dirnames if os.path.relpath(os.path.join(directory, d), self.static_dir) not in self.exclude]
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                files.append(os.path.relpath(path, self.static_dir).replace(os.sep, "/"))
+        # Сначала файлы без ссылок (картинки), потом CSS/JS, чтобы их хэш учитывал переименования
+        files.sort(key=lambda name: name.endswith(REWRITTEN_EXTENSIONS))
+        for name in files:
+            with open(os.path.join(self.static_dir, name), "rb") as f:
+                body = f.read()
+            if name.endswith(REWRITTEN_EXTENSIONS):
+                body = self.rewrite(body)
+            content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            hashed = fingerprint(name, body)
+            self.fingerprints[name] = hashed
+            self.assets[hashed] = make_asset(body, content_type, IMMUTABLE)
+            self.assets[name] = make_asset(body, content_type, REVALIDATE)
+        with open(os.path.join(self.root, "index.html"), "rb") as f:
+            self.index = make_asset(self.rewrite(f.read()), "text/html", REVALIDATE)
+        size = sum(len(v) for asset in self.assets.values() for v in asset.variants.values())
+        logger.info(f"Loaded {len(files)} static assets into memory ({size} bytes with compressed variants)")
+        return self
+
+    def rewrite(self, body):
+        def replace(match):
+            hashed = self.fingerprints.get(match.group(1))
+            return f"{STATIC_ROUTE}{hashed}" if hashed else match.group(0)
+        return REFERENCE.sub(replace, body.decode()).encode()
+
+    def url_for(self, name):
+        return f"{STATIC_ROUTE}{self.fingerprints.get(name, name)}"
+
+    @staticmethod
+    def respond(request, asset):
+        headers = {"ETag": asset.etag, "Cache-Control": asset.cache_control, "Vary": "Accept-Encoding"}
+        if asset.etag in request.headers.get("If-None-Match", ""):
+            return web.Response(status=304, headers=headers)
+        accepted = request.headers.get("Accept-Encoding", "")
+        for encoding in ("br", "gzip"):
+            if encoding in asset.variants and encoding in accepted:
+                headers["Content-Encoding"] = encoding
+                return web.Response(body=asset.variants[encoding], content_type=asset.content_type, headers=headers)
+        return web.Response(body=asset.variants["identity"], content_type=asset.content_type, headers=headers)
+
+    async def handle_index(self, request):
+        return self.respond(request, self.index)
+
+    async def handle_static(self, request):
+        asset = self.assets.get(request.match_info["path"])
+        if asset is None:
+            raise web.HTTPNotFound()
+        return self.respond(request, asset)
@@ -7,3 +7,104 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
 ADMIN_IDS = [int(id) for id in os.getenv("ADMIN_IDS", "").split(",") if id.strip().isdigit()]
 WEBAPP_URL = os.getenv("WEBAPP_URL", "https://cryptodivebot.onrender.com")
+
+# Пул соединений с базой данных
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", 10.0))
+DB_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_MAX_INACTIVE_LIFETIME", 300.0))
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_HEALTH_CHECK_INTERVAL", 30.0))
+
+# Очередь кандидатов для ленты знакомств
+CANDIDATE_BATCH_SIZE = int(os.getenv("CANDIDATE_BATCH_SIZE", 20))
+CANDIDATE_LOW_WATERMARK = int(os.getenv("CANDIDATE_LOW_WATERMARK", 5))
+CANDIDATE_QUEUE_TTL = float(os.getenv("CANDIDATE_QUEUE_TTL", 600.0))
+CANDIDATE_MAX_QUEUES = int(os.getenv("CANDIDATE_MAX_QUEUES", 10000))
+
+# Кэш профилей и общий key-value бэкенд (Redis или "memory://" для локального запуска)
+REDIS_URL = os.getenv("REDIS_URL")
+# Где хранить FSM и лимиты: memory (один процесс), redis или postgres (общие для воркеров)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "redis" if REDIS_URL else "memory")
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 50000))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 300.0))
+
+# Рассылки: общий лимит Telegram ~30 сообщений/с
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25.0))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 10))
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", 200))
+
+# Приём вебхуков: очередь апдейтов и пул обработчиков
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 8))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.getenv("WEBHOOK_ENQUEUE_TIMEOUT", 1.0))
+WEBHOOK_DEDUP_SIZE = int(os.getenv("WEBHOOK_DEDUP_SIZE", 10000))
+# Перезапуск без простоя: сколько ждать дообработки апдейтов после SIGTERM
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", 20.0))
+# Прогрев при старте: профили недавно активных пользователей в кэш
+WARMUP_USERS = int(os.getenv("WARMUP_USERS", 500))
+
+# Горизонтальное масштабирование: число процессов веб-сервера на узле
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", 1))
+# Внутренние порты воркеров (WEB_INTERNAL_PORT + номер): апдейты чата пересылаются его воркеру
+WEB_INTERNAL_PORT = int(os.getenv("WEB_INTERNAL_PORT", 10100))
+# Свой Bot API сервер (или заглушка для бенчмарков); по умолчанию api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+# Викторина
+QUIZ_FILE = os.getenv("QUIZ_FILE", "data/questions.json")
+QUIZ_LENGTH = int(os.getenv("QUIZ_LENGTH", 5))
+QUIZ_REWARD = int(os.getenv("QUIZ_REWARD", 1))
+QUIZ_RELOAD_INTERVAL = float(os.getenv("QUIZ_RELOAD_INTERVAL", 5.0))
+
+# Монеты: бонус при регистрации и пакетная запись в журнал
+SIGNUP_BONUS = int(os.getenv("SIGNUP_BONUS", 10))
+COINS_FLUSH_INTERVAL = float(os.getenv("COINS_FLUSH_INTERVAL", 0.5))
+COINS_FLUSH_SIZE = int(os.getenv("COINS_FLUSH_SIZE", 200))
+
+# Аналитика: пакетная запись событий сервисов и кэш отчёта для админки
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", 10.0))
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", 60.0))
+STATS_DAYS = int(os.getenv("STATS_DAYS", 7))
+
+# REST API Mini App и HTTP-сервер
+WEBAPP_AUTH_TTL = int(os.getenv("WEBAPP_AUTH_TTL", 86400))
+WEBAPP_AUTH_CACHE_SIZE = int(os.getenv("WEBAPP_AUTH_CACHE_SIZE", 10000))
+API_FEED_PAGE_SIZE = int(os.getenv("API_FEED_PAGE_SIZE", 20))
+API_MAX_UPLOAD_SIZE = int(os.getenv("API_MAX_UPLOAD_SIZE", 5 * 1024 * 1024))
+API_GZIP_MIN_SIZE = int(os.getenv("API_GZIP_MIN_SIZE", 1024))
+WEB_KEEPALIVE_TIMEOUT = float(os.getenv("WEB_KEEPALIVE_TIMEOUT", 75.0))
+
+# Фото профилей: хранилище по хэшу содержимого, превью и кэш file_id Telegram
+PHOTO_DIR = os.getenv("PHOTO_DIR", "webapp/static/uploads")
+PHOTO_URL = os.getenv("PHOTO_URL", f"{WEBAPP_URL}/static/uploads")
+PHOTO_THUMBNAIL_SIZES = [int(size) for size in os.getenv("PHOTO_THUMBNAIL_SIZES", "320,640").split(",") if size.strip().isdigit()]
+PHOTO_WORKERS = int(os.getenv("PHOTO_WORKERS", 2))
+PHOTO_FILE_ID_CACHE_SIZE = int(os.getenv("PHOTO_FILE_ID_CACHE_SIZE", 50000))
+
+# Статика Mini App: из памяти, с хэшем в именах и предсжатием (0 — отдавать с диска)
+STATIC_IN_MEMORY = os.getenv("STATIC_IN_MEMORY", "1") not in ("0", "false", "no")
+
+# Рекомендации: фоновый пересчёт ранжированных кандидатов
+RECS_TOP_K = int(os.getenv("RECS_TOP_K", 200))
+RECS_POOL_SIZE = int(os.getenv("RECS_POOL_SIZE", 5000))
+RECS_BATCH_SIZE = int(os.getenv("RECS_BATCH_SIZE", 50))
+RECS_INTERVAL = float(os.getenv("RECS_INTERVAL", 5.0))
+RECS_REFRESH_INTERVAL = float(os.getenv("RECS_REFRESH_INTERVAL", 3600.0))
+RECS_LEASE = float(os.getenv("RECS_LEASE", 300.0))
+# Веса: интересы (Jaccard), близость возраста, недавняя активность, вероятность взаимного лайка
+RECS_WEIGHTS = tuple(float(w) for w in os.getenv("RECS_WEIGHTS", "0.45,0.2,0.15,0.2").split(","))
+RECS_AGE_SCALE = float(os.getenv("RECS_AGE_SCALE", 5.0))
+RECS_RECENCY_HALF_LIFE = float(os.getenv("RECS_RECENCY_HALF_LIFE", 3 * 86400.0))
+
+# Уведомления и чат: outbox и фоновая доставка
+NOTIFY_RATE = float(os.getenv("NOTIFY_RATE", 25.0))
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", 10))
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", 100))
+NOTIFY_POLL_INTERVAL = float(os.getenv("NOTIFY_POLL_INTERVAL", 2.0))
+# Telegram: не больше ~1 сообщения в секунду в один чат
+NOTIFY_CHAT_INTERVAL = float(os.getenv("NOTIFY_CHAT_INTERVAL", 1.0))
+NOTIFY_COALESCE_WINDOW = float(os.getenv("NOTIFY_COALESCE_WINDOW", 60.0))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", 5))
+NOTIFY_LEASE = float(os.getenv("NOTIFY_LEASE", 60.0))
+NOTIFY_RETENTION = float(os.getenv("NOTIFY_RETENTION", 86400.0))
@@ -0,0 +1,112 @@
+import asyncio
+import asyncpg
+from config import (
+    DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_STATEMENT_CACHE_SIZE,
+    DB_COMMAND_TIMEOUT, DB_MAX_INACTIVE_LIFETIME, DB_HEALTH_CHECK_INTERVAL,
+)
+from metrics import TimedAcquire
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Ключи advisory-блокировок, общие для всех воркеров и узлов
+LOCK_MIGRATIONS = 1
+LOCK_WEBHOOK = 2
+LOCK_BROADCAST = 3
+
+class Database:
+    """Process-wide asyncpg pool shared by all services."""
+
+    def __init__(self, dsn=DATABASE_URL, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 statement_cache_size=DB_STATEMENT_CACHE_SIZE, command_timeout=DB_COMMAND_TIMEOUT,
+                 max_inactive_lifetime=DB_MAX_INACTIVE_LIFETIME, health_check_interval=DB_HEALTH_CHECK_INTERVAL):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statement_cache_size = statement_cache_size
+        self.command_timeout = command_timeout
+        self.max_inactive_lifetime = max_inactive_lifetime
+        self.health_check_interval = health_check_interval
+        self.pool = None
+        self._health_task = None
+        self._listener = None
+
+    async def connect(self):
+        if self.pool is not None:
+            return self.pool
+        try:
+            self.pool = await asyncpg.create_pool(
+                self.dsn,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                statement_cache_size=self.statement_cache_size,
+                command_timeout=self.command_timeout,
+                max_inactive_connection_lifetime=self.max_inactive_lifetime,
+            )
+            logger.info(f"Database pool created (min={self.min_size}, max={self.max_size})")
+        except Exception as e:
+            logger.error(f"Error creating database pool: {e}")
+            raise
+        if self.health_check_interval > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+        return self.pool
+
+    def acquire(self):
+        if self.pool is None:
+            raise RuntimeError("Database pool is not initialized, call connect() first")
+        return TimedAcquire(self.pool.acquire())
+
+    async def listen(self, channel, callback):
+        """Subscribe to NOTIFY on channel over a dedicated connection outside the pool."""
+        if self._listener is None:
+            self._listener = await asyncpg.connect(self.dsn)
+        await self._listener.add_listener(channel, lambda conn, pid, ch, payload: callback(payload))
+
+    async def warm_up(self, statements=()):
+        """Round-trip every pooled connection and run hot statements once on each.
+
+        statements are (query, args) pairs; asyncpg keeps prepared statements
+        per connection, so the first real requests skip parsing and planning.
+        """
+        conns = [await self.pool.acquire() for _ in range(self.pool.get_size())]
+        try:
+            for query, args in [("SELECT 1", ()), *statements]:
+                await asyncio.gather(*(conn.fetch(query, *args) for conn in conns))
+        finally:
+            for conn in conns:
+                await self.pool.release(conn)
+        return len(conns)
+
+    async def health_check(self):
+        try:
+            async with self.acquire() as conn:
+                await conn.fetchval("SELECT 1")
+            return True
+        except Exception as e:
+            logger.error(f"Database health check failed: {e}")
+            return False
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            if not await self.health_check():
+                # Сбрасываем простаивающие соединения, чтобы пул переподключился
+                await self.pool.expire_connections()
+
+    async def close(self, timeout=10.0):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+        if self.pool is None:
+            return
+        try:
+            await asyncio.wait_for(self.pool.close(), timeout)
+            logger.info("Database pool closed")
+        except asyncio.TimeoutError:
+            logger.warning("Database pool did not close in time, terminating connections")
+            self.pool.terminate()
+        finally:
+            self.pool = None
@@ -1,14 +1,21 @@
+from html import escape
 from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
 from config import ADMIN_IDS
-from services.user_manager import UserManager
+from services.broadcast import BroadcastService
+from services.analytics import AnalyticsService, DAILY_METRICS
 import logging
 import asyncio
 
 logger = logging.getLogger(__name__)
 router = Router()
 
+class AdminStates(StatesGroup):
+    broadcast_text = State()
+
 @router.message(Command("admin"))
 async def admin_panel(message: Message):
     try:
@@ -18,21 +25,37 @@ async def admin_panel(message: Message):
         await message.answer("Admin Panel", reply_markup=InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="Statistics", callback_data="admin_stats")],
             [InlineKeyboardButton(text="Ban User", callback_data="admin_ban")],
-            [InlineKeyboardButton(text="Broadcast", callback_data="admin_broadcast")]
+            [InlineKeyboardButton(text="Broadcast", callback_data="admin_broadcast")],
+            [InlineKeyboardButton(text="Broadcast Status", callback_data="admin_broadcast_status")]
         ]))
     except Exception as e:
         logger.error(f"Error in admin_panel for user {message.from_user.id}: {e}")
         await message.answer("Error accessing admin panel.")
 
+def format_stats(stats):
+    lines = [
+        "<b>Statistics</b>",
+        f"Users: {stats['users']} (active today: {stats['series']['active_users'][-1]})",
+        f"Likes: {stats['likes']}\nMatches: {stats['matches']}",
+        f"Chat messages: {stats['messages']}\nQuiz plays: {stats['quiz_plays']}",
+        "",
+        "<b>Daily</b> (" + " / ".join(metric.replace("_", " ") for metric in DAILY_METRICS) + ")",
+    ]
+    for i, day in enumerate(stats["days"]):
+        lines.append(f"{day:%m-%d}: " + " / ".join(str(stats["series"][metric][i]) for metric in DAILY_METRICS))
+    lines.append("")
+    # Город и пол вводят пользователи, а сообщение уходит с parse_mode HTML
+    lines.append("Top cities: " + (", ".join(f"{escape(city.title())} {count}" for city, count in stats["cities"][:5]) or "-"))
+    lines.append("Genders: " + (", ".join(f"{escape(gender)} {count}" for gender, count in stats["genders"]) or "-"))
+    return "\n".join(lines)
+
 @router.callback_query(F.data == "admin_stats")
-async def admin_stats(callback: CallbackQuery):
+async def admin_stats(callback: CallbackQuery, analytics: AnalyticsService):
     try:
         if callback.from_user.id not in ADMIN_IDS:
             await callback.message.answer("Access denied.")
             return
-        user_manager = UserManager()
-        stats = await user_manager.get_stats()
-        await callback.message.answer(f"Users: {stats['users']}\nMatches: {stats['matches']}\nActive Chats: {stats['chats']}")
+        await callback.message.answer(format_stats(await analytics.get_stats()))
     except Exception as e:
         logger.error(f"Error in admin_stats for user {callback.from_user.id}: {e}")
         await callback.message.answer("Error fetching stats.")
@@ -50,13 +73,53 @@ async def admin_ban(callback: CallbackQuery):
         await callback.message.answer("Error processing ban.")
 
 @router.callback_query(F.data == "admin_broadcast")
-async def admin_broadcast(callback: CallbackQuery):
+async def admin_broadcast(callback: CallbackQuery, state: FSMContext):
     try:
         if callback.from_user.id not in ADMIN_IDS:
             await callback.message.answer("Access denied.")
             return
+        await state.set_state(AdminStates.broadcast_text)
         await callback.message.answer("Enter broadcast message:")
-        # Implement broadcast logic in a separate message handler if needed
     except Exception as e:
         logger.error(f"Error in admin_broadcast for user {callback.from_user.id}: {e}")
         await callback.message.answer("Error processing broadcast.")
+
+@router.message(AdminStates.broadcast_text)
+async def admin_broadcast_text(message: Message, state: FSMContext, broadcasts: BroadcastService):
+    try:
+        await state.clear()
+        if message.from_user.id not in ADMIN_IDS:
+            await message.answer("Access denied.")
+            return
+        if not message.text:
+            await message.answer("Broadcast message must be text.")
+            return
+        job = await broadcasts.start(message.html_text, message.from_user.id)
+        await message.answer(f"Broadcast #{job.id} started for {job.total} users.", reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="Broadcast Status", callback_data="admin_broadcast_status")]
+        ]))
+    except Exception as e:
+        logger.error(f"Error in admin_broadcast_text for user {message.from_user.id}: {e}")
+        await message.answer("Error starting broadcast.")
+
+@router.callback_query(F.data == "admin_broadcast_status")
+async def admin_broadcast_status(callback: CallbackQuery, broadcasts: BroadcastService):
+    try:
+        if callback.from_user.id not in ADMIN_IDS:
+            await callback.message.answer("Access denied.")
+            return
+        status = await broadcasts.get_status()
+        if not status:
+            await callback.message.answer("No broadcasts yet.")
+            return
+        done = status["sent"] + status["failed"]
+        progress = done / status["total"] * 100 if status["total"] else 100.0
+        await callback.message.answer(
+            f"Broadcast #{status['id']}: {status['status']}\n"
+            f"Progress: {done}/{status['total']} ({progress:.0f}%)\n"
+            f"Sent: {status['sent']}, failed: {status['failed']}\n"
+            f"Throughput: {status['throughput']:.1f} msg/s"
+        )
+    except Exception as e:
+        logger.error(f"Error in admin_broadcast_status for user {callback.from_user.id}: {e}")
+        await callback.message.answer("Error fetching broadcast status.")
@@ -1,17 +1,28 @@
+from html import escape
 from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from config import WEBAPP_URL
+from config import WEBAPP_URL, QUIZ_REWARD
 from services.user_manager import UserManager
 from services.matching import MatchingService
 from services.quiz import QuizService
+from services.coins import CoinsService
+from services.photos import PhotoStore
+from services.chat import ChatService
+from services.analytics import AnalyticsService
 import logging
+import uuid
 
 logger = logging.getLogger(__name__)
 router = Router()
 
+# Свайпы делят один бакет: короткий всплеск и ~2 свайпа в секунду
+SWIPE_RATE_LIMIT = {"key": "swipe", "rate": 2.0, "burst": 5}
+# Переписка: общий лимит сообщений слишком строг для живого диалога
+CHAT_RATE_LIMIT = {"key": "chat", "rate": 1.0, "burst": 5}
+
 class RegistrationStates(StatesGroup):
     nickname = State()
     age = State()
@@ -22,11 +33,10 @@ class RegistrationStates(StatesGroup):
     photo = State()
 
 @router.message(Command("start"))
-async def start(message: Message):
+async def start(message: Message, user_manager: UserManager):
     try:
         user_id = message.from_user.id
         logger.info(f"User {user_id} triggered /start")
-        user_manager = UserManager()
         user = await user_manager.get_user(user_id)
         if user:
             await message.answer("Welcome back! Use the menu below.", reply_markup=main_menu())
@@ -46,14 +56,13 @@ def main_menu():
     ])
 
 @router.callback_query(F.data == "view_profile")
-async def view_profile(callback: CallbackQuery):
+async def view_profile(callback: CallbackQuery, user_manager: UserManager, photos: PhotoStore):
     try:
-        user_manager = UserManager()
         user = await user_manager.get_user(callback.from_user.id)
         if user:
             profile_text = f"<b>Profile</b>\n\nNickname: {user.nickname}\nAge: {user.age}\nCity: {user.city}\nGender: {user.gender}\nInterests: {', '.join(user.interests)}\nCoins: {user.coins}"
             photo = user.photo_url or None
-            await callback.message.answer_photo(photo=photo, caption=profile_text, reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            await photos.answer_photo(callback.message, photo, caption=profile_text, reply_markup=InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="Edit Profile", web_app={"url": f"{WEBAPP_URL}/index.html"})]
             ])) if photo else await callback.message.answer(profile_text, reply_markup=InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="Edit Profile", web_app={"url": f"{WEBAPP_URL}/index.html"})]
@@ -66,15 +75,13 @@ async def view_profile(callback: CallbackQuery):
         logger.error(f"Error in view_profile for user {callback.from_user.id}: {e}")
         await callback.message.answer("Error loading profile.")
 
-@router.callback_query(F.data == "find_users")
-async def find_users(callback: CallbackQuery):
+@router.callback_query(F.data == "find_users", flags={"rate_limit": SWIPE_RATE_LIMIT})
+async def find_users(callback: CallbackQuery, user_manager: UserManager, matching: MatchingService, photos: PhotoStore):
     try:
-        user_manager = UserManager()
         user = await user_manager.get_user(callback.from_user.id)
         if not user:
             await callback.message.answer("Please register first.")
             return
-        matching = MatchingService()
         next_user = await matching.get_next_user(callback.from_user.id, user.city, user.gender, user.interests)
         if next_user:
             text = f"{next_user.nickname}, {next_user.age}, {next_user.city}\nInterests: {', '.join(next_user.interests)}"
@@ -83,40 +90,116 @@ async def find_users(callback: CallbackQuery):
                 [InlineKeyboardButton(text="Like ❤️", callback_data=f"like_{next_user.user_id}"),
                  InlineKeyboardButton(text="Next ➡️", callback_data="find_users")]
             ])
-            await callback.message.answer_photo(photo=photo, caption=text, reply_markup=keyboard) if photo else await callback.message.answer(text, reply_markup=keyboard)
+            await photos.answer_photo(callback.message, photo, caption=text, reply_markup=keyboard) if photo else await callback.message.answer(text, reply_markup=keyboard)
         else:
             await callback.message.answer("No more users to show.")
     except Exception as e:
         logger.error(f"Error in find_users for user {callback.from_user.id}: {e}")
         await callback.message.answer("Error finding users.")
 
-@router.callback_query(F.data.startswith("like_"))
-async def like_user(callback: CallbackQuery):
+@router.callback_query(F.data.startswith("like_"), flags={"rate_limit": SWIPE_RATE_LIMIT})
+async def like_user(callback: CallbackQuery, user_manager: UserManager, matching: MatchingService, photos: PhotoStore):
     try:
         target_id = int(callback.data.split("_")[1])
         user_id = callback.from_user.id
-        matching = MatchingService()
         match = await matching.add_like(user_id, target_id)
         if match:
             await callback.message.answer("🎉 It's a Match! Start chatting!", reply_markup=InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="Start Chat", callback_data=f"chat_{target_id}")]
             ]))
-        await find_users(callback)
+        await find_users(callback, user_manager, matching, photos)
     except Exception as e:
         logger.error(f"Error in like_user for user {callback.from_user.id}: {e}")
         await callback.message.answer("Error processing like.")
 
+def quiz_keyboard(position, question):
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=str(i + 1), callback_data=f"quiz_{position}_{i}") for i in range(len(question.options))]
+    ])
+
+async def send_question(message: Message, position, question):
+    options = "\n".join(f"{i + 1}. {option}" for i, option in enumerate(question.options))
+    await message.answer(f"Question {position + 1}:\n{question.text}\n\n{options}", reply_markup=quiz_keyboard(position, question))
+
 @router.callback_query(F.data == "play_quiz")
-async def start_quiz(callback: CallbackQuery, state: FSMContext):
+async def start_quiz(callback: CallbackQuery, state: FSMContext, quiz: QuizService):
     try:
-        quiz = QuizService()
-        question = quiz.get_next_question()
+        question_ids = quiz.new_session()
         await state.set_state(QuizService.QuizStates.answering)
-        await state.update_data(question_index=0, correct_answers=0)
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=str(i + 1), callback_data=f"quiz_{i}") for i in range(4)]
-        ])
-        await callback.message.answer(f"Question 1:\n{question['text']}\n\n1. {question['options'][0]}\n2. {question['options'][1]}\n3. {question['options'][2]}\n4. {question['options'][3]}", reply_markup=keyboard)
+        await state.set_data({"session_id": uuid.uuid4().hex, "question_ids": question_ids, "position": 0, "correct_answers": 0})
+        await send_question(callback.message, 0, quiz.get_question(question_ids[0]))
     except Exception as e:
         logger.error(f"Error in start_quiz for user {callback.from_user.id}: {e}")
         await callback.message.answer("Error starting quiz.")
+
+@router.callback_query(QuizService.QuizStates.answering, F.data.startswith("quiz_"))
+async def answer_quiz(callback: CallbackQuery, state: FSMContext, quiz: QuizService, coins: CoinsService,
+                      analytics: AnalyticsService):
+    try:
+        _, position, answer_index = callback.data.split("_")
+        position, answer_index = int(position), int(answer_index)
+        data = await state.get_data()
+        # Повторное нажатие на кнопки уже отвеченного вопроса игнорируем
+        if position != data["position"]:
+            await callback.answer()
+            return
+        question_ids = data["question_ids"]
+        correct = quiz.check_answer(question_ids[position], answer_index)
+        correct_answers = data["correct_answers"] + int(correct)
+        await callback.answer("Correct!" if correct else "Wrong!")
+        position += 1
+        next_question = None
+        while position < len(question_ids) and next_question is None:
+            # Вопрос мог пропасть из банка после перезагрузки файла
+            next_question = quiz.get_question(question_ids[position])
+            if next_question is None:
+                position += 1
+        if next_question:
+            await state.update_data(position=position, correct_answers=correct_answers)
+            await send_question(callback.message, position, next_question)
+            return
+        await state.clear()
+        analytics.record("quiz_plays")
+        reward = correct_answers * QUIZ_REWARD
+        if reward:
+            coins.credit_later(callback.from_user.id, reward, reason="quiz", idempotency_key=f"quiz:{data['session_id']}")
+        await callback.message.answer(f"Quiz finished! {correct_answers}/{len(question_ids)} correct, +{reward} coins.", reply_markup=main_menu())
+    except Exception as e:
+        logger.error(f"Error in answer_quiz for user {callback.from_user.id}: {e}")
+        await callback.message.answer("Error processing answer.")
+
+@router.callback_query(F.data.startswith("chat_"))
+async def open_chat(callback: CallbackQuery, state: FSMContext, user_manager: UserManager, chat: ChatService):
+    try:
+        partner_id = int(callback.data.split("_")[1])
+        if not await chat.is_match(callback.from_user.id, partner_id):
+            await callback.answer("You can only chat with your matches.", show_alert=True)
+            return
+        partner = await user_manager.get_user(partner_id)
+        if partner is None:
+            await callback.answer("This user is no longer available.", show_alert=True)
+            return
+        await state.set_state(ChatService.ChatStates.chatting)
+        await state.set_data({"partner_id": partner_id})
+        await callback.answer()
+        await callback.message.answer(f"Chatting with <b>{escape(partner.nickname)}</b>. Send a message, or /stop to leave.")
+    except Exception as e:
+        logger.error(f"Error in open_chat for user {callback.from_user.id}: {e}")
+        await callback.message.answer("Error opening chat.")
+
+@router.message(ChatService.ChatStates.chatting, Command("stop"))
+async def leave_chat(message: Message, state: FSMContext):
+    await state.clear()
+    await message.answer("Chat closed.", reply_markup=main_menu())
+
+@router.message(ChatService.ChatStates.chatting, F.text, flags={"rate_limit": CHAT_RATE_LIMIT})
+async def relay_message(message: Message, state: FSMContext, user_manager: UserManager, chat: ChatService):
+    try:
+        data = await state.get_data()
+        user = await user_manager.get_user(message.from_user.id)
+        # Только запись в outbox: доставкой занимается ChatService в фоне
+        await chat.relay_message(message.from_user.id, user.nickname if user else message.from_user.full_name,
+                                 data["partner_id"], message.text, message.message_id)
+    except Exception as e:
+        logger.error(f"Error in relay_message for user {message.from_user.id}: {e}")
+        await message.answer("Message not sent. Please try again.")
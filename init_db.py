@@ -1,36 +1,403 @@
 import asyncio
-import asyncpg
-from config import DATABASE_URL
+import time
+from db import Database, LOCK_MIGRATIONS
 import logging
 
 logger = logging.getLogger(__name__)
 
-async def init_db():
+# Версии схемы: применённые записываются в schema_migrations и при старте пропускаются.
+# Шаги идемпотентны, поэтому базы, созданные до версионирования, догоняются без ошибок.
+# Новые изменения — только новой версией в конце списка.
+MIGRATIONS = [
+    (1, "core tables", """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            nickname VARCHAR(50) NOT NULL,
+            age INTEGER NOT NULL CHECK (age >= 18),
+            country VARCHAR(100) NOT NULL,
+            city VARCHAR(100) NOT NULL,
+            gender VARCHAR(20) NOT NULL,
+            interests TEXT[] NOT NULL,
+            photo_url TEXT,
+            blocked BOOLEAN DEFAULT FALSE
+        );
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS city_norm VARCHAR(100) GENERATED ALWAYS AS (LOWER(city)) STORED;
+        DROP INDEX IF EXISTS idx_users_city;
+        DROP INDEX IF EXISTS idx_users_gender;
+        -- Индексы ленты: город + пол среди незаблокированных и пересечение интересов
+        CREATE INDEX IF NOT EXISTS idx_users_feed ON users (city_norm, gender, user_id) WHERE blocked = FALSE;
+        CREATE INDEX IF NOT EXISTS idx_users_interests ON users USING GIN (interests) WHERE blocked = FALSE;
+
+        CREATE TABLE IF NOT EXISTS likes (
+            liker BIGINT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+            likee BIGINT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+            ts TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (liker, likee)
+        );
+        CREATE INDEX IF NOT EXISTS idx_likes_likee ON likes (likee, liker);
+
+        CREATE TABLE IF NOT EXISTS matches (
+            user_a BIGINT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+            user_b BIGINT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+            ts TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (user_a, user_b),
+            CHECK (user_a < user_b)
+        );
+        CREATE INDEX IF NOT EXISTS idx_matches_user_b ON matches (user_b, user_a);
+
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id SERIAL PRIMARY KEY,
+            text TEXT NOT NULL,
+            created_by BIGINT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'running',
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            last_user_id BIGINT NOT NULL DEFAULT 0,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            finished_at TIMESTAMPTZ
+        );
+    """),
+    (2, "likes and matches out of user arrays", """
+        -- Переносим старые массивы users.likes / users.matches в отдельные таблицы
+        DO $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'users' AND column_name = 'likes'
+            ) THEN
+                INSERT INTO likes (liker, likee)
+                SELECT u.user_id, l.likee FROM users u, unnest(u.likes) AS l(likee)
+                WHERE l.likee <> u.user_id AND EXISTS (SELECT 1 FROM users t WHERE t.user_id = l.likee)
+                ON CONFLICT DO NOTHING;
+                INSERT INTO matches (user_a, user_b)
+                SELECT LEAST(u.user_id, m.other), GREATEST(u.user_id, m.other) FROM users u, unnest(u.matches) AS m(other)
+                WHERE m.other <> u.user_id AND EXISTS (SELECT 1 FROM users t WHERE t.user_id = m.other)
+                ON CONFLICT DO NOTHING;
+                ALTER TABLE users DROP COLUMN likes, DROP COLUMN matches;
+            END IF;
+        END $$;
+    """),
+    (3, "coin ledger", """
+        -- Монеты: журнал операций и материализованный баланс вне горячей строки users
+        CREATE TABLE IF NOT EXISTS coin_ledger (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+            amount INTEGER NOT NULL,
+            reason VARCHAR(50) NOT NULL,
+            idempotency_key TEXT UNIQUE,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS idx_coin_ledger_user ON coin_ledger (user_id, id);
+        CREATE TABLE IF NOT EXISTS coin_balances (
+            user_id BIGINT PRIMARY KEY REFERENCES users (user_id) ON DELETE CASCADE,
+            balance INTEGER NOT NULL DEFAULT 0 CHECK (balance >= 0)
+        );
+        -- Переносим users.coins в журнал монет начальной записью
+        DO $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'users' AND column_name = 'coins'
+            ) THEN
+                INSERT INTO coin_ledger (user_id, amount, reason, idempotency_key)
+                SELECT user_id, coins, 'migration', 'migration:' || user_id FROM users WHERE coins <> 0
+                ON CONFLICT DO NOTHING;
+                INSERT INTO coin_balances (user_id, balance)
+                SELECT user_id, GREATEST(coins, 0) FROM users
+                ON CONFLICT DO NOTHING;
+                ALTER TABLE users DROP COLUMN coins;
+            END IF;
+        END $$;
+    """),
+    (4, "shared state and photo file ids", """
+        -- Общее состояние воркеров: FSM и key-value (лимиты запросов)
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            bot_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            thread_id BIGINT NOT NULL DEFAULT 0,
+            destiny VARCHAR(50) NOT NULL,
+            state TEXT,
+            data JSONB,
+            PRIMARY KEY (bot_id, chat_id, user_id, thread_id, destiny)
+        );
+        CREATE UNLOGGED TABLE IF NOT EXISTS kv_store (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            expires_at TIMESTAMPTZ
+        );
+        -- file_id, выданный Telegram после первой отправки фото
+        CREATE TABLE IF NOT EXISTS photo_file_ids (
+            photo_url TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL
+        );
+    """),
+    (5, "notification outbox", """
+        -- Уведомления о матчах и пересылаемые сообщения: доставляются фоновым диспетчером
+        CREATE TABLE IF NOT EXISTS outbox (
+            id BIGSERIAL PRIMARY KEY,
+            chat_id BIGINT NOT NULL,
+            kind VARCHAR(20) NOT NULL,
+            payload JSONB NOT NULL,
+            dedup_key TEXT UNIQUE,
+            status VARCHAR(10) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            available_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            sent_at TIMESTAMPTZ
+        );
+        CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (available_at, id) WHERE status = 'pending';
+        CREATE INDEX IF NOT EXISTS idx_outbox_done ON outbox (created_at) WHERE status <> 'pending';
+        -- До какого момента уведомления о матчах в чат копятся в одно сообщение
+        CREATE UNLOGGED TABLE IF NOT EXISTS outbox_cooldowns (
+            chat_id BIGINT PRIMARY KEY,
+            until TIMESTAMPTZ NOT NULL
+        );
+    """),
+    (6, "recommendations", """
+        -- Рекомендации: заранее посчитанные кандидаты и очередь пересчёта
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS last_active TIMESTAMPTZ NOT NULL DEFAULT NOW();
+        CREATE TABLE IF NOT EXISTS recommendations (
+            user_id BIGINT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+            candidate_id BIGINT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+            score REAL NOT NULL,
+            PRIMARY KEY (user_id, candidate_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_recommendations_rank ON recommendations (user_id, score DESC, candidate_id DESC);
+        CREATE INDEX IF NOT EXISTS idx_recommendations_candidate ON recommendations (candidate_id);
+        CREATE TABLE IF NOT EXISTS recommendation_jobs (
+            user_id BIGINT PRIMARY KEY REFERENCES users (user_id) ON DELETE CASCADE,
+            due_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS idx_recommendation_jobs_due ON recommendation_jobs (due_at);
+
+        -- Смена профиля — пересчёт сразу; входящий лайк — с задержкой, чтобы не пересчитывать на каждый
+        CREATE OR REPLACE FUNCTION schedule_recommendations(target BIGINT, delay INTERVAL) RETURNS VOID AS $$
+            INSERT INTO recommendation_jobs (user_id, due_at) VALUES (target, NOW() + delay)
+            ON CONFLICT (user_id) DO UPDATE SET due_at = LEAST(recommendation_jobs.due_at, EXCLUDED.due_at);
+        $$ LANGUAGE sql;
+        CREATE OR REPLACE FUNCTION users_schedule_recommendations() RETURNS TRIGGER AS $$
+        BEGIN
+            PERFORM schedule_recommendations(NEW.user_id, INTERVAL '0');
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+        CREATE OR REPLACE FUNCTION likes_schedule_recommendations() RETURNS TRIGGER AS $$
+        BEGIN
+            PERFORM schedule_recommendations(NEW.likee, INTERVAL '5 minutes');
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS trg_users_recommendations ON users;
+        CREATE TRIGGER trg_users_recommendations AFTER INSERT OR UPDATE OF age, city, gender, interests, blocked ON users
+            FOR EACH ROW EXECUTE FUNCTION users_schedule_recommendations();
+        DROP TRIGGER IF EXISTS trg_likes_recommendations ON likes;
+        CREATE TRIGGER trg_likes_recommendations AFTER INSERT ON likes
+            FOR EACH ROW EXECUTE FUNCTION likes_schedule_recommendations();
+        -- Пользователи, зарегистрированные до появления рекомендаций, ставятся в очередь один раз
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM recommendation_jobs) THEN
+                INSERT INTO recommendation_jobs (user_id)
+                SELECT user_id FROM users WHERE blocked = FALSE
+                ON CONFLICT DO NOTHING;
+            END IF;
+        END $$;
+    """),
+    (7, "analytics counters", """
+        -- Аналитика: счётчики ведут триггеры и события сервисов, отчёт не сканирует таблицы данных.
+        -- Каждое соединение пишет в свой шард строки, чтобы параллельные транзакции не ждали друг друга.
+        CREATE TABLE IF NOT EXISTS stats_totals (
+            metric VARCHAR(30) NOT NULL,
+            dimension TEXT NOT NULL DEFAULT '',
+            shard SMALLINT NOT NULL DEFAULT 0,
+            value BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (metric, dimension, shard)
+        );
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            day DATE NOT NULL,
+            metric VARCHAR(30) NOT NULL,
+            shard SMALLINT NOT NULL DEFAULT 0,
+            value BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, metric, shard)
+        );
+        CREATE OR REPLACE FUNCTION stats_total_add(m TEXT, dim TEXT, delta BIGINT) RETURNS VOID AS $$
+            INSERT INTO stats_totals (metric, dimension, shard, value) VALUES (m, dim, pg_backend_pid() % 16, delta)
+            ON CONFLICT (metric, dimension, shard) DO UPDATE SET value = stats_totals.value + EXCLUDED.value;
+        $$ LANGUAGE sql;
+        CREATE OR REPLACE FUNCTION stats_daily_add(m TEXT, delta BIGINT) RETURNS VOID AS $$
+            INSERT INTO stats_daily (day, metric, shard, value)
+            VALUES ((NOW() AT TIME ZONE 'UTC')::date, m, pg_backend_pid() % 16, delta)
+            ON CONFLICT (day, metric, shard) DO UPDATE SET value = stats_daily.value + EXCLUDED.value;
+        $$ LANGUAGE sql;
+
+        -- Незаблокированные пользователи: всего, по городам и полам
+        CREATE OR REPLACE FUNCTION users_stats() RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP = 'UPDATE' AND OLD.city_norm = NEW.city_norm AND OLD.gender = NEW.gender
+                    AND OLD.blocked IS NOT DISTINCT FROM NEW.blocked THEN
+                RETURN NULL;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.blocked IS FALSE THEN
+                PERFORM stats_total_add('users', '', -1);
+                PERFORM stats_total_add('users', 'city:' || OLD.city_norm, -1);
+                PERFORM stats_total_add('users', 'gender:' || OLD.gender, -1);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.blocked IS FALSE THEN
+                PERFORM stats_total_add('users', '', 1);
+                PERFORM stats_total_add('users', 'city:' || NEW.city_norm, 1);
+                PERFORM stats_total_add('users', 'gender:' || NEW.gender, 1);
+            END IF;
+            IF TG_OP = 'INSERT' THEN
+                PERFORM stats_daily_add('signups', 1);
+                PERFORM stats_daily_add('active_users', 1);
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+        -- Активный за день: last_active впервые перешёл на новую дату
+        CREATE OR REPLACE FUNCTION users_activity_stats() RETURNS TRIGGER AS $$
+        BEGIN
+            PERFORM stats_daily_add('active_users', 1);
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+        -- Лайки, матчи, сообщения чата: событие дня и общий итог
+        CREATE OR REPLACE FUNCTION events_stats() RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM stats_daily_add(TG_ARGV[0], 1);
+                PERFORM stats_total_add(TG_ARGV[0], '', 1);
+            ELSE
+                PERFORM stats_total_add(TG_ARGV[0], '', -1);
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS trg_users_stats ON users;
+        CREATE TRIGGER trg_users_stats AFTER INSERT OR DELETE OR UPDATE OF city, gender, blocked ON users
+            FOR EACH ROW EXECUTE FUNCTION users_stats();
+        DROP TRIGGER IF EXISTS trg_users_activity_stats ON users;
+        CREATE TRIGGER trg_users_activity_stats AFTER UPDATE OF last_active ON users
+            FOR EACH ROW WHEN ((OLD.last_active AT TIME ZONE 'UTC')::date < (NEW.last_active AT TIME ZONE 'UTC')::date)
+            EXECUTE FUNCTION users_activity_stats();
+        DROP TRIGGER IF EXISTS trg_likes_stats ON likes;
+        CREATE TRIGGER trg_likes_stats AFTER INSERT OR DELETE ON likes
+            FOR EACH ROW EXECUTE FUNCTION events_stats('likes');
+        DROP TRIGGER IF EXISTS trg_matches_stats ON matches;
+        CREATE TRIGGER trg_matches_stats AFTER INSERT OR DELETE ON matches
+            FOR EACH ROW EXECUTE FUNCTION events_stats('matches');
+        DROP TRIGGER IF EXISTS trg_outbox_stats ON outbox;
+        CREATE TRIGGER trg_outbox_stats AFTER INSERT ON outbox
+            FOR EACH ROW WHEN (NEW.kind = 'message') EXECUTE FUNCTION events_stats('messages');
+
+        -- Начальные значения из уже накопленных данных. CREATE TRIGGER держит блокировку таблиц
+        -- до конца транзакции, поэтому между подсчётом и включением триггеров записи не теряются.
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM stats_totals) THEN
+                INSERT INTO stats_totals (metric, dimension, value)
+                SELECT 'users', '', COUNT(*) FROM users WHERE blocked = FALSE
+                UNION ALL SELECT 'users', 'city:' || city_norm, COUNT(*) FROM users WHERE blocked = FALSE GROUP BY city_norm
+                UNION ALL SELECT 'users', 'gender:' || gender, COUNT(*) FROM users WHERE blocked = FALSE GROUP BY gender
+                UNION ALL SELECT 'likes', '', COUNT(*) FROM likes
+                UNION ALL SELECT 'matches', '', COUNT(*) FROM matches
+                UNION ALL SELECT 'messages', '', COUNT(*) FROM outbox WHERE kind = 'message';
+                INSERT INTO stats_daily (day, metric, value)
+                SELECT (ts AT TIME ZONE 'UTC')::date, 'likes', COUNT(*) FROM likes GROUP BY 1
+                UNION ALL SELECT (ts AT TIME ZONE 'UTC')::date, 'matches', COUNT(*) FROM matches GROUP BY 1
+                UNION ALL SELECT (created_at AT TIME ZONE 'UTC')::date, 'messages', COUNT(*) FROM outbox
+                    WHERE kind = 'message' GROUP BY 1;
+            END IF;
+        END $$;
+    """),
+    (8, "user activity", """
+        -- Время последней активности — в отдельной узкой таблице: частые отметки не переписывают
+        -- широкие строки users и не плодят новые версии во всех её индексах
+        CREATE TABLE IF NOT EXISTS user_activity (
+            user_id BIGINT PRIMARY KEY REFERENCES users (user_id) ON DELETE CASCADE,
+            last_active TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS idx_user_activity_recent ON user_activity (last_active DESC);
+        INSERT INTO user_activity (user_id, last_active)
+        SELECT user_id, last_active FROM users
+        ON CONFLICT (user_id) DO NOTHING;
+
+        -- Активный за день: первая отметка пользователя или первая за новую дату (UTC)
+        DROP TRIGGER IF EXISTS trg_users_activity_stats ON users;
+        DROP TRIGGER IF EXISTS trg_user_activity_insert_stats ON user_activity;
+        CREATE TRIGGER trg_user_activity_insert_stats AFTER INSERT ON user_activity
+            FOR EACH ROW EXECUTE FUNCTION users_activity_stats();
+        DROP TRIGGER IF EXISTS trg_user_activity_stats ON user_activity;
+        CREATE TRIGGER trg_user_activity_stats AFTER UPDATE OF last_active ON user_activity
+            FOR EACH ROW WHEN ((OLD.last_active AT TIME ZONE 'UTC')::date < (NEW.last_active AT TIME ZONE 'UTC')::date)
+            EXECUTE FUNCTION users_activity_stats();
+        CREATE OR REPLACE FUNCTION users_stats() RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP = 'UPDATE' AND OLD.city_norm = NEW.city_norm AND OLD.gender = NEW.gender
+                    AND OLD.blocked IS NOT DISTINCT FROM NEW.blocked THEN
+                RETURN NULL;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.blocked IS FALSE THEN
+                PERFORM stats_total_add('users', '', -1);
+                PERFORM stats_total_add('users', 'city:' || OLD.city_norm, -1);
+                PERFORM stats_total_add('users', 'gender:' || OLD.gender, -1);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.blocked IS FALSE THEN
+                PERFORM stats_total_add('users', '', 1);
+                PERFORM stats_total_add('users', 'city:' || NEW.city_norm, 1);
+                PERFORM stats_total_add('users', 'gender:' || NEW.gender, 1);
+            END IF;
+            IF TG_OP = 'INSERT' THEN
+                PERFORM stats_daily_add('signups', 1);
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+        ALTER TABLE users DROP COLUMN IF EXISTS last_active;
+    """),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+async def applied_migrations(conn):
+    if await conn.fetchval("SELECT to_regclass('schema_migrations')") is None:
+        return set()
+    return {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+
+async def init_db(db):
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                nickname VARCHAR(50) NOT NULL,
-                age INTEGER NOT NULL CHECK (age >= 18),
-                country VARCHAR(100) NOT NULL,
-                city VARCHAR(100) NOT NULL,
-                gender VARCHAR(20) NOT NULL,
-                interests TEXT[] NOT NULL,
-                photo_url TEXT,
-                coins INTEGER DEFAULT 10,
-                blocked BOOLEAN DEFAULT FALSE,
-                likes BIGINT[] DEFAULT '{}',
-                matches BIGINT[] DEFAULT '{}'
-            );
-            CREATE INDEX IF NOT EXISTS idx_users_city ON users (city);
-            CREATE INDEX IF NOT EXISTS idx_users_gender ON users (gender);
-        """)
-        await conn.close()
-        logger.info("Database initialized successfully")
+        async with db.acquire() as conn:
+            # Схема актуальна — обходимся без блокировки и DDL
+            applied = await applied_migrations(conn)
+            if all(version in applied for version, _, _ in MIGRATIONS):
+                logger.info(f"Database schema is up to date (version {SCHEMA_VERSION})")
+                return
+            async with conn.transaction():
+                # Несколько воркеров стартуют одновременно — миграции выполняет один
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", LOCK_MIGRATIONS)
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                    )
+                """)
+                applied = await applied_migrations(conn)
+                for version, name, sql in MIGRATIONS:
+                    if version in applied:
+                        continue
+                    started = time.perf_counter()
+                    await conn.execute(sql)
+                    await conn.execute("INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", version, name)
+                    logger.info(f"Applied migration {version} ({name}) in {time.perf_counter() - started:.2f}s")
+        logger.info(f"Database initialized successfully (version {SCHEMA_VERSION})")
     except Exception as e:
         logger.error(f"Database initialization failed: {e}")
         raise
 
+async def _main():
+    db = Database(health_check_interval=0)
+    await db.connect()
+    try:
+        await init_db(db)
+    finally:
+        await db.close()
+
 if __name__ == "__main__":
-    asyncio.run(init_db())
+    asyncio.run(_main())
@@ -1,26 +1,78 @@
 import asyncio
 import logging
+import time
+from contextlib import contextmanager
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import BotCommand
 from aiohttp import web
-from config import BOT_TOKEN, WEBAPP_URL
+from config import (BOT_TOKEN, WEBAPP_URL, WEB_WORKERS, STATE_BACKEND, REDIS_URL, TELEGRAM_API_URL, WEB_KEEPALIVE_TIMEOUT, STATIC_IN_MEMORY,
+                    WEBHOOK_DRAIN_TIMEOUT)
 from handlers.user import router as user_router
 from handlers.admin import router as admin_router
 from middleware.throttling import ThrottlingMiddleware
 from middleware.dispatcher import DispatcherMiddleware
+from middleware.instrumentation import InstrumentationMiddleware
+from middleware.activity import ActivityMiddleware
+from metrics import REGISTRY, register_gauge
 from init_db import init_db
+from db import Database, LOCK_WEBHOOK
+from webhook import UpdateQueue, UpdateRouter
+from api import setup_api
+from assets import AssetBundle
+from services.user_manager import UserManager, USER_BY_ID_QUERY
+from services.matching import MatchingService, RECOMMENDED_QUERY
+from services.recommendations import RecommendationService
+from services.coins import CoinsService
+from services.quiz import QuizService
+from services.cache import create_kv
+from services.broadcast import BroadcastService
+from services.state import PostgresStorage
+from services.photos import PhotoStore
+from services.chat import ChatService
+from services.analytics import AnalyticsService
+import multiprocessing
 import os
+import signal
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+BOT_COMMANDS = [
+    BotCommand(command="/start", description="Start the bot"),
+    BotCommand(command="/admin", description="Admin panel (for admins only)"),
+]
+
+class StartupTimer:
+    """Wall time of each startup phase, logged as it finishes."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+            logger.info(f"Startup phase '{name}' took {self.phases[name]:.3f}s")
+
+    def summary(self):
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+        return f"{time.perf_counter() - self.started:.2f}s ({phases})"
+
 async def set_commands(bot: Bot):
-    commands = [
-        BotCommand(command="/start", description="Start the bot"),
-        BotCommand(command="/admin", description="Admin panel (for admins only)"),
-    ]
-    await bot.set_my_commands(commands)
+    # Telegram возвращает команды без «/»; при совпадении повторный вызов не нужен
+    current = [(c.command.lstrip("/"), c.description) for c in await bot.get_my_commands()]
+    if current == [(c.command.lstrip("/"), c.description) for c in BOT_COMMANDS]:
+        logger.info("Bot commands are up to date")
+        return
+    await bot.set_my_commands(BOT_COMMANDS)
+    logger.info("Bot commands updated")
 
 async def handle_webapp(request):
     try:
@@ -37,58 +89,282 @@ async def handle_root(request):
     logger.info("Root route accessed, returning 404")
     raise web.HTTPNotFound(text="Not found")
 
+async def handle_health(request):
+    # Балансировщик переключает трафик на воркер только после прогрева и снимает при остановке
+    if request.app['state'] != 'ready':
+        return web.Response(status=503, text=request.app['state'])
+    return web.Response(text="ok")
+
 async def handle_webhook(request):
+    # Отвечаем Telegram сразу, обработка идёт в фоне через очередь
+    if request.app['state'] == 'draining':
+        # Telegram повторит доставку — её примет уже новый экземпляр
+        return web.Response(status=503)
     try:
         update = await request.json()
-        dp = request.app['dispatcher']
-        bot = request.app['bot']
-        await dp.feed_raw_update(bot, update)
-        return web.Response(status=200)
+        if not isinstance(update, dict):
+            raise ValueError("update is not an object")
     except Exception as e:
-        logger.error(f"Error processing webhook: {e}")
-        return web.Response(status=500)
+        logger.error(f"Invalid webhook payload: {e}")
+        return web.Response(status=200)
+    router = request.app.get('router')
+    if router:
+        return web.Response(status=await router.route(update))
+    if not await request.app['updates'].put(update):
+        return web.Response(status=503)
+    return web.Response(status=200)
+
+async def handle_metrics(request):
+    return web.Response(body=REGISTRY.render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
 
-async def start_web_server(bot: Bot, dp: Dispatcher):
+def register_runtime_gauges(db, updates, user_manager, matching, chat=None):
+    register_gauge("bot_db_pool_size", "Open connections in the DB pool", lambda: {(): db.pool.get_size() if db.pool else 0})
+    register_gauge("bot_db_pool_idle", "Idle connections in the DB pool", lambda: {(): db.pool.get_idle_size() if db.pool else 0})
+    register_gauge("bot_update_queue_depth", "Webhook updates waiting for a worker", lambda: {(): updates.depth})
+    register_gauge("bot_update_queue_events", "Webhook queue counters", lambda: {
+        (name,): value for name, value in updates.stats().items() if name not in ("depth", "avg_wait_time", "avg_processing_time")
+    }, ("event",))
+    register_gauge("bot_user_cache", "User profile cache counters", lambda: {
+        (name,): value for name, value in user_manager.cache.stats().items()
+    }, ("stat",))
+    register_gauge("bot_candidate_queues", "Users with a prefetched swipe queue", lambda: {(): matching.queued_users})
+    if matching.recommendations:
+        register_gauge("bot_recommendations_computed", "Users whose recommendations were recomputed by this process",
+                       lambda: {(): matching.recommendations.computed})
+    if chat:
+        register_gauge("bot_notifications", "Outbox messages handled by this process", lambda: {
+            ("sent",): chat.sent, ("failed",): chat.failed,
+        }, ("outcome",))
+
+async def start_web_server(bot: Bot, dp: Dispatcher, user_manager: UserManager, matching: MatchingService, photos: PhotoStore,
+                           worker_id=0, workers=1):
     app = web.Application()
     app['bot'] = bot
     app['dispatcher'] = dp
-    app.router.add_get('/webapp', handle_webapp)
+    app['state'] = 'starting'
+    app['updates'] = UpdateQueue(dp, bot)
+    app['updates'].start()
+    if workers > 1:
+        # Порядок и дедупликация апдейтов чата держатся в одном процессе — его воркере
+        app['router'] = UpdateRouter(app, worker_id, workers)
+        await app['router'].start()
     app.router.add_get('/', handle_root)
     app.router.add_post('/webhook', handle_webhook)
-    app.router.add_static('/webapp/static/', path='webapp/static/', name='static')
+    app.router.add_get('/metrics', handle_metrics)
+    app.router.add_get('/health', handle_health)
+    setup_api(app, user_manager, matching, photos, activity=matching.recommendations)
+    if STATIC_IN_MEMORY:
+        assets = AssetBundle(exclude=(os.path.relpath(photos.directory, 'webapp/static'),)).build()
+        for path in ('/webapp', '/webapp/', '/webapp/index.html'):
+            app.router.add_get(path, assets.handle_index)
+        app.router.add_static('/webapp/static/uploads/', path=photos.directory, name='uploads')
+        app.router.add_get('/webapp/static/{path:.*}', assets.handle_static, name='static')
+    else:
+        for path in ('/webapp', '/webapp/', '/webapp/index.html'):
+            app.router.add_get(path, handle_webapp)
+        app.router.add_static('/webapp/static/', path='webapp/static/', name='static')
     port = int(os.getenv("PORT", 10000))
-    runner = web.AppRunner(app)
+    # Mini App держит соединение между запросами к API, Telegram — между вебхуками
+    runner = web.AppRunner(app, keepalive_timeout=WEB_KEEPALIVE_TIMEOUT)
     await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', port)
+    # Несколько воркеров слушают один порт, ядро распределяет соединения
+    site = web.TCPSite(runner, '0.0.0.0', port, reuse_port=workers > 1)
     await site.start()
     logger.info(f"Web server started on port {port}")
+    return runner
+
+async def register_webhook(bot: Bot, db: Database):
+    # Регистрирует вебхук только один воркер/узел
+    async with db.acquire() as conn:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", LOCK_WEBHOOK):
+            logger.info("Webhook registration is handled by another instance")
+            return
+        try:
+            webhook_url = f"{WEBAPP_URL}/webhook".replace('/webapp', '')
+            info, _ = await asyncio.gather(bot.get_webhook_info(), set_commands(bot))
+            if info.url == webhook_url:
+                logger.info(f"Webhook already set to {webhook_url}")
+            else:
+                await bot.set_webhook(webhook_url)
+                logger.info(f"Webhook set to {webhook_url}")
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", LOCK_WEBHOOK)
+
+def create_bot():
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+    return Bot(token=BOT_TOKEN, parse_mode="HTML", session=session)
 
-    # Устанавливаем Webhook
-    webhook_url = f"{WEBAPP_URL}/webhook".replace('/webapp', '')
-    await bot.set_webhook(webhook_url)
-    logger.info(f"Webhook set to {webhook_url}")
+def create_storage(db):
+    if STATE_BACKEND == "postgres":
+        return PostgresStorage(db)
+    if STATE_BACKEND == "redis" and REDIS_URL and REDIS_URL != "memory://":
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+            return RedisStorage.from_url(REDIS_URL)
+        except ImportError:
+            logger.warning("redis package is not installed, falling back to MemoryStorage")
+    return MemoryStorage()
 
-async def main():
+async def shutdown_step(name, step):
+    """Await one shutdown step; errors are logged so the remaining steps still run."""
     try:
-        # Инициализация базы данных
-        await init_db()
-        logger.info("Database initialization attempted")
-
-        # Запуск бота
-        bot = Bot(token=BOT_TOKEN, parse_mode="HTML")
-        dp = Dispatcher(storage=MemoryStorage())
-        dp.message.middleware(DispatcherMiddleware(dp))
-        dp.message.middleware(ThrottlingMiddleware(limit=2.0))
-        dp.include_routers(user_router, admin_router)
-        
-        await set_commands(bot)
-        logger.info("Bot is starting...")
-
-        # Запускаем веб-сервер
-        await start_web_server(bot, dp)
+        await step
+    except Exception as e:
+        logger.error(f"Error stopping {name}: {e}")
+
+async def stop_web_server(runner):
+    # Новые вебхуки отклоняем, принятые дообрабатываем, затем закрываем сокет
+    runner.app['state'] = 'draining'
+    await shutdown_step("update queue", runner.app['updates'].stop(WEBHOOK_DRAIN_TIMEOUT))
+    await shutdown_step("web server", runner.cleanup())
+    if 'router' in runner.app:
+        await shutdown_step("update router", runner.app['router'].stop())
+
+def setup_dispatcher(dp: Dispatcher, kv=None, throttling=True, **services):
+    """Middlewares and routers shared by the bot and the benchmark harness."""
+    middleware = DispatcherMiddleware(dp, **services)
+    dp.message.middleware(middleware)
+    dp.callback_query.middleware(middleware)
+    # Активность — по любому апдейту пользователя, не только по ленте
+    recommendations = getattr(services.get("matching"), "recommendations", None)
+    if recommendations:
+        dp.message.middleware(ActivityMiddleware(recommendations))
+        dp.callback_query.middleware(ActivityMiddleware(recommendations))
+    if throttling:
+        dp.message.middleware(ThrottlingMiddleware(rate=0.5, burst=2, kv=kv))
+        dp.callback_query.middleware(ThrottlingMiddleware(rate=1.0, burst=4, kv=kv))
+    dp.message.middleware(InstrumentationMiddleware())
+    dp.callback_query.middleware(InstrumentationMiddleware())
+    dp.include_routers(user_router, admin_router)
+
+async def main(worker_id=0):
+    db = Database()
+    kv = None
+    bot = None
+    broadcasts = None
+    coins = None
+    quiz = None
+    photos = None
+    recommendations = None
+    chat = None
+    analytics = None
+    runner = None
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    timer = StartupTimer()
+    try:
+        with timer.phase("database"):
+            await db.connect()
+        with timer.phase("migrations"):
+            await init_db(db)
+
+        with timer.phase("services"):
+            bot = create_bot()
+            dp = Dispatcher(storage=create_storage(db))
+            kv = create_kv(db=db)
+            user_manager = UserManager(db, kv=kv if STATE_BACKEND == "redis" else None)
+            if WEB_WORKERS > 1 or STATE_BACKEND != "memory":
+                await user_manager.enable_shared_invalidation()
+            if WEB_WORKERS > 1 and STATE_BACKEND == "memory":
+                logger.warning("FSM and throttling state is per process, set STATE_BACKEND=postgres or redis")
+            broadcasts = BroadcastService(db, bot)
+            recommendations = RecommendationService(db, user_manager, MatchingService.get_gender_filter)
+            recommendations.start()
+            matching = MatchingService(db, recommendations=recommendations)
+            coins = CoinsService(db, user_manager)
+            coins.start()
+            quiz = QuizService()
+            quiz.start()
+            photos = PhotoStore(db)
+            chat = ChatService(db, bot)
+            await chat.start()
+            analytics = AnalyticsService(db)
+            analytics.start()
+            setup_dispatcher(
+                dp,
+                kv=kv,
+                db=db,
+                user_manager=user_manager,
+                matching=matching,
+                coins=coins,
+                quiz=quiz,
+                photos=photos,
+                chat=chat,
+                analytics=analytics,
+                broadcasts=broadcasts,
+            )
+
+        # Сокет слушает сразу, но /health отвечает 503, пока воркер не прогрет
+        with timer.phase("web server"):
+            runner = await start_web_server(bot, dp, user_manager, matching, photos, worker_id, WEB_WORKERS)
+            register_runtime_gauges(db, runner.app['updates'], user_manager, matching, chat)
+        with timer.phase("warm-up"):
+            await asyncio.gather(
+                db.warm_up([(USER_BY_ID_QUERY, (0,)), (RECOMMENDED_QUERY, (0, 0.0, 0, 1))]),
+                user_manager.warm_cache(),
+            )
+        runner.app['state'] = 'ready'
+        with timer.phase("webhook"):
+            await register_webhook(bot, db)
+        await broadcasts.resume()
+        register_gauge("bot_startup_seconds", "Duration of each startup phase", lambda: {
+            (name,): seconds for name, seconds in timer.phases.items()
+        }, ("phase",))
+        logger.info(f"Bot worker {worker_id} started in {timer.summary()}")
+        await stop.wait()
+        logger.info(f"Bot worker {worker_id} is shutting down")
     except Exception as e:
         logger.error(f"Bot or web server failed to start: {e}")
         raise
+    finally:
+        # Каждый шаг сам по себе: сбой одного сервиса не оставляет открытыми остальные и пул базы
+        if broadcasts:
+            await shutdown_step("broadcasts", broadcasts.stop())
+        if runner:
+            await stop_web_server(runner)
+        if quiz:
+            await shutdown_step("quiz", quiz.stop())
+        if chat:
+            await shutdown_step("chat", chat.stop())
+        if photos:
+            await shutdown_step("photos", photos.stop())
+        if recommendations:
+            await shutdown_step("recommendations", recommendations.stop())
+        if coins:
+            await shutdown_step("coins", coins.stop())
+        if analytics:
+            await shutdown_step("analytics", analytics.stop())
+        if bot:
+            await shutdown_step("bot session", bot.session.close())
+        if kv:
+            await shutdown_step("key-value store", kv.close())
+        await shutdown_step("database", db.close())
+
+def run_worker(worker_id):
+    asyncio.run(main(worker_id))
+
+def run():
+    if WEB_WORKERS <= 1:
+        asyncio.run(main())
+        return
+    # Pre-fork: N процессов с общим портом (SO_REUSEPORT), мастер только следит за ними
+    workers = [multiprocessing.Process(target=run_worker, args=(i,), name=f"worker-{i}") for i in range(WEB_WORKERS)]
+    for worker in workers:
+        worker.start()
+    logger.info(f"Started {WEB_WORKERS} workers")
+
+    def forward(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for worker in workers:
+        worker.join()
+        logger.info(f"{worker.name} exited with code {worker.exitcode}")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run()
@@ -0,0 +1,162 @@
+import bisect
+import contextvars
+import functools
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, amount=1, labels=()):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def total(self):
+        return sum(self._values.values())
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+class Gauge:
+    """Gauge whose samples are read from a callback at scrape time."""
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.callback = callback
+        self._values = {}
+
+    def set(self, value, labels=()):
+        self._values[labels] = value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        samples = dict(self._values)
+        if self.callback is not None:
+            try:
+                samples.update(self.callback())
+            except Exception as e:
+                logger.error(f"Error collecting gauge {self.name}: {e}")
+        for labels, value in samples.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, labels=()):
+        series = self._series.get(labels)
+        if series is None:
+            # [счётчики по бакетам..., +Inf, sum]
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def counts(self):
+        """Observations so far per label tuple."""
+        return {labels: sum(series[:-1]) for labels, series in self._series.items()}
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-1]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.register(Histogram(
+    "bot_handler_latency_seconds", "Time spent in update handlers", ("router", "handler", "prefix")))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    "bot_handler_errors_total", "Handlers that raised", ("router", "handler")))
+# Время от выдачи соединения из пула до возврата, а не время запросов: туда входят
+# несколько запросов и всё, что метод делал, пока держал соединение
+DB_CONNECTION_HOLD = REGISTRY.register(Histogram(
+    "bot_db_connection_hold_seconds", "Time a service method held a DB connection (per checkout)", ("method",)))
+DB_POOL_WAIT = REGISTRY.register(Histogram(
+    "bot_db_pool_wait_seconds", "Time spent waiting for a pool connection", ("method",)))
+THROTTLE_REJECTIONS = REGISTRY.register(Counter(
+    "bot_throttle_rejections_total", "Updates dropped by the rate limiter", ("event", "key")))
+
+# Имя метода сервиса, от имени которого сейчас берётся соединение из пула
+current_db_method = contextvars.ContextVar("current_db_method", default="other")
+
+def db_method(func):
+    """Label pool checkouts made inside an async service method with ClassName.method."""
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = current_db_method.set(name)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            current_db_method.reset(token)
+    return wrapper
+
+class TimedAcquire:
+    """Async context manager around pool.acquire() that records wait and hold time."""
+
+    __slots__ = ("_acquire", "_method", "_acquired_at")
+
+    def __init__(self, acquire):
+        self._acquire = acquire
+        self._method = current_db_method.get()
+
+    async def __aenter__(self):
+        started = time.perf_counter()
+        conn = await self._acquire.__aenter__()
+        self._acquired_at = time.perf_counter()
+        DB_POOL_WAIT.observe(self._acquired_at - started, (self._method,))
+        return conn
+
+    async def __aexit__(self, *exc):
+        DB_CONNECTION_HOLD.observe(time.perf_counter() - self._acquired_at, (self._method,))
+        return await self._acquire.__aexit__(*exc)
+
+def register_gauge(name, documentation, callback, labelnames=()):
+    """Expose values computed at scrape time; callback returns {label_values_tuple: value}."""
+    return REGISTRY.register(Gauge(name, documentation, labelnames, callback))
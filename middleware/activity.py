@@ -0,0 +1,20 @@
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+class ActivityMiddleware(BaseMiddleware):
+    """Marks the sender of every message and callback as active.
+
+    Registered ahead of throttling, so a user who is being rate limited still
+    counts as active. The tracker only buffers ids in memory
+    (RecommendationService.touch); they are written in one batch per tick.
+    """
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+        super().__init__()
+
+    async def __call__(self, handler, event: TelegramObject, data: dict):
+        user = getattr(event, "from_user", None)
+        if user:
+            self.tracker.touch(user.id)
+        return await handler(event, data)
@@ -2,10 +2,12 @@ from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
 
 class DispatcherMiddleware(BaseMiddleware):
-    def __init__(self, dp):
+    def __init__(self, dp, **services):
         self.dp = dp
+        self.services = services
         super().__init__()
 
     async def __call__(self, handler, event: TelegramObject, data: dict):
         data["dp"] = self.dp
+        data.update(self.services)
         return await handler(event, data)
@@ -0,0 +1,42 @@
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, CallbackQuery, Message
+from metrics import HANDLER_LATENCY, HANDLER_ERRORS
+import re
+import time
+
+# like_123 -> like, quiz_0_2 -> quiz: метки без пользовательских id
+ID_SUFFIX = re.compile(r"(_-?\d+)+$")
+
+# callback_data и команды из handlers/; всё остальное присылает клиент как угодно,
+# поэтому идёт в метку "other" — число серий гистограммы ограничено
+KNOWN_PREFIXES = frozenset({
+    "/start", "/admin", "/stop",
+    "view_profile", "find_users", "like", "play_quiz", "quiz", "chat",
+    "admin_stats", "admin_ban", "admin_broadcast", "admin_broadcast_status",
+})
+
+def get_prefix(event: TelegramObject):
+    if isinstance(event, CallbackQuery):
+        prefix = ID_SUFFIX.sub("", event.data or "")
+    elif isinstance(event, Message) and event.text and event.text.startswith("/"):
+        prefix = event.text.split()[0].split("@")[0]
+    else:
+        return "message"
+    return prefix if prefix in KNOWN_PREFIXES else "other"
+
+class InstrumentationMiddleware(BaseMiddleware):
+    """Records handler latency by router, handler and callback_data/command prefix."""
+
+    async def __call__(self, handler, event: TelegramObject, data: dict):
+        handler_object = data.get("handler")
+        callback = getattr(handler_object, "callback", None)
+        router = getattr(callback, "__module__", "unknown").rsplit(".", 1)[-1]
+        name = getattr(callback, "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(labels=(router, name))
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, (router, name, get_prefix(event)))
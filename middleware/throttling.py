@@ -1,23 +1,95 @@
 from aiogram import BaseMiddleware
-from aiogram.types import TelegramObject
-import asyncio
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import TelegramObject, CallbackQuery
+from collections import OrderedDict
+from metrics import THROTTLE_REJECTIONS
+import time
 import logging
 
 logger = logging.getLogger(__name__)
 
+class LocalTokenBuckets:
+    """Token buckets kept in process memory.
+
+    Entries are ordered by last use. A bucket that has been idle long enough to
+    refill completely carries no state, so those are evicted from the front of
+    the map on every call; max_entries is a hard cap on top of that.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+
+    async def consume(self, key, rate, burst):
+        now = time.monotonic()
+        self._evict(now)
+        tokens, last, _ = self._buckets.pop(key, (burst, now, 0))
+        tokens = min(burst, tokens + (now - last) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now, burst / rate)
+        return allowed
+
+    def _evict(self, now):
+        while self._buckets:
+            key, (tokens, last, refill_time) = next(iter(self._buckets.items()))
+            if now - last < refill_time and len(self._buckets) < self.max_entries:
+                break
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+class SharedTokenBuckets:
+    """Limits shared between worker processes through a Redis-compatible store.
+
+    Uses an atomic INCR per fixed window of burst / rate seconds, which allows
+    the same burst and sustained rate as the local token bucket.
+    """
+
+    def __init__(self, kv, prefix="throttle"):
+        self.kv = kv
+        self.prefix = prefix
+
+    async def consume(self, key, rate, burst):
+        window = burst / rate
+        slot = int(time.time() // window)
+        redis_key = f"{self.prefix}:{key}:{slot}"
+        count = await self.kv.incrby(redis_key, 1)
+        if count == 1:
+            await self.kv.expire(redis_key, max(1, int(window) + 1))
+        return count <= burst
+
 class ThrottlingMiddleware(BaseMiddleware):
-    def __init__(self, limit: float):
-        self.limit = limit
-        self.last_call = {}
+    """Per-user token-bucket rate limiter.
+
+    Handlers can override the defaults with a flag, e.g.
+    ``flags={"rate_limit": {"key": "swipe", "rate": 2, "burst": 5}}``.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, kv=None, max_entries: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = SharedTokenBuckets(kv) if kv is not None else LocalTokenBuckets(max_entries)
         super().__init__()
 
     async def __call__(self, handler, event: TelegramObject, data: dict):
-        user_id = event.from_user.id if hasattr(event, "from_user") else None
-        if user_id:
-            current_time = asyncio.get_event_loop().time()
-            last = self.last_call.get(user_id, 0)
-            if current_time - last < self.limit:
-                logger.warning(f"Throttling user {user_id}")
+        user = getattr(event, "from_user", None)
+        if user:
+            options = get_flag(data, "rate_limit") or {}
+            # Тип апдейта в ключе: у сообщений и колбэков свои лимиты, и в общем хранилище тоже
+            key = f"{type(event).__name__}:{options.get('key', 'default')}:{user.id}"
+            try:
+                allowed = await self.buckets.consume(key, options.get("rate", self.rate), options.get("burst", self.burst))
+            except Exception as e:
+                # Общее хранилище недоступно — лучше пропустить апдейт, чем не ответить никому
+                logger.error(f"Error checking rate limit for user {user.id}: {e}")
+                allowed = True
+            if not allowed:
+                THROTTLE_REJECTIONS.inc(labels=(type(event).__name__, options.get("key", "default")))
+                logger.warning(f"Throttling user {user.id}")
+                if isinstance(event, CallbackQuery):
+                    await event.answer("Too many requests, slow down.")
                 return
-            self.last_call[user_id] = current_time
         return await handler(event, data)
@@ -1,6 +1,6 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 
-@dataclass
+@dataclass(slots=True)
 class User:
     user_id: int
     nickname: str
@@ -12,5 +12,9 @@ class User:
     photo_url: str = None
     coins: int = 10
     blocked: bool = False
-    likes: list = None
-    matches: list = None
+
+    @classmethod
+    def from_record(cls, row):
+        """Build a User from a DB row, ignoring columns the model doesn't know about."""
+        names = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in row.items() if k in names})
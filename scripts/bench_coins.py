@@ -0,0 +1,106 @@
+"""Benchmark: coin credits/sec, one UPDATE per reward vs batched ledger flushes.
+
+Creates a set of throwaway users, then credits them N times concurrently
+twice: first with a single-row UPDATE per reward (the old users.coins
+approach, run against coin_balances), then through CoinsService.credit_later
+with periodic batch flushes. Runs only against a dedicated --database;
+benchmark users get negative ids and are deleted afterwards, together with
+the analytics counters they moved (see bench_db.py).
+
+    python scripts/bench_coins.py --database postgres://.../bench --users 100 --credits 20000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_db import add_database_argument, check_database, snapshot_stats, restore_stats
+from db import Database
+from init_db import init_db
+from services.coins import CoinsService
+from services.user_manager import UserManager
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Отрицательные id Telegram не выдаёт: очистка не заденет настоящих пользователей
+USER_BASE = -9_000_000_000
+
+async def seed_users(db, count):
+    user_ids = list(range(USER_BASE, USER_BASE + count))
+    async with db.acquire() as conn:
+        await conn.execute("""
+            INSERT INTO users (user_id, nickname, age, country, city, gender, interests)
+            SELECT id, 'bench' || id, 25, 'Bench', 'Bench', 'Male', ARRAY['Bench']
+            FROM unnest($1::bigint[]) AS id
+            ON CONFLICT (user_id) DO NOTHING
+        """, user_ids)
+        await conn.execute("""
+            INSERT INTO coin_balances (user_id, balance) SELECT id, 0 FROM unnest($1::bigint[]) AS id
+            ON CONFLICT (user_id) DO NOTHING
+        """, user_ids)
+    return user_ids
+
+async def drop_users(db, user_ids):
+    async with db.acquire() as conn:
+        await conn.execute("DELETE FROM users WHERE user_id = ANY($1::bigint[])", user_ids)
+
+async def bench_per_call(db, user_ids, credits):
+    async def credit(i):
+        async with db.acquire() as conn:
+            await conn.execute("UPDATE coin_balances SET balance = balance + 1 WHERE user_id = $1",
+                               user_ids[i % len(user_ids)])
+    started = time.perf_counter()
+    await asyncio.gather(*(credit(i) for i in range(credits)))
+    return credits / (time.perf_counter() - started)
+
+async def bench_batched(db, user_ids, credits, flush_size):
+    # С UserManager, как в боте: сброс кэша профилей входит в стоимость записи
+    user_manager = UserManager(db)
+    await user_manager.enable_shared_invalidation()
+    coins = CoinsService(db, user_manager, flush_interval=0.05, flush_size=flush_size)
+    coins.start()
+    started = time.perf_counter()
+    for i in range(credits):
+        coins.credit_later(user_ids[i % len(user_ids)], 1, reason="bench", idempotency_key=f"bench:{started}:{i}")
+        if i % flush_size == 0:
+            # Даём циклу сброса шанс сработать, как при реальном потоке апдейтов
+            await asyncio.sleep(0)
+    await coins.stop()
+    return credits / (time.perf_counter() - started)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_argument(parser)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--credits", type=int, default=20000)
+    parser.add_argument("--flush-size", type=int, default=200)
+    args = parser.parse_args()
+    check_database(parser, args)
+
+    db = Database(dsn=args.database, health_check_interval=0)
+    await db.connect()
+    try:
+        await init_db(db)
+        async with db.acquire() as conn:
+            stats_before = await snapshot_stats(conn)
+        user_ids = await seed_users(db, args.users)
+        try:
+            per_call = await bench_per_call(db, user_ids, args.credits)
+            batched = await bench_batched(db, user_ids, args.credits, args.flush_size)
+        finally:
+            await drop_users(db, user_ids)
+            async with db.acquire() as conn:
+                await restore_stats(conn, stats_before)
+    finally:
+        await db.close()
+    logger.info(f"per-call UPDATE:  {per_call:10.0f} credits/sec")
+    logger.info(f"batched ledger:   {batched:10.0f} credits/sec ({batched / per_call:.1f}x)")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+"""Guard rails for benchmarks that write synthetic rows into Postgres.
+
+Benchmarks only run against a database passed explicitly with --database,
+never the DATABASE_URL loaded from the environment or .env. Synthetic users
+get negative ids, which Telegram never issues, so cleanup cannot touch a real
+account. Deleting the users reverses the stats_totals they moved, but not the
+per-day counters or service events (quiz plays), so analytics counters are
+snapshotted before the run and restored afterwards.
+"""
+from config import DATABASE_URL
+
+STATS_SNAPSHOT_QUERY = """
+    SELECT 'daily' AS kind, day::text AS key, metric, SUM(value) AS value FROM stats_daily GROUP BY day, metric
+    UNION ALL
+    SELECT 'total', dimension, metric, SUM(value) FROM stats_totals GROUP BY dimension, metric
+"""
+
+def add_database_argument(parser):
+    parser.add_argument("--database", required=True, metavar="DSN",
+                        help="dedicated benchmark database; synthetic rows are written to it")
+
+def check_database(parser, args):
+    """Exit if --database is the DATABASE_URL from the environment; call right after parse_args()."""
+    if DATABASE_URL and args.database == DATABASE_URL:
+        parser.error("--database is the DATABASE_URL from the environment, use a dedicated benchmark database")
+    return args.database
+
+async def snapshot_stats(conn):
+    return {(row["kind"], row["key"], row["metric"]): row["value"] for row in await conn.fetch(STATS_SNAPSHOT_QUERY)}
+
+async def restore_stats(conn, before):
+    """Subtract whatever the run added to the analytics counters since snapshot_stats()."""
+    after = await snapshot_stats(conn)
+    deltas = [(kind, key, metric, before.get((kind, key, metric), 0) - value)
+              for (kind, key, metric), value in after.items() if value != before.get((kind, key, metric), 0)]
+    daily = [(key, metric, delta) for kind, key, metric, delta in deltas if kind == "daily"]
+    totals = [(key, metric, delta) for kind, key, metric, delta in deltas if kind == "total"]
+    async with conn.transaction():
+        if daily:
+            await conn.execute("""
+                INSERT INTO stats_daily (day, metric, value)
+                SELECT d.day::date, d.metric, d.delta FROM unnest($1::text[], $2::text[], $3::bigint[]) AS d(day, metric, delta)
+                ON CONFLICT (day, metric, shard) DO UPDATE SET value = stats_daily.value + EXCLUDED.value
+            """, *map(list, zip(*daily)))
+        if totals:
+            await conn.execute("""
+                INSERT INTO stats_totals (dimension, metric, value)
+                SELECT t.dimension, t.metric, t.delta FROM unnest($1::text[], $2::text[], $3::bigint[]) AS t(dimension, metric, delta)
+                ON CONFLICT (metric, dimension, shard) DO UPDATE SET value = stats_totals.value + EXCLUDED.value
+            """, *map(list, zip(*totals)))
+        # Строки, которых до прогона не было, теперь нулевые — убираем их целиком
+        added = [(key, metric) for kind, key, metric in after if kind == "total" and (kind, key, metric) not in before]
+        if added:
+            await conn.execute("""
+                DELETE FROM stats_totals t USING unnest($1::text[], $2::text[]) AS a(dimension, metric)
+                WHERE t.dimension = a.dimension AND t.metric = a.metric
+            """, *map(list, zip(*added)))
+    return len(deltas)
@@ -0,0 +1,272 @@
+"""End-to-end benchmark: synthetic users and updates through the real dispatcher.
+
+Seeds the dedicated --database with N synthetic users (negative ids, removed
+again afterwards together with the analytics counters they moved; see
+bench_db.py), precomputes their recommendations, then replays a seeded mix of
+/start, view_profile, find_users, like_ and play_quiz updates through
+Dispatcher.feed_raw_update with an in-process stub Bot. Reports throughput,
+p50/p95/p99 latency per handler and pool connection checkouts per service
+method (not individual queries: one checkout may run several statements).
+
+Per-user rate limits are off by default, since a scripted quiz session sends
+its callbacks faster than a person would and throttled no-ops would skew the
+latencies; --throttle keeps the production limits.
+
+Runs are repeatable for a given --seed. Save a run with --output and compare a
+later commit against it with --baseline; the script exits with code 1 if any
+handler's p95 regressed by more than --threshold.
+
+    python scripts/bench_e2e.py --database postgres://.../bench --users 10000 --updates 5000 --output before.json
+    python scripts/bench_e2e.py --database postgres://.../bench --users 10000 --updates 5000 --baseline before.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+from fake_telegram import StubSession, message_update, callback_update
+from bench_db import add_database_argument, check_database, snapshot_stats, restore_stats
+from api import GENDERS, INTERESTS
+from db import Database
+from init_db import init_db
+from main import setup_dispatcher
+from metrics import DB_CONNECTION_HOLD, THROTTLE_REJECTIONS
+from services.user_manager import UserManager
+from services.matching import MatchingService
+from services.recommendations import RecommendationService
+from services.coins import CoinsService
+from services.quiz import QuizService
+from services.analytics import AnalyticsService
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Отрицательные id Telegram не выдаёт: очистка не заденет настоящих пользователей
+USER_BASE = -7_000_000_000
+# Город, страна, вес: несколько крупных городов и длинный хвост
+CITIES = [
+    ("Moscow", "Russia", 30), ("Berlin", "Germany", 20), ("London", "UK", 20), ("Kyiv", "Ukraine", 12),
+    ("Warsaw", "Poland", 8), ("Almaty", "Kazakhstan", 6), ("Tbilisi", "Georgia", 4), ("Riga", "Latvia", 3),
+    ("Vilnius", "Lithuania", 2), ("Tallinn", "Estonia", 1),
+]
+GENDER_WEIGHTS = (42, 42, 8, 4, 4)
+SCENARIOS = {"start": 10, "view_profile": 15, "find_users": 40, "like": 25, "play_quiz": 10}
+
+def synthetic_users(rng, count):
+    cities = rng.choices(CITIES, weights=[weight for *_, weight in CITIES], k=count)
+    genders = rng.choices(GENDERS, weights=GENDER_WEIGHTS, k=count)
+    for i, ((city, country, _), gender) in enumerate(zip(cities, genders)):
+        interests = rng.sample(INTERESTS, rng.randint(1, 3))
+        yield (USER_BASE + i, f"bench{i}", rng.randint(18, 55), country, city, gender, interests)
+
+async def seed(db, rng, count):
+    async with db.acquire() as conn:
+        await conn.execute("DELETE FROM users WHERE user_id >= $1 AND user_id < $2", USER_BASE, USER_BASE + 10 ** 9)
+        await conn.copy_records_to_table(
+            "users", records=list(synthetic_users(rng, count)),
+            columns=["user_id", "nickname", "age", "country", "city", "gender", "interests"])
+        await conn.execute("""
+            INSERT INTO coin_balances (user_id, balance)
+            SELECT user_id, 10 FROM users WHERE user_id >= $1 AND user_id < $2
+            ON CONFLICT DO NOTHING
+        """, USER_BASE, USER_BASE + count)
+
+async def cleanup(db, count):
+    async with db.acquire() as conn:
+        await conn.execute("DELETE FROM users WHERE user_id >= $1 AND user_id < $2", USER_BASE, USER_BASE + count)
+
+def build_plan(rng, users, updates, quiz_length):
+    """Seeded list of (user_id, [(label, update kind, payload), ...]) sessions."""
+    names, weights = zip(*SCENARIOS.items())
+    plan = []
+    planned = 0
+    while planned < updates:
+        scenario = rng.choices(names, weights=weights)[0]
+        user_id = USER_BASE + rng.randrange(users)
+        if scenario == "start":
+            steps = [("start", "message", "/start")]
+        elif scenario == "like":
+            steps = [("like", "callback", f"like_{USER_BASE + rng.randrange(users)}")]
+        elif scenario == "play_quiz":
+            steps = [("play_quiz", "callback", "play_quiz")]
+            steps += [("quiz_answer", "callback", f"quiz_{position}_{rng.randrange(2)}") for position in range(quiz_length)]
+        else:
+            steps = [(scenario, "callback", scenario)]
+        plan.append((user_id, steps))
+        planned += len(steps)
+    return plan
+
+async def replay(dp, bot, plan, concurrency):
+    latencies = defaultdict(list)
+    update_ids = itertools.count(1)
+    # Как в UpdateQueue: апдейты одного пользователя идут по порядку, разные — параллельно
+    shards = defaultdict(list)
+    for user_id, steps in plan:
+        shards[user_id % concurrency].append((user_id, steps))
+
+    async def worker(sessions):
+        for user_id, steps in sessions:
+            for label, kind, payload in steps:
+                update_id = next(update_ids)
+                if kind == "message":
+                    update = message_update(update_id, user_id, payload)
+                else:
+                    update = callback_update(update_id, user_id, payload)
+                started = time.perf_counter()
+                await dp.feed_raw_update(bot, update)
+                latencies[label].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(sessions) for sessions in shards.values()))
+    return latencies, time.perf_counter() - started
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] * 1000
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+def summarize(latencies, elapsed, db_before, db_after, throttled, session, args):
+    total = sum(len(values) for values in latencies.values())
+    handlers = {
+        label: {
+            "count": len(values),
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+            "p99_ms": percentile(values, 99),
+        }
+        for label, values in sorted(latencies.items())
+    }
+    db_checkouts = {labels[0]: count - db_before.get(labels, 0) for labels, count in db_after.items()
+                    if count - db_before.get(labels, 0) > 0}
+    return {
+        "revision": git_revision(),
+        "users": args.users,
+        "updates": total,
+        "seed": args.seed,
+        "concurrency": args.concurrency,
+        "elapsed_s": elapsed,
+        "throughput_ups": total / elapsed if elapsed else 0.0,
+        "throttled": throttled,
+        "handlers": handlers,
+        "db_checkouts": dict(sorted(db_checkouts.items(), key=lambda item: -item[1])),
+        "db_checkouts_per_update": sum(db_checkouts.values()) / total if total else 0.0,
+        "bot_api_calls": dict(session.calls),
+    }
+
+def report(result):
+    logger.info(f"{result['updates']} updates in {result['elapsed_s']:.2f}s: {result['throughput_ups']:.0f} updates/s "
+                f"({result['throttled']} throttled), {result['db_checkouts_per_update']:.2f} DB connection checkouts/update")
+    logger.info(f"{'handler':<14}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, stats in result["handlers"].items():
+        logger.info(f"{label:<14}{stats['count']:>8}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+    for method, count in result["db_checkouts"].items():
+        logger.info(f"  db {method:<45}{count:>8}")
+
+def compare(result, baseline, threshold):
+    """Handlers whose p95 got worse than baseline by more than threshold (fraction)."""
+    regressions = []
+    for label, stats in result["handlers"].items():
+        before = baseline.get("handlers", {}).get(label)
+        if before and stats["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(f"{label}: p95 {before['p95_ms']:.2f} -> {stats['p95_ms']:.2f} ms")
+    if result["db_checkouts_per_update"] > baseline.get("db_checkouts_per_update", float("inf")) * (1 + threshold):
+        regressions.append(f"DB checkouts/update {baseline['db_checkouts_per_update']:.2f} -> {result['db_checkouts_per_update']:.2f}")
+    return regressions
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_argument(parser)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--skip-precompute", action="store_true", help="measure the feed without precomputed recommendations")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic users after the run")
+    parser.add_argument("--throttle", action="store_true", help="keep the production per-user rate limits")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+    check_database(parser, args)
+
+    rng = random.Random(args.seed)
+    db = Database(dsn=args.database, health_check_interval=0)
+    await db.connect()
+    session = StubSession()
+    bot = Bot(token="123456:bench", session=session, parse_mode="HTML")
+    coins = None
+    analytics = None
+    stats_before = None
+    try:
+        await init_db(db)
+        async with db.acquire() as conn:
+            stats_before = await snapshot_stats(conn)
+        started = time.perf_counter()
+        await seed(db, rng, args.users)
+        logger.info(f"Seeded {args.users} users in {time.perf_counter() - started:.1f}s")
+
+        user_manager = UserManager(db)
+        recommendations = RecommendationService(db, user_manager, MatchingService.get_gender_filter)
+        if not args.skip_precompute:
+            started = time.perf_counter()
+            while await recommendations.run_once():
+                pass
+            logger.info(f"Precomputed recommendations in {time.perf_counter() - started:.1f}s")
+        matching = MatchingService(db, recommendations=recommendations)
+        coins = CoinsService(db, user_manager)
+        coins.start()
+        quiz = QuizService(reload_interval=0)
+        analytics = AnalyticsService(db)
+        dp = Dispatcher(storage=MemoryStorage())
+        setup_dispatcher(dp, throttling=args.throttle, db=db, user_manager=user_manager, matching=matching, coins=coins,
+                         quiz=quiz, photos=None, chat=None, analytics=analytics, broadcasts=None)
+
+        plan = build_plan(rng, args.users, args.updates, quiz.length)
+        db_before = DB_CONNECTION_HOLD.counts()
+        throttled_before = THROTTLE_REJECTIONS.total()
+        latencies, elapsed = await replay(dp, bot, plan, args.concurrency)
+        result = summarize(latencies, elapsed, db_before, DB_CONNECTION_HOLD.counts(),
+                           THROTTLE_REJECTIONS.total() - throttled_before, session, args)
+    finally:
+        if coins:
+            await coins.stop()
+        if analytics:
+            await analytics.stop()
+        if not args.keep:
+            await cleanup(db, args.users)
+            if stats_before is not None:
+                async with db.acquire() as conn:
+                    await restore_stats(conn, stats_before)
+        await db.close()
+
+    report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        for regression in regressions:
+            logger.error(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    sys.exit(asyncio.run(main()))
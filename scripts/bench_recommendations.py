@@ -0,0 +1,152 @@
+"""Benchmark: recommendation scoring and feed latency on synthetic users.
+
+Generates N users in memory (Zipf-distributed cities, random genders, ages,
+interest bitsets and activity), then for a sample of users measures:
+
+  precompute  - building the pool and scoring it with the vectorized scorer
+                (what the background job does per user)
+  feed        - with --database only: the top-k of the first --feed-sample
+                users is written to the recommendations table of that
+                dedicated database (negative ids, removed again afterwards
+                with the analytics counters they moved; see bench_db.py) and
+                one page of RECOMMENDED_QUERY is timed per user (swipe time)
+
+and prints p50/p99 for each. Needs NumPy.
+
+    python scripts/bench_recommendations.py --users 1000000 --sample 2000
+    python scripts/bench_recommendations.py --database postgres://.../bench
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_db import check_database, snapshot_stats, restore_stats
+from db import Database
+from init_db import init_db
+from services.matching import RECOMMENDED_QUERY, START_CURSOR, MatchingService
+from services.recommendations import np, score_arrays, top_k
+import logging
+
+logger = logging.getLogger(__name__)
+
+GENDERS = ("Male", "Female", "Bi", "Lesbian", "Gay")
+GENDER_WEIGHTS = (0.42, 0.42, 0.08, 0.04, 0.04)
+INTERESTS = 20
+# Отрицательные id Telegram не выдаёт: очистка не заденет настоящих пользователей
+USER_BASE = -8_000_000_000
+
+def generate(rng, users, cities):
+    city_weights = 1.0 / np.arange(1, cities + 1)
+    city = rng.choice(cities, size=users, p=city_weights / city_weights.sum()).astype(np.int32)
+    gender = rng.choice(len(GENDERS), size=users, p=GENDER_WEIGHTS).astype(np.int8)
+    age = rng.integers(18, 61, size=users).astype(np.float64)
+    idle = rng.exponential(3 * 86400.0, size=users)
+    bits = np.zeros(users, dtype=np.uint64)
+    for _ in range(3):
+        bits |= np.uint64(1) << rng.integers(0, INTERESTS, size=users).astype(np.uint64)
+    return city, gender, age, idle, bits
+
+async def measure_feed(args, ranked, city, gender, age, bits):
+    """Seed users and recommendations for the ranked sample, then time one RECOMMENDED_QUERY page per user."""
+    ids = sorted({int(i) for user, candidates, _ in ranked for i in (user, *candidates)})
+    users = [(USER_BASE + i, f"bench{i}", int(age[i]), "Benchland", f"city{city[i]}", GENDERS[gender[i]],
+              [f"interest{b}" for b in range(INTERESTS) if int(bits[i]) >> b & 1]) for i in ids]
+    recommendations = [(USER_BASE + int(user), USER_BASE + int(candidate), float(score))
+                       for user, candidates, scores in ranked for candidate, score in zip(candidates, scores)]
+    # Засев идёт через триггеры счётчиков и может занять дольше обычного таймаута запроса
+    db = Database(dsn=args.database, min_size=1, max_size=1, health_check_interval=0, command_timeout=600)
+    await db.connect()
+    feed = []
+    stats_before = None
+    try:
+        await init_db(db)
+        async with db.acquire() as conn:
+            stats_before = await snapshot_stats(conn)
+            await conn.execute("DELETE FROM users WHERE user_id >= $1 AND user_id < $2", USER_BASE, USER_BASE + args.users)
+            await conn.copy_records_to_table(
+                "users", records=users, columns=["user_id", "nickname", "age", "country", "city", "gender", "interests"])
+            await conn.copy_records_to_table(
+                "recommendations", records=recommendations, columns=["user_id", "candidate_id", "score"])
+            await conn.execute("ANALYZE users, recommendations")
+            logger.info(f"Seeded {len(users)} users and {len(recommendations)} recommendations")
+            # Первый вызов готовит prepared statement — в замер не идёт
+            await conn.fetch(RECOMMENDED_QUERY, USER_BASE + int(ranked[0][0]), *START_CURSOR, args.page_size)
+            for user, _, _ in ranked:
+                started = time.perf_counter()
+                await conn.fetch(RECOMMENDED_QUERY, USER_BASE + int(user), *START_CURSOR, args.page_size)
+                feed.append(time.perf_counter() - started)
+    finally:
+        try:
+            async with db.acquire() as conn:
+                await conn.execute("DELETE FROM users WHERE user_id >= $1 AND user_id < $2", USER_BASE, USER_BASE + args.users)
+                if stats_before is not None:
+                    await restore_stats(conn, stats_before)
+        finally:
+            await db.close()
+    return feed
+
+def percentile(samples, q):
+    return float(np.percentile(np.array(samples) * 1000, q))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--cities", type=int, default=500)
+    parser.add_argument("--sample", type=int, default=2000)
+    parser.add_argument("--pool-size", type=int, default=5000)
+    parser.add_argument("--top-k", type=int, default=200)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database", metavar="DSN",
+                        help="dedicated benchmark database to also time RECOMMENDED_QUERY against")
+    parser.add_argument("--feed-sample", type=int, default=200)
+    args = parser.parse_args()
+    if args.database:
+        check_database(parser, args)
+    if np is None:
+        logger.error("NumPy is required for this benchmark")
+        return 1
+
+    rng = np.random.default_rng(args.seed)
+    started = time.perf_counter()
+    city, gender, age, idle, bits = generate(rng, args.users, args.cities)
+    # Группы (город, пол) — аналог индекса idx_users_feed
+    group = city.astype(np.int64) * len(GENDERS) + gender
+    order = np.argsort(group, kind="stable")
+    bounds = np.searchsorted(group[order], np.arange(args.cities * len(GENDERS) + 1))
+    filters = [np.array([GENDERS.index(g) for g in MatchingService.get_gender_filter(name)]) for name in GENDERS]
+    # Кому виден пол кандидата: взаимность, если кандидат тоже видит пользователя
+    sees = np.array([[other in filters[g] for other in range(len(GENDERS))] for g in range(len(GENDERS))])
+    logger.info(f"Generated {args.users} users in {time.perf_counter() - started:.1f}s")
+
+    precompute, pool_sizes, ranked_sample = [], [], []
+    for user in rng.choice(args.users, size=args.sample, replace=False):
+        started = time.perf_counter()
+        c = city[user] * len(GENDERS)
+        pool = np.concatenate([order[bounds[c + g]:bounds[c + g + 1]] for g in filters[gender[user]]])
+        pool = pool[(pool != user) & ((bits[pool] & bits[user]) != 0)][:args.pool_size]
+        reciprocity = np.where(sees[gender[pool], gender[user]], 0.5, 0.0)
+        reciprocity[rng.random(len(pool)) < 0.01] = 1.0
+        scores = score_arrays(bits[user], age[user], bits[pool], age[pool], idle[pool], reciprocity)
+        best = top_k(scores, args.top_k)
+        ranked = pool[best]
+        precompute.append(time.perf_counter() - started)
+        pool_sizes.append(len(pool))
+        if len(ranked_sample) < args.feed_sample and len(ranked):
+            ranked_sample.append((user, ranked, scores[best]))
+
+    logger.info(f"Sampled {args.sample} users, median pool {int(np.median(pool_sizes))}, max pool {max(pool_sizes)}")
+    logger.info(f"precompute per user: p50 {percentile(precompute, 50):.3f} ms, p99 {percentile(precompute, 99):.3f} ms")
+    if args.database and ranked_sample:
+        feed = asyncio.run(measure_feed(args, ranked_sample, city, gender, age, bits))
+        logger.info(f"feed page (query):   p50 {percentile(feed, 50):.3f} ms, p99 {percentile(feed, 99):.3f} ms")
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    sys.exit(main())
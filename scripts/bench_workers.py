@@ -0,0 +1,86 @@
+"""Benchmark: processed updates/sec as web workers are added.
+
+Starts the fake Bot API, then for each worker count launches main.py with
+WEB_WORKERS=N against the configured DATABASE_URL, POSTs a burst of /start
+updates to /webhook and measures how fast replies reach the fake API.
+
+    DATABASE_URL=postgres://... python scripts/bench_workers.py --workers 1 2 4 --updates 2000
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegramAPI, message_update
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+async def wait_for_port(url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url):
+                    return
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.2)
+    raise TimeoutError(f"{url} did not come up")
+
+async def run_once(api, workers, updates, port, state_backend):
+    env = dict(
+        os.environ,
+        WEB_WORKERS=str(workers),
+        PORT=str(port),
+        BOT_TOKEN="123456:bench",
+        TELEGRAM_API_URL=api.url,
+        WEBAPP_URL=f"http://127.0.0.1:{port}",
+        STATE_BACKEND=state_backend,
+    )
+    process = subprocess.Popen([sys.executable, "main.py"], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        base = f"http://127.0.0.1:{port}"
+        await wait_for_port(base)
+        await asyncio.sleep(1.0)
+        api.reset()
+        user_base = int(time.time() * 1000) % 10 ** 9 * 1000
+        connector = aiohttp.TCPConnector(limit=200)
+        started = time.monotonic()
+        async with aiohttp.ClientSession(connector=connector) as session:
+            async def post(i):
+                async with session.post(f"{base}/webhook", json=message_update(user_base + i, user_base + i, "/start")) as r:
+                    await r.read()
+            await asyncio.gather(*(post(i) for i in range(updates)))
+        await api.wait_for("sendmessage", updates, timeout=120.0)
+        return updates / (api.last_call_at - started)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+async def main(args):
+    api = FakeTelegramAPI(port=args.api_port)
+    await api.start()
+    try:
+        print(f"{'workers':>8} {'updates/s':>10}")
+        for workers in args.workers:
+            rate = await run_once(api, workers, args.updates, args.port, args.state_backend)
+            print(f"{workers:>8} {rate:>10.1f}")
+    finally:
+        await api.stop()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--port", type=int, default=10080)
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--state-backend", default="postgres")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
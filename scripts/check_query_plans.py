@@ -0,0 +1,71 @@
+"""EXPLAIN-based regression check for the swipe feed queries.
+
+Covers the interest-overlap feed (CANDIDATES_QUERY), the precomputed feed
+(RECOMMENDED_QUERY) and the recommendation candidate pool (POOL_QUERY). Fails
+(exit code 1) if the planner falls back to a sequential scan on users, likes,
+recommendations or user_activity for any of them. Sequential scans are disabled for the check, so on a small or empty
+database the planner still has to pick an index if one is usable.
+
+    python scripts/check_query_plans.py
+"""
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from init_db import init_db
+from services.matching import CANDIDATES_QUERY, RECOMMENDED_QUERY, START_CURSOR, MatchingService
+from services.recommendations import POOL_QUERY
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHECKED_TABLES = {"users", "likes", "recommendations", "user_activity"}
+
+GENDER_FILTER = MatchingService.get_gender_filter("Male")
+QUERIES = [
+    ("candidates", CANDIDATES_QUERY, (1, "Berlin", GENDER_FILTER, ["Music", "Travel"], *START_CURSOR, 20)),
+    ("recommended", RECOMMENDED_QUERY, (1, *START_CURSOR, 20)),
+    ("pool", POOL_QUERY, (1, "Berlin", GENDER_FILTER, ["Music", "Travel"], 5000)),
+]
+
+def find_seq_scans(plan):
+    scans = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in CHECKED_TABLES:
+        scans.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        scans.extend(find_seq_scans(child))
+    return scans
+
+async def explain(conn, query, args):
+    async with conn.transaction():
+        await conn.execute("SET LOCAL enable_seqscan = off")
+        raw = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *args)
+    return json.loads(raw)[0]["Plan"]
+
+async def main():
+    db = Database(min_size=1, max_size=1, health_check_interval=0)
+    await db.connect()
+    try:
+        await init_db(db)
+        async with db.acquire() as conn:
+            plans = [(name, await explain(conn, query, args)) for name, query, args in QUERIES]
+    finally:
+        await db.close()
+    failed = 0
+    for name, plan in plans:
+        scans = find_seq_scans(plan)
+        if scans:
+            logger.error(f"{name} query falls back to Seq Scan on: {', '.join(scans)}")
+            logger.error(json.dumps(plan, indent=2))
+            failed += 1
+        else:
+            logger.info(f"{name} query plan uses indexes only")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,136 @@
+"""Minimal stand-ins for the Telegram Bot API used by the benchmark scripts.
+
+FakeTelegramAPI is an HTTP server: point the bot at it with
+TELEGRAM_API_URL=http://127.0.0.1:<port>. StubSession is an in-process aiogram
+session for benchmarks that should not pay for HTTP. Both answer every method
+call immediately and count calls per method.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from aiogram.client.session.base import BaseSession
+from aiohttp import web
+
+def fake_result(method, chat_id, text, message_id):
+    """Canned Bot API result: a Message for send* methods, startup getters, True for everything else."""
+    if method == "getwebhookinfo":
+        return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+    if method == "getmycommands":
+        return []
+    if method not in ("sendmessage", "sendphoto"):
+        return True
+    result = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "text": text or "",
+    }
+    if method == "sendphoto":
+        result["photo"] = [{"file_id": f"photo-{message_id}", "file_unique_id": str(message_id),
+                            "width": 320, "height": 320}]
+    return result
+
+class FakeTelegramAPI:
+    def __init__(self, host="127.0.0.1", port=8081):
+        self.host = host
+        self.port = port
+        self.calls = Counter()
+        self.first_call_at = None
+        self.last_call_at = None
+        self._message_ids = itertools.count(1)
+        self._runner = None
+        self._waiters = []
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def reset(self):
+        self.calls.clear()
+        self.first_call_at = None
+        self.last_call_at = None
+
+    async def wait_for(self, method, count, timeout=60.0):
+        """Wait until method has been called count times (since the last reset)."""
+        deadline = time.monotonic() + timeout
+        while self.calls[method] < count:
+            if time.monotonic() > deadline:
+                raise asyncio.TimeoutError(f"only {self.calls[method]}/{count} {method} calls")
+            await asyncio.sleep(0.01)
+
+    async def handle(self, request):
+        method = request.match_info["method"].lower()
+        params = dict(await request.post())
+        now = time.monotonic()
+        self.first_call_at = self.first_call_at or now
+        self.last_call_at = now
+        self.calls[method] += 1
+        result = fake_result(method, int(params.get("chat_id", 0)), params.get("text"), next(self._message_ids))
+        return web.json_response({"ok": True, "result": result})
+
+class StubSession(BaseSession):
+    """aiogram session that answers Bot API calls in-process, without HTTP."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        name = method.__api_method__.lower()
+        self.calls[name] += 1
+        result = fake_result(name, int(getattr(method, "chat_id", 0) or 0), getattr(method, "text", None),
+                             next(self._message_ids))
+        response = self.check_response(bot, method, 200, json.dumps({"ok": True, "result": result}))
+        return response.result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+def message_update(update_id, user_id, text):
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}] if text.startswith("/") else [],
+        },
+    }
+
+def callback_update(update_id, user_id, data):
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "menu",
+            },
+        },
+    }
@@ -0,0 +1,73 @@
+"""Load test for the webhook endpoint: replays recorded updates at a target rate.
+
+Reads Telegram updates (one JSON object per line) and POSTs them to /webhook,
+reporting acknowledgement latency percentiles and response codes. Use
+--unique-ids to rewrite update_id so repeated replays are not dropped as
+duplicates.
+
+    python scripts/replay_updates.py updates.jsonl --url http://localhost:10000/webhook --rate 200 --count 5000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+import aiohttp
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+async def replay(args):
+    with open(args.file) as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+    if not updates:
+        raise SystemExit("No updates to replay")
+    latencies = []
+    statuses = Counter()
+    next_id = itertools.count(int(time.time() * 1000))
+    interval = 1.0 / args.rate
+    connector = aiohttp.TCPConnector(limit=args.connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def send(update):
+            started = time.monotonic()
+            try:
+                async with session.post(args.url, json=update) as response:
+                    await response.read()
+                    statuses[response.status] += 1
+            except aiohttp.ClientError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.monotonic() - started)
+
+        tasks = []
+        started = time.monotonic()
+        for i, update in enumerate(itertools.islice(itertools.cycle(updates), args.count)):
+            if args.unique_ids:
+                update = dict(update, update_id=next(next_id))
+            # Держим расписание по целевой частоте, а не по завершению запросов
+            delay = started + i * interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(update)))
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - started
+    print(f"Sent {args.count} updates in {elapsed:.2f}s ({args.count / elapsed:.1f} req/s, target {args.rate})")
+    print(f"Ack latency p50={percentile(latencies, 50) * 1000:.1f}ms "
+          f"p95={percentile(latencies, 95) * 1000:.1f}ms p99={percentile(latencies, 99) * 1000:.1f}ms")
+    print(f"Responses: {dict(statuses)}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file", help="JSON lines file with recorded updates")
+    parser.add_argument("--url", default="http://localhost:10000/webhook")
+    parser.add_argument("--rate", type=float, default=100.0, help="target requests per second")
+    parser.add_argument("--count", type=int, default=1000, help="number of requests to send")
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--unique-ids", action="store_true")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(replay(parse_args()))
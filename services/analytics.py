@@ -0,0 +1,122 @@
+import asyncio
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from config import STATS_FLUSH_INTERVAL, STATS_CACHE_TTL, STATS_DAYS
+from metrics import db_method
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Метрики ряда по дням в порядке вывода
+DAILY_METRICS = ("signups", "active_users", "likes", "matches", "messages", "quiz_plays")
+
+# События сервисов за интервал: прибавка к счётчику дня и к общему итогу
+RECORD_QUERY = """
+    SELECT stats_daily_add(e.metric, e.value), stats_total_add(e.metric, '', e.value)
+    FROM unnest($1::text[], $2::bigint[]) AS e(metric, value)
+"""
+
+class AnalyticsService:
+    """Admin statistics from counters maintained incrementally.
+
+    Users, likes, matches and chat messages are counted by triggers
+    (migration 7 in init_db.py); events without a table of their own, such
+    as finished quizzes, are recorded here and flushed in one statement per
+    interval. The report reads only the counter rows (a few per metric and
+    day) and is cached for STATS_CACHE_TTL.
+    """
+
+    def __init__(self, db, flush_interval=STATS_FLUSH_INTERVAL, cache_ttl=STATS_CACHE_TTL, days=STATS_DAYS):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self.days = days
+        self._pending = Counter()
+        self._cached = None
+        self._cached_at = 0.0
+        self._task = None
+
+    def record(self, metric, amount=1):
+        """Count an event; written on the next flush."""
+        self._pending[metric] += amount
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing analytics events: {e}")
+
+    @db_method
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, Counter()
+        try:
+            async with self.db.acquire() as conn:
+                await conn.execute(RECORD_QUERY, list(pending.keys()), list(pending.values()))
+        except Exception:
+            # Не потерять события: вернём их в следующий сброс
+            self._pending.update(pending)
+            raise
+
+    async def get_stats(self):
+        """Totals, breakdowns and a daily series; cached for cache_ttl seconds."""
+        if self._cached is not None and time.monotonic() - self._cached_at < self.cache_ttl:
+            return self._cached
+        try:
+            self._cached = await self._load_stats()
+            self._cached_at = time.monotonic()
+            return self._cached
+        except Exception as e:
+            logger.error(f"Error getting stats: {e}")
+            raise
+
+    @db_method
+    async def _load_stats(self):
+        today = datetime.now(timezone.utc).date()
+        days = [today - timedelta(days=i) for i in range(self.days - 1, -1, -1)]
+        async with self.db.acquire() as conn:
+            totals = await conn.fetch("SELECT metric, dimension, SUM(value) AS value FROM stats_totals GROUP BY metric, dimension")
+            daily = await conn.fetch("""
+                SELECT day, metric, SUM(value) AS value FROM stats_daily
+                WHERE day >= $1 GROUP BY day, metric
+            """, days[0])
+        total = {}
+        cities, genders = {}, {}
+        for row in totals:
+            metric, dimension, value = row["metric"], row["dimension"], row["value"]
+            if dimension.startswith("city:") and value > 0:
+                cities[dimension[5:]] = value
+            elif dimension.startswith("gender:") and value > 0:
+                genders[dimension[7:]] = value
+            elif not dimension:
+                total[metric] = value
+        series = {metric: [0] * len(days) for metric in DAILY_METRICS}
+        index = {day: i for i, day in enumerate(days)}
+        for row in daily:
+            if row["metric"] in series and row["day"] in index:
+                series[row["metric"]][index[row["day"]]] = row["value"]
+        return {
+            "users": total.get("users", 0),
+            "likes": total.get("likes", 0),
+            "matches": total.get("matches", 0),
+            "messages": total.get("messages", 0),
+            "quiz_plays": total.get("quiz_plays", 0),
+            "cities": sorted(cities.items(), key=lambda item: -item[1]),
+            "genders": sorted(genders.items(), key=lambda item: -item[1]),
+            "days": days,
+            "series": series,
+        }
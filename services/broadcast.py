@@ -0,0 +1,226 @@
+import asyncio
+import time
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest, TelegramNetworkError
+from db import LOCK_BROADCAST
+from config import BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_CHUNK_SIZE
+from metrics import db_method
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Следующий чанк получателей после last_user_id
+RECIPIENTS_QUERY = """
+    SELECT user_id FROM users WHERE blocked = FALSE AND user_id > $1
+    ORDER BY user_id LIMIT $2
+"""
+
+class AsyncRateLimiter:
+    """Global token bucket: acquire() waits until a send is allowed."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        # После 429 Telegram просит подождать — откладываем всех отправителей
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+class BroadcastJob:
+    def __init__(self, job_id, text, total, sent=0, failed=0, last_user_id=0):
+        self.id = job_id
+        self.text = text
+        self.total = total
+        self.sent = sent
+        self.failed = failed
+        self.last_user_id = last_user_id
+        self.started_at = time.monotonic()
+        self.sent_this_run = 0
+        self.task = None
+
+    @property
+    def throughput(self):
+        elapsed = time.monotonic() - self.started_at
+        return self.sent_this_run / elapsed if elapsed > 0 else 0.0
+
+class BroadcastService:
+    """Background broadcasts to all users with persisted, resumable progress.
+
+    Recipients are read in user_id order, one short keyset query per chunk,
+    and sent by a bounded pool of workers sharing one rate limiter. After each
+    chunk the last user_id and counters are saved, so a restart resumes from
+    the last completed chunk.
+    """
+
+    def __init__(self, db, bot, rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY,
+                 chunk_size=BROADCAST_CHUNK_SIZE, max_retries=5):
+        self.db = db
+        self.bot = bot
+        self.limiter = AsyncRateLimiter(rate)
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.jobs = {}
+
+    @db_method
+    async def start(self, text, created_by):
+        try:
+            async with self.db.acquire() as conn:
+                total = await conn.fetchval("SELECT COUNT(*) FROM users WHERE blocked = FALSE")
+                job_id = await conn.fetchval(
+                    "INSERT INTO broadcasts (text, created_by, total) VALUES ($1, $2, $3) RETURNING id",
+                    text, created_by, total)
+            job = BroadcastJob(job_id, text, total)
+            self._launch(job)
+            return job
+        except Exception as e:
+            logger.error(f"Error starting broadcast: {e}")
+            raise
+
+    @db_method
+    async def resume(self):
+        try:
+            async with self.db.acquire() as conn:
+                rows = await conn.fetch("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id")
+            for row in rows:
+                job = BroadcastJob(row["id"], row["text"], row["total"], row["sent"], row["failed"], row["last_user_id"])
+                logger.info(f"Resuming broadcast {job.id} after user {job.last_user_id}")
+                self._launch(job)
+        except Exception as e:
+            logger.error(f"Error resuming broadcasts: {e}")
+            raise
+
+    @db_method
+    async def get_status(self, job_id=None):
+        try:
+            async with self.db.acquire() as conn:
+                if job_id is None:
+                    row = await conn.fetchrow("SELECT * FROM broadcasts ORDER BY id DESC LIMIT 1")
+                else:
+                    row = await conn.fetchrow("SELECT * FROM broadcasts WHERE id = $1", job_id)
+            if not row:
+                return None
+            status = dict(row)
+            job = self.jobs.get(row["id"])
+            # Живые счётчики точнее последнего сохранённого чанка
+            if job:
+                status.update(sent=job.sent, failed=job.failed)
+            status["throughput"] = job.throughput if job else 0.0
+            return status
+        except Exception as e:
+            logger.error(f"Error getting broadcast status: {e}")
+            raise
+
+    async def stop(self):
+        tasks = [job.task for job in self.jobs.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _launch(self, job):
+        self.jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job))
+        job.task.add_done_callback(lambda _: self.jobs.pop(job.id, None))
+
+    @db_method
+    async def _run(self, job):
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self._worker(job, queue)) for _ in range(self.concurrency)]
+        try:
+            async with self.db.acquire() as conn:
+                # Рассылку ведёт только один воркер, остальные её пропускают
+                if not await conn.fetchval("SELECT pg_try_advisory_lock($1, $2)", LOCK_BROADCAST, job.id):
+                    logger.info(f"Broadcast {job.id} is handled by another worker")
+                    return
+                try:
+                    # Прогресс мог измениться, пока блокировку держал другой воркер
+                    row = await conn.fetchrow("SELECT status, sent, failed, last_user_id FROM broadcasts WHERE id = $1", job.id)
+                    if row["status"] != "running":
+                        return
+                    job.sent, job.failed, job.last_user_id = row["sent"], row["failed"], row["last_user_id"]
+                    await self._stream(job, conn, queue)
+                finally:
+                    await conn.execute("SELECT pg_advisory_unlock($1, $2)", LOCK_BROADCAST, job.id)
+            logger.info(f"Broadcast {job.id} finished: {job.sent} sent, {job.failed} failed")
+        except asyncio.CancelledError:
+            logger.info(f"Broadcast {job.id} interrupted after user {job.last_user_id}, will resume on restart")
+            raise
+        except Exception as e:
+            logger.error(f"Broadcast {job.id} failed: {e}")
+            await self._checkpoint(job, job.last_user_id, status="failed")
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def _stream(self, job, conn, queue):
+        # Каждый чанк — отдельный короткий запрос по ключу (user_id > последнего),
+        # без транзакции на всю рассылку: снимок не держится и не мешает autovacuum
+        last_user_id = job.last_user_id
+        while True:
+            rows = await conn.fetch(RECIPIENTS_QUERY, last_user_id, self.chunk_size)
+            for record in rows:
+                await queue.put(record["user_id"])
+            await queue.join()
+            if rows:
+                last_user_id = rows[-1]["user_id"]
+            if len(rows) < self.chunk_size:
+                break
+            await self._checkpoint(job, last_user_id)
+        await self._checkpoint(job, last_user_id, status="done")
+
+    @db_method
+    async def _checkpoint(self, job, last_user_id, status="running"):
+        job.last_user_id = last_user_id
+        async with self.db.acquire() as conn:
+            await conn.execute("""
+                UPDATE broadcasts SET sent = $2, failed = $3, last_user_id = $4, status = $5,
+                    finished_at = CASE WHEN $5 = 'running' THEN NULL ELSE NOW() END
+                WHERE id = $1
+            """, job.id, job.sent, job.failed, last_user_id, status)
+
+    async def _worker(self, job, queue):
+        while True:
+            user_id = await queue.get()
+            try:
+                if await self._send(user_id, job.text):
+                    job.sent += 1
+                    job.sent_this_run += 1
+                else:
+                    job.failed += 1
+            except Exception as e:
+                logger.error(f"Error broadcasting to {user_id}: {e}")
+                job.failed += 1
+            finally:
+                queue.task_done()
+
+    async def _send(self, user_id, text):
+        for attempt in range(self.max_retries):
+            await self.limiter.acquire()
+            try:
+                await self.bot.send_message(user_id, text)
+                return True
+            except TelegramRetryAfter as e:
+                logger.warning(f"Broadcast hit flood limit, retrying after {e.retry_after}s")
+                # Следующий acquire() и так ждёт retry_after — отдельный sleep удвоил бы паузу
+                self.limiter.pause(e.retry_after)
+            except (TelegramForbiddenError, TelegramBadRequest):
+                # Пользователь заблокировал бота или чат недоступен — повтор не поможет
+                return False
+            except TelegramNetworkError as e:
+                logger.warning(f"Network error broadcasting to {user_id}: {e}")
+                if attempt + 1 < self.max_retries:
+                    await asyncio.sleep(2 ** attempt)
+        return False
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from config import REDIS_URL, STATE_BACKEND
+from services.state import PostgresKV
+import logging
+
+logger = logging.getLogger(__name__)
+
+class LRUCache:
+    """In-process LRU cache with a per-entry TTL and hit/miss/eviction counters."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.evictions += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+class MemoryKV:
+    """In-memory stand-in for the subset of the Redis API the bot uses."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = asyncio.Lock()
+
+    def _alive(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    async def get(self, key):
+        entry = self._alive(key)
+        return entry[0] if entry else None
+
+    async def set(self, key, value, ex=None, nx=False):
+        if nx and self._alive(key):
+            return None
+        self._data[key] = (value, time.monotonic() + ex if ex else None)
+        return True
+
+    async def delete(self, *keys):
+        return sum(self._data.pop(key, None) is not None for key in keys)
+
+    async def incrby(self, key, amount=1):
+        async with self._lock:
+            entry = self._alive(key)
+            value = int(entry[0]) + amount if entry else amount
+            self._data[key] = (str(value), entry[1] if entry else None)
+            return value
+
+    async def expire(self, key, seconds):
+        entry = self._alive(key)
+        if not entry:
+            return False
+        self._data[key] = (entry[0], time.monotonic() + seconds)
+        return True
+
+    async def close(self):
+        self._data.clear()
+
+def create_kv(backend=STATE_BACKEND, db=None, url=REDIS_URL):
+    """Shared key-value backend for the chosen STATE_BACKEND, or None for process-local state."""
+    if backend == "postgres":
+        return PostgresKV(db)
+    if backend != "redis" or not url:
+        return None
+    if url == "memory://":
+        return MemoryKV()
+    try:
+        from redis import asyncio as redis
+    except ImportError:
+        logger.warning("REDIS_URL is set but the redis package is not installed, shared backend disabled")
+        return None
+    return redis.from_url(url, decode_responses=True)
+
+class ObjectCache:
+    """Two-tier cache: a local LRUCache in front of an optional shared key-value store."""
+
+    def __init__(self, namespace, max_size, ttl, kv=None, dumps=json.dumps, loads=json.loads):
+        self.namespace = namespace
+        self.local = LRUCache(max_size, ttl)
+        self.kv = kv
+        self.dumps = dumps
+        self.loads = loads
+
+    def _key(self, key):
+        return f"{self.namespace}:{key}"
+
+    async def get(self, key):
+        value = self.local.get(key)
+        if value is not None or self.kv is None:
+            return value
+        try:
+            raw = await self.kv.get(self._key(key))
+        except Exception as e:
+            logger.error(f"Error reading {self.namespace} cache: {e}")
+            return None
+        if raw is None:
+            return None
+        value = self.loads(raw)
+        self.local.set(key, value)
+        return value
+
+    async def set(self, key, value):
+        self.local.set(key, value)
+        if self.kv is not None:
+            try:
+                await self.kv.set(self._key(key), self.dumps(value), ex=int(self.local.ttl))
+            except Exception as e:
+                logger.error(f"Error writing {self.namespace} cache: {e}")
+
+    async def invalidate(self, *keys):
+        for key in keys:
+            self.local.delete(key)
+        if self.kv is not None and keys:
+            try:
+                await self.kv.delete(*(self._key(key) for key in keys))
+            except Exception as e:
+                logger.error(f"Error invalidating {self.namespace} cache: {e}")
+
+    def stats(self):
+        return self.local.stats()
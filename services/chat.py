@@ -1,4 +1,267 @@
-# Placeholder for chat functionality
-# Chat messages are sent via Telegram Bot API and not stored in DB for simplicity
+import asyncio
+import json
+import time
+from collections import defaultdict
+from html import escape
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from config import (NOTIFY_RATE, NOTIFY_CONCURRENCY, NOTIFY_BATCH_SIZE, NOTIFY_POLL_INTERVAL, NOTIFY_CHAT_INTERVAL,
+                    NOTIFY_COALESCE_WINDOW, NOTIFY_MAX_ATTEMPTS, NOTIFY_LEASE, NOTIFY_RETENTION)
+from services.broadcast import AsyncRateLimiter
+from metrics import db_method
+import logging
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY-канал: будит диспетчер сразу после записи в outbox
+OUTBOX_CHANNEL = "outbox"
+MAX_MATCH_BUTTONS = 5
+
+# Забираем готовые к отправке записи с арендой; матчи чата в «окне склейки» ждут.
+# Из чата берём только записи среди первых $3 ожидающих, считая уже арендованные: отправка
+# с интервалом чата укладывается в аренду, а хвост не заберёт параллельно другой воркер
+CLAIM_QUERY = """
+    WITH ranked AS (
+        SELECT o.id, ROW_NUMBER() OVER (PARTITION BY o.chat_id ORDER BY o.id) AS position
+        FROM outbox o
+        WHERE o.status = 'pending'
+        AND (o.kind <> 'match' OR NOT EXISTS (
+            SELECT 1 FROM outbox_cooldowns c WHERE c.chat_id = o.chat_id AND c.until > NOW()))
+    ), due AS (
+        SELECT o.id FROM outbox o JOIN ranked r ON r.id = o.id
+        WHERE r.position <= $3 AND o.status = 'pending' AND o.available_at <= NOW()
+        ORDER BY o.available_at, o.id
+        LIMIT $1
+        FOR UPDATE OF o SKIP LOCKED
+    )
+    UPDATE outbox o SET available_at = NOW() + $2 * INTERVAL '1 second', attempts = o.attempts + 1
+    FROM due WHERE o.id = due.id
+    RETURNING o.id, o.chat_id, o.kind, o.payload, o.attempts
+"""
+
+RETRY_QUERY = """
+    UPDATE outbox o SET available_at = NOW() + r.delay * INTERVAL '1 second', last_error = r.error,
+        attempts = o.attempts - r.refund
+    FROM unnest($1::bigint[], $2::float8[], $3::text[], $4::int[]) AS r(id, delay, error, refund)
+    WHERE o.id = r.id
+"""
+
+FAIL_QUERY = """
+    UPDATE outbox o SET status = 'failed', last_error = f.error
+    FROM unnest($1::bigint[], $2::text[]) AS f(id, error)
+    WHERE o.id = f.id
+"""
+
+def render_matches(payloads):
+    """One message for all pending match events of a chat."""
+    buttons = [[InlineKeyboardButton(text=f"Chat with {p['nickname']}", callback_data=f"chat_{p['user_id']}")]
+               for p in payloads[:MAX_MATCH_BUTTONS]]
+    if len(payloads) == 1:
+        text = f"🎉 It's a Match! <b>{escape(payloads[0]['nickname'])}</b> liked you back. Start chatting!"
+    else:
+        names = ", ".join(escape(p["nickname"]) for p in payloads[:MAX_MATCH_BUTTONS])
+        more = f" and {len(payloads) - MAX_MATCH_BUTTONS} more" if len(payloads) > MAX_MATCH_BUTTONS else ""
+        text = f"🎉 You have {len(payloads)} new matches: {names}{more}!"
+    return text, InlineKeyboardMarkup(inline_keyboard=buttons)
+
+def render_message(payload):
+    text = f"💬 <b>{escape(payload['nickname'])}</b>: {escape(payload['text'])}"
+    return text, InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Reply", callback_data=f"chat_{payload['user_id']}")]
+    ])
+
 class ChatService:
-    pass
+    """Match notifications and chat relay through a durable outbox.
+
+    Producers only insert outbox rows (match rows are written in the same
+    transaction as the match itself), so handlers never wait on Telegram.
+    A background dispatcher in every worker claims due rows with SKIP LOCKED,
+    sends them with bounded concurrency, a global and a per-chat rate limit,
+    and retries with backoff. Match events of one chat that pile up within
+    NOTIFY_COALESCE_WINDOW are merged into a single message.
+    """
+
+    class ChatStates(StatesGroup):
+        chatting = State()
+
+    def __init__(self, db, bot, rate=NOTIFY_RATE, concurrency=NOTIFY_CONCURRENCY, batch_size=NOTIFY_BATCH_SIZE,
+                 poll_interval=NOTIFY_POLL_INTERVAL, chat_interval=NOTIFY_CHAT_INTERVAL,
+                 coalesce_window=NOTIFY_COALESCE_WINDOW, max_attempts=NOTIFY_MAX_ATTEMPTS, lease=NOTIFY_LEASE,
+                 retention=NOTIFY_RETENTION):
+        self.db = db
+        self.bot = bot
+        self.limiter = AsyncRateLimiter(rate)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.chat_interval = chat_interval
+        self.coalesce_window = coalesce_window
+        self.max_attempts = max_attempts
+        self.lease = lease
+        # Половина аренды на отправки одного чата, остальное — запас на общий лимит и очередь семафора
+        self.max_per_chat = max(1, int(lease / (2 * chat_interval))) if chat_interval > 0 else batch_size
+        self.retention = retention
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._purged_at = 0.0
+        # chat_id -> время последней отправки: интервал чата держится и между пачками
+        self._last_sent = {}
+        self.sent = 0
+        self.failed = 0
+
+    @db_method
+    async def is_match(self, user_id, other_id):
+        async with self.db.acquire() as conn:
+            return await conn.fetchval(
+                "SELECT EXISTS (SELECT 1 FROM matches WHERE user_a = LEAST($1::bigint, $2::bigint) AND user_b = GREATEST($1::bigint, $2::bigint))",
+                user_id, other_id)
+
+    @db_method
+    async def enqueue(self, chat_id, kind, payload, dedup_key=None):
+        """Store an outgoing message; returns False if dedup_key was already queued."""
+        async with self.db.acquire() as conn:
+            queued = await conn.fetchval("""
+                WITH queued AS (
+                    INSERT INTO outbox (chat_id, kind, payload, dedup_key) VALUES ($1, $2, $3::jsonb, $4)
+                    ON CONFLICT (dedup_key) DO NOTHING
+                    RETURNING id
+                )
+                SELECT pg_notify($5, '') IS NOT NULL FROM queued
+            """, chat_id, kind, json.dumps(payload), dedup_key, OUTBOX_CHANNEL)
+        return bool(queued)
+
+    async def relay_message(self, sender_id, nickname, recipient_id, text, message_id):
+        """Queue a chat message; the Telegram message id makes webhook redeliveries no-ops."""
+        payload = {"user_id": sender_id, "nickname": nickname, "text": text}
+        return await self.enqueue(recipient_id, "message", payload, dedup_key=f"message:{sender_id}:{message_id}")
+
+    async def start(self):
+        if self._task is None:
+            await self.db.listen(OUTBOX_CHANNEL, lambda payload: self._wakeup.set())
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                # Пока очередь не пуста, забираем следующую пачку без ожидания
+                while await self.run_once():
+                    pass
+                if time.monotonic() - self._purged_at > 3600:
+                    await self.purge()
+            except Exception as e:
+                logger.error(f"Error dispatching notifications: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    @db_method
+    async def run_once(self):
+        """Deliver one claimed batch; returns the number of outbox rows processed."""
+        async with self.db.acquire() as conn:
+            rows = await conn.fetch(CLAIM_QUERY, self.batch_size, self.lease, self.max_per_chat)
+        if not rows:
+            return 0
+        by_chat = defaultdict(list)
+        for row in rows:
+            by_chat[row["chat_id"]].append(row)
+        outcome = {"sent": [], "retry": [], "failed": [], "cooldown": []}
+        results = await asyncio.gather(*(self._deliver_chat(chat_id, chat_rows, outcome)
+                                         for chat_id, chat_rows in by_chat.items()), return_exceptions=True)
+        # Сбой одного чата не должен терять итоги остальных: их записи уже отправлены.
+        # Неотправленные записи упавшего чата вернутся в очередь по истечении аренды
+        for chat_id, result in zip(by_chat, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Error delivering notifications to chat {chat_id}: {result}")
+        now = time.monotonic()
+        self._last_sent = {chat_id: sent_at for chat_id, sent_at in self._last_sent.items()
+                           if now - sent_at < self.chat_interval}
+        await self._record(outcome)
+        return len(rows)
+
+    async def _deliver_chat(self, chat_id, rows, outcome):
+        matches = [row for row in rows if row["kind"] == "match"]
+        messages = []
+        if matches:
+            messages.append((matches, *render_matches([json.loads(row["payload"]) for row in matches])))
+        for row in rows:
+            if row["kind"] == "message":
+                messages.append(([row], *render_message(json.loads(row["payload"]))))
+        async with self.semaphore:
+            for i, (batch, text, markup) in enumerate(messages):
+                delay = self._last_sent.get(chat_id, 0.0) + self.chat_interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                result = await self._send(chat_id, text, markup)
+                self._last_sent[chat_id] = time.monotonic()
+                if result is True:
+                    outcome["sent"].extend(row["id"] for row in batch)
+                    if batch is matches:
+                        outcome["cooldown"].append(chat_id)
+                    continue
+                kind, delay, error = result
+                for row in batch:
+                    if kind == "failed" or (kind == "retry" and row["attempts"] >= self.max_attempts):
+                        outcome["failed"].append((row["id"], error))
+                    elif kind == "retry":
+                        outcome["retry"].append((row["id"], min(2.0 ** row["attempts"], 300.0), error, 0))
+                    else:
+                        # 429 — не вина сообщения, попытку не списываем
+                        outcome["retry"].append((row["id"], delay, error, 1))
+                if kind == "failed":
+                    continue
+                # Остальные сообщения чата откладываем вместе с этим, чтобы не нарушить порядок
+                for rest, _, _ in messages[i + 1:]:
+                    outcome["retry"].extend((row["id"], delay or 1.0, error, 1) for row in rest)
+                return
+
+    async def _send(self, chat_id, text, markup):
+        """True on success, otherwise (outcome, retry delay, error)."""
+        await self.limiter.acquire()
+        try:
+            await self.bot.send_message(chat_id, text, reply_markup=markup)
+            return True
+        except TelegramRetryAfter as e:
+            self.limiter.pause(e.retry_after)
+            return "retry_after", float(e.retry_after), str(e)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Пользователь заблокировал бота или чат недоступен — повтор не поможет
+            return "failed", 0.0, str(e)
+        except Exception as e:
+            return "retry", 0.0, str(e)
+
+    @db_method
+    async def _record(self, outcome):
+        retries = outcome["retry"]
+        self.sent += len(outcome["sent"])
+        self.failed += len(outcome["failed"])
+        async with self.db.acquire() as conn, conn.transaction():
+            if outcome["sent"]:
+                await conn.execute("UPDATE outbox SET status = 'sent', sent_at = NOW() WHERE id = ANY($1::bigint[])",
+                                   outcome["sent"])
+            if retries:
+                await conn.execute(RETRY_QUERY, *map(list, zip(*retries)))
+            if outcome["failed"]:
+                await conn.execute(FAIL_QUERY, *map(list, zip(*outcome["failed"])))
+            if outcome["cooldown"]:
+                await conn.execute("""
+                    INSERT INTO outbox_cooldowns (chat_id, until)
+                    SELECT chat_id, NOW() + $2 * INTERVAL '1 second' FROM unnest($1::bigint[]) AS chat_id
+                    ON CONFLICT (chat_id) DO UPDATE SET until = EXCLUDED.until
+                """, outcome["cooldown"], self.coalesce_window)
+
+    @db_method
+    async def purge(self):
+        self._purged_at = time.monotonic()
+        async with self.db.acquire() as conn:
+            await conn.execute("DELETE FROM outbox WHERE status <> 'pending' AND created_at < NOW() - $1 * INTERVAL '1 second'",
+                               self.retention)
+            await conn.execute("DELETE FROM outbox_cooldowns WHERE until < NOW()")
@@ -1,15 +1,105 @@
-import asyncpg
-from config import DATABASE_URL
+import asyncio
+from config import COINS_FLUSH_INTERVAL, COINS_FLUSH_SIZE
+from metrics import db_method
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Одна инструкция: записи в журнал (дубликаты ключей пропускаются) и прирост баланса
+CREDIT_QUERY = """
+    WITH entries AS (
+        INSERT INTO coin_ledger (user_id, amount, reason, idempotency_key)
+        SELECT v.user_id, v.amount, v.reason, v.idempotency_key
+        FROM unnest($1::bigint[], $2::int[], $3::text[], $4::text[]) AS v(user_id, amount, reason, idempotency_key)
+        WHERE EXISTS (SELECT 1 FROM users u WHERE u.user_id = v.user_id)
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING user_id, amount
+    ), totals AS (
+        SELECT user_id, SUM(amount)::int AS amount FROM entries GROUP BY user_id
+    )
+    INSERT INTO coin_balances (user_id, balance)
+    SELECT user_id, amount FROM totals
+    ON CONFLICT (user_id) DO UPDATE SET balance = coin_balances.balance + EXCLUDED.balance
+"""
+
 class CoinsService:
-    async def add_coins(self, user_id, amount):
+    """Coin balances backed by an append-only ledger.
+
+    Credits are queued and written in batches (one statement per flush); each
+    entry may carry an idempotency key so retried rewards are applied once.
+    Cached profiles of credited users are invalidated over the same connection,
+    with one NOTIFY per flush for the other workers.
+    """
+
+    def __init__(self, db, user_manager=None, flush_interval=COINS_FLUSH_INTERVAL, flush_size=COINS_FLUSH_SIZE):
+        self.db = db
+        self.user_manager = user_manager
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._pending = []
+        self._pending_keys = set()
+        self._flush_now = asyncio.Event()
+        self._flush_task = None
+
+    async def add_coins(self, user_id, amount, reason="manual", idempotency_key=None):
+        """Credit immediately, bypassing the batch queue."""
         try:
-            conn = await asyncpg.connect(DATABASE_URL)
-            await conn.execute("UPDATE users SET coins = coins + $1 WHERE user_id = $2", amount, user_id)
-            await conn.close()
+            await self._write_credits([(user_id, amount, reason, idempotency_key)])
         except Exception as e:
             logger.error(f"Error adding coins: {e}")
             raise
+
+    def credit_later(self, user_id, amount, reason="reward", idempotency_key=None):
+        """Queue a credit for the next batch flush."""
+        if amount <= 0:
+            raise ValueError("Credit amount must be positive")
+        if idempotency_key is not None:
+            if idempotency_key in self._pending_keys:
+                return
+            self._pending_keys.add(idempotency_key)
+        self._pending.append((user_id, amount, reason, idempotency_key))
+        if len(self._pending) >= self.flush_size:
+            self._flush_now.set()
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing coin credits: {e}")
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        self._pending_keys = set()
+        try:
+            await self._write_credits(pending)
+        except Exception:
+            # Возвращаем неначисленное в очередь, чтобы не потерять награды
+            self._pending = pending + self._pending
+            self._pending_keys.update(key for *_, key in pending if key is not None)
+            raise
+
+    @db_method
+    async def _write_credits(self, entries):
+        user_ids, amounts, reasons, keys = zip(*entries)
+        async with self.db.acquire() as conn:
+            await conn.execute(CREDIT_QUERY, list(user_ids), list(amounts), list(reasons), list(keys))
+            if self.user_manager:
+                await self.user_manager.invalidate_users(set(user_ids), conn=conn)
@@ -1,31 +1,149 @@
-import asyncpg
-from config import DATABASE_URL
+import asyncio
+from collections import OrderedDict, deque
+from config import CANDIDATE_BATCH_SIZE, CANDIDATE_LOW_WATERMARK, CANDIDATE_QUEUE_TTL, CANDIDATE_MAX_QUEUES
 from models.user import User
+from metrics import db_method
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Начальный курсор: больше любого возможного (overlap, user_id)
+START_CURSOR = (2 ** 31 - 1, 2 ** 63 - 1)
+
+# Лента кандидатов; планы проверяются scripts/check_query_plans.py
+CANDIDATES_QUERY = """
+    SELECT * FROM (
+        SELECT u.*, (SELECT COUNT(*) FROM unnest(u.interests) i WHERE i = ANY($4::text[])) AS overlap
+        FROM users u
+        WHERE u.user_id != $1 AND u.blocked = FALSE AND u.city_norm = LOWER($2)
+        AND u.gender = ANY($3::varchar[])
+        AND u.interests && $4::text[]
+        AND NOT EXISTS (SELECT 1 FROM likes l WHERE l.liker = $1 AND l.likee = u.user_id)
+    ) c
+    WHERE (c.overlap, c.user_id) < ($5, $6)
+    ORDER BY c.overlap DESC, c.user_id DESC
+    LIMIT $7
+"""
+
+# Заранее посчитанная выдача (services/recommendations.py), keyset по (score, candidate_id); план тоже проверяется
+RECOMMENDED_QUERY = """
+    SELECT u.*, r.score FROM recommendations r
+    JOIN users u ON u.user_id = r.candidate_id
+    WHERE r.user_id = $1 AND u.blocked = FALSE
+    AND NOT EXISTS (SELECT 1 FROM likes l WHERE l.liker = $1 AND l.likee = r.candidate_id)
+    AND (r.score, r.candidate_id) < ($2, $3)
+    ORDER BY r.score DESC, r.candidate_id DESC
+    LIMIT $4
+"""
+
+class CandidateQueue:
+    """Prefetched, ranked candidates for one user plus the keyset cursor of the last fetched row."""
+
+    def __init__(self, filters, created_at, ranked=False):
+        self.filters = filters
+        self.created_at = created_at
+        self.ranked = ranked
+        self.items = deque()
+        self.cursor = START_CURSOR
+        self.exhausted = False
+        self.refill_task = None
+
 class MatchingService:
+    def __init__(self, db, batch_size=CANDIDATE_BATCH_SIZE, low_watermark=CANDIDATE_LOW_WATERMARK,
+                 queue_ttl=CANDIDATE_QUEUE_TTL, max_queues=CANDIDATE_MAX_QUEUES, recommendations=None):
+        self.db = db
+        self.recommendations = recommendations
+        self.batch_size = batch_size
+        self.low_watermark = low_watermark
+        self.queue_ttl = queue_ttl
+        self.max_queues = max_queues
+        self._queues = OrderedDict()
+
     async def get_next_user(self, user_id, city, gender, interests):
         try:
-            conn = await asyncpg.connect(DATABASE_URL)
-            query = """
-                SELECT * FROM users 
-                WHERE user_id != $1 AND blocked = FALSE AND city ILIKE $2 
-                AND gender = ANY($3::varchar[]) 
-                AND interests && $4::text[]
-                AND NOT ($1 = ANY(likes))
-                LIMIT 1
-            """
-            gender_filter = self.get_gender_filter(gender)
-            row = await conn.fetchrow(query, user_id, city, gender_filter, interests)
-            await conn.close()
-            return User(**row) if row else None
+            queue = self._get_queue(user_id, (city, gender, tuple(interests)))
+            if not queue.items and not queue.exhausted:
+                await self._refill(user_id, queue)
+            if not queue.items:
+                # Лента закончилась — следующий запрос начнёт её заново
+                self.invalidate(user_id)
+                return None
+            candidate = queue.items.popleft()
+            if len(queue.items) < self.low_watermark and not queue.exhausted and queue.refill_task is None:
+                queue.refill_task = asyncio.create_task(self._refill(user_id, queue))
+            return candidate
         except Exception as e:
             logger.error(f"Error getting next user: {e}")
             raise
 
-    def get_gender_filter(self, gender):
+    @property
+    def queued_users(self):
+        return len(self._queues)
+
+    def invalidate(self, user_id):
+        queue = self._queues.pop(user_id, None)
+        if queue and queue.refill_task:
+            queue.refill_task.cancel()
+
+    def _get_queue(self, user_id, filters):
+        now = asyncio.get_running_loop().time()
+        queue = self._queues.get(user_id)
+        if queue and (queue.filters != filters or now - queue.created_at > self.queue_ttl):
+            self.invalidate(user_id)
+            queue = None
+        if queue is None:
+            queue = CandidateQueue(filters, now, ranked=self.recommendations is not None)
+            self._queues[user_id] = queue
+            while len(self._queues) > self.max_queues:
+                self.invalidate(next(iter(self._queues)))
+        else:
+            self._queues.move_to_end(user_id)
+        return queue
+
+    async def _refill(self, user_id, queue):
+        if queue.refill_task is not None and queue.refill_task is not asyncio.current_task():
+            await asyncio.shield(queue.refill_task)
+            return
+        try:
+            rows = await self._fetch_candidates(user_id, queue)
+            if queue.ranked and not rows and queue.cursor == START_CURSOR:
+                # Рекомендации ещё не посчитаны — отдаём ленту по пересечению интересов
+                await self.recommendations.request_refresh(user_id)
+                queue.ranked = False
+                rows = await self._fetch_candidates(user_id, queue)
+            queue.items.extend(User.from_record(row) for row in rows)
+            if rows:
+                queue.cursor = (rows[-1]["score" if queue.ranked else "overlap"], rows[-1]["user_id"])
+            if len(rows) < self.batch_size:
+                queue.exhausted = True
+        except Exception as e:
+            logger.error(f"Error refilling candidates for user {user_id}: {e}")
+            if not queue.items:
+                raise
+        finally:
+            queue.refill_task = None
+
+    @db_method
+    async def _fetch_candidates(self, user_id, queue):
+        city, gender, interests = queue.filters
+        gender_filter = self.get_gender_filter(gender)
+        async with self.db.acquire() as conn:
+            if queue.ranked:
+                return await conn.fetch(RECOMMENDED_QUERY, user_id, queue.cursor[0], queue.cursor[1], self.batch_size)
+            return await conn.fetch(CANDIDATES_QUERY, user_id, city, gender_filter, list(interests),
+                                    queue.cursor[0], queue.cursor[1], self.batch_size)
+
+    @db_method
+    async def get_feed_page(self, user_id, city, gender, interests, cursor=START_CURSOR, limit=CANDIDATE_BATCH_SIZE):
+        """One keyset page of the feed for API clients; returns (users, next_cursor or None)."""
+        async with self.db.acquire() as conn:
+            rows = await conn.fetch(CANDIDATES_QUERY, user_id, city, self.get_gender_filter(gender), list(interests),
+                                    cursor[0], cursor[1], limit)
+        next_cursor = (rows[-1]["overlap"], rows[-1]["user_id"]) if len(rows) == limit else None
+        return [User.from_record(row) for row in rows], next_cursor
+
+    @staticmethod
+    def get_gender_filter(gender):
         if gender == "Male":
             return ["Female", "Bi", "Lesbian"]
         elif gender == "Female":
@@ -38,18 +156,42 @@ class MatchingService:
             return ["Male", "Bi", "Gay"]
         return []
 
+    @db_method
     async def add_like(self, user_id, target_id):
-        try:
-            conn = await asyncpg.connect(DATABASE_URL)
-            await conn.execute("UPDATE users SET likes = array_append(likes, $1) WHERE user_id = $2", target_id, user_id)
-            target = await conn.fetchrow("SELECT likes, matches FROM users WHERE user_id = $1", target_id)
-            if user_id in (target["likes"] or []):
-                await conn.execute("UPDATE users SET matches = array_append(matches, $1) WHERE user_id = $2", target_id, user_id)
-                await conn.execute("UPDATE users SET matches = array_append(matches, $1) WHERE user_id = $2", user_id, target_id)
-                await conn.close()
-                return True
-            await conn.close()
+        if user_id == target_id:
             return False
+        try:
+            async with self.db.acquire() as conn, conn.transaction():
+                # Сериализуем встречные лайки одной пары, чтобы взаимный матч не потерялся
+                await conn.execute(
+                    "SELECT pg_advisory_xact_lock(hashtextextended(LEAST($1::bigint, $2::bigint) || ':' || GREATEST($1::bigint, $2::bigint), 0))",
+                    user_id, target_id)
+                match = await conn.fetchval("""
+                    WITH liked AS (
+                        INSERT INTO likes (liker, likee) VALUES ($1, $2)
+                        ON CONFLICT DO NOTHING
+                        RETURNING liker, likee
+                    ),
+                    matched AS (
+                        INSERT INTO matches (user_a, user_b)
+                        SELECT LEAST(liked.liker, liked.likee), GREATEST(liked.liker, liked.likee) FROM liked
+                        WHERE EXISTS (SELECT 1 FROM likes l WHERE l.liker = liked.likee AND l.likee = liked.liker)
+                        ON CONFLICT DO NOTHING
+                        RETURNING user_a, user_b
+                    ),
+                    -- Уведомление второй стороне пишется в той же транзакции (services/chat.py)
+                    notified AS (
+                        INSERT INTO outbox (chat_id, kind, payload, dedup_key)
+                        SELECT $2, 'match',
+                               jsonb_build_object('user_id', $1::bigint, 'nickname', (SELECT nickname FROM users WHERE user_id = $1)),
+                               'match:' || matched.user_a || ':' || matched.user_b
+                        FROM matched
+                        ON CONFLICT (dedup_key) DO NOTHING
+                        RETURNING id
+                    )
+                    SELECT matched.user_a, (SELECT pg_notify('outbox', '') FROM notified LIMIT 1) FROM matched
+                """, user_id, target_id)
+                return match is not None
         except Exception as e:
             logger.error(f"Error adding like: {e}")
             raise
@@ -0,0 +1,213 @@
+import asyncio
+import hashlib
+import os
+import re
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+from config import PHOTO_DIR, PHOTO_URL, PHOTO_THUMBNAIL_SIZES, PHOTO_WORKERS, PHOTO_FILE_ID_CACHE_SIZE, API_MAX_UPLOAD_SIZE
+from services.cache import LRUCache
+from metrics import db_method
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Сигнатуры форматов: тип определяем по содержимому, а не по имени файла
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+)
+
+# Имя, которое выдаёт save_stream: sha256 содержимого и расширение по сигнатуре
+STORED_NAME = re.compile(r"[0-9a-f]{64}\.(jpg|png|gif|webp)")
+
+def detect_extension(head):
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+class UploadTooLarge(Exception):
+    pass
+
+class UnsupportedImage(Exception):
+    pass
+
+def make_thumbnails(path, digest, sizes):
+    """Write digest_<size>.jpg variants next to the original; runs in a worker process."""
+    from PIL import Image, ImageOps
+    directory = os.path.dirname(path)
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        for size in sizes:
+            target = os.path.join(directory, f"{digest}_{size}.jpg")
+            if os.path.exists(target):
+                continue
+            variant = image.copy()
+            variant.thumbnail((size, size))
+            tmp = f"{target}.{uuid.uuid4().hex}.part"
+            variant.save(tmp, "JPEG", quality=85, optimize=True)
+            os.replace(tmp, target)
+
+class PhotoStore:
+    """Content-addressed photo storage with thumbnails and a Telegram file_id cache.
+
+    Uploads are streamed to disk while being hashed, so identical photos are
+    stored once as <sha256><ext>. Thumbnails are rendered in a process pool.
+    Once a photo has been sent, Telegram's file_id is remembered and reused.
+    """
+
+    def __init__(self, db, directory=PHOTO_DIR, base_url=PHOTO_URL, thumbnail_sizes=PHOTO_THUMBNAIL_SIZES,
+                 workers=PHOTO_WORKERS, max_size=API_MAX_UPLOAD_SIZE, file_id_cache_size=PHOTO_FILE_ID_CACHE_SIZE):
+        self.db = db
+        self.directory = directory
+        self.base_url = base_url.rstrip("/")
+        self.thumbnail_sizes = tuple(sorted(thumbnail_sizes))
+        self.workers = workers
+        self.max_size = max_size
+        self.file_ids = LRUCache(file_id_cache_size, float("inf"))
+        self._executor = None
+        self._thumbnail_tasks = set()
+        if self.thumbnail_sizes and Image is None:
+            logger.warning("Pillow is not installed, photo thumbnails disabled")
+            self.thumbnail_sizes = ()
+        os.makedirs(directory, exist_ok=True)
+
+    def url_for(self, name):
+        return f"{self.base_url}/{name}"
+
+    def is_stored(self, url):
+        """True for a URL returned by save_stream whose file exists in this store."""
+        if not isinstance(url, str) or not url.startswith(self.base_url + "/"):
+            return False
+        name = url[len(self.base_url) + 1:]
+        return bool(STORED_NAME.fullmatch(name)) and os.path.isfile(os.path.join(self.directory, name))
+
+    def local_path(self, url):
+        """Path of a stored photo for one of our URLs, None for external URLs or missing files."""
+        if not url or not url.startswith(self.base_url + "/"):
+            return None
+        name = os.path.basename(url[len(self.base_url) + 1:])
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+    async def save_stream(self, field):
+        """Stream a multipart field to disk; returns (url, thumbnail urls by size)."""
+        digest = hashlib.sha256()
+        tmp = os.path.join(self.directory, f".{uuid.uuid4().hex}.part")
+        extension = None
+        size = 0
+        try:
+            with open(tmp, "wb") as f:
+                while chunk := await field.read_chunk(64 * 1024):
+                    if extension is None:
+                        extension = detect_extension(chunk)
+                        if extension is None:
+                            raise UnsupportedImage("not a JPEG, PNG, GIF or WebP image")
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise UploadTooLarge(f"photo is larger than {self.max_size} bytes")
+                    digest.update(chunk)
+                    f.write(chunk)
+            if extension is None:
+                raise UnsupportedImage("empty upload")
+            hex_digest = digest.hexdigest()
+            name = f"{hex_digest}{extension}"
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path):
+                # Такое фото уже есть — храним одну копию
+                os.remove(tmp)
+            else:
+                os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._schedule_thumbnails(path, hex_digest)
+        thumbnails = {size: self.url_for(f"{hex_digest}_{size}.jpg") for size in self.thumbnail_sizes}
+        return self.url_for(name), thumbnails
+
+    def _schedule_thumbnails(self, path, digest):
+        if not self.thumbnail_sizes:
+            return
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(loop.run_in_executor(self._executor, make_thumbnails, path, digest, self.thumbnail_sizes))
+        self._thumbnail_tasks.add(task)
+        task.add_done_callback(self._on_thumbnails_done)
+
+    def _on_thumbnails_done(self, task):
+        self._thumbnail_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Error generating thumbnails: {task.exception()}")
+
+    def best_local_file(self, url):
+        """Largest ready thumbnail of a stored photo, falling back to the original."""
+        path = self.local_path(url)
+        if path is None:
+            return None
+        digest = os.path.splitext(os.path.basename(path))[0]
+        for size in reversed(self.thumbnail_sizes):
+            thumbnail = os.path.join(self.directory, f"{digest}_{size}.jpg")
+            if os.path.isfile(thumbnail):
+                return thumbnail
+        return path
+
+    @db_method
+    async def get_file_id(self, url):
+        file_id = self.file_ids.get(url)
+        if file_id is not None:
+            return file_id
+        async with self.db.acquire() as conn:
+            file_id = await conn.fetchval("SELECT file_id FROM photo_file_ids WHERE photo_url = $1", url)
+        if file_id is not None:
+            self.file_ids.set(url, file_id)
+        return file_id
+
+    @db_method
+    async def remember_file_id(self, url, file_id):
+        self.file_ids.set(url, file_id)
+        async with self.db.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO photo_file_ids (photo_url, file_id) VALUES ($1, $2)
+                ON CONFLICT (photo_url) DO UPDATE SET file_id = EXCLUDED.file_id
+            """, url, file_id)
+
+    @db_method
+    async def forget_file_id(self, url):
+        self.file_ids.delete(url)
+        async with self.db.acquire() as conn:
+            await conn.execute("DELETE FROM photo_file_ids WHERE photo_url = $1", url)
+
+    async def answer_photo(self, message, url, **kwargs):
+        """Send a profile photo, reusing the cached file_id when Telegram already has it."""
+        file_id = await self.get_file_id(url)
+        if file_id is not None:
+            try:
+                return await message.answer_photo(photo=file_id, **kwargs)
+            except TelegramBadRequest as e:
+                logger.warning(f"Cached file_id for {url} rejected, re-uploading: {e}")
+                await self.forget_file_id(url)
+        local_file = self.best_local_file(url)
+        sent = await message.answer_photo(photo=FSInputFile(local_file) if local_file else url, **kwargs)
+        if sent.photo:
+            await self.remember_file_id(url, sent.photo[-1].file_id)
+        return sent
+
+    async def stop(self):
+        if self._thumbnail_tasks:
+            await asyncio.gather(*self._thumbnail_tasks, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -1,25 +1,103 @@
+import asyncio
 import json
+import os
 import random
+from typing import NamedTuple
 from aiogram.fsm.state import State, StatesGroup
+from config import QUIZ_FILE, QUIZ_LENGTH, QUIZ_RELOAD_INTERVAL
 import logging
 
 logger = logging.getLogger(__name__)
 
+class Question(NamedTuple):
+    id: str
+    text: str
+    options: tuple
+    correct_index: int
+
+def load_questions(path):
+    """Parse and validate the question bank; raises ValueError on a bad file."""
+    with open(path, "r") as f:
+        raw = json.load(f)
+    questions = []
+    seen = set()
+    for item in raw:
+        question_id = str(item["id"])
+        options = tuple(item["options"])
+        correct = item["correct"]
+        if question_id in seen:
+            raise ValueError(f"Duplicate question id {question_id}")
+        if len(options) < 2:
+            raise ValueError(f"Question {question_id} needs at least two options")
+        if isinstance(correct, int):
+            correct_index = correct
+        elif correct in options:
+            correct_index = options.index(correct)
+        else:
+            raise ValueError(f"Question {question_id}: correct answer {correct!r} is not an option")
+        if not 0 <= correct_index < len(options):
+            raise ValueError(f"Question {question_id}: correct index {correct_index} out of range")
+        seen.add(question_id)
+        questions.append(Question(question_id, item["text"], options, correct_index))
+    if not questions:
+        raise ValueError("Question bank is empty")
+    return questions
+
 class QuizService:
+    """Question bank loaded once, indexed by id and reloaded when the file changes."""
+
     class QuizStates(StatesGroup):
         answering = State()
 
-    def __init__(self):
-        with open("data/questions.json", "r") as f:
-            self.questions = json.load(f)
+    def __init__(self, path=QUIZ_FILE, length=QUIZ_LENGTH, reload_interval=QUIZ_RELOAD_INTERVAL):
+        self.path = path
+        self.length = length
+        self.reload_interval = reload_interval
+        self.questions = []
+        self.positions = {}
+        self._mtime = None
+        self._watch_task = None
+        self.reload()
+
+    def reload(self):
+        mtime = os.stat(self.path).st_mtime
+        questions = load_questions(self.path)
+        self.questions = questions
+        self.positions = {question.id: i for i, question in enumerate(questions)}
+        self._mtime = mtime
+        logger.info(f"Loaded {len(questions)} quiz questions from {self.path}")
+
+    def start(self):
+        if self.reload_interval > 0 and self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                if os.stat(self.path).st_mtime != self._mtime:
+                    self.reload()
+            except Exception as e:
+                # Битый файл не должен ломать текущий банк вопросов
+                logger.error(f"Error reloading quiz questions, keeping previous bank: {e}")
+
+    def new_session(self):
+        """Question ids for one quiz run."""
+        count = min(self.length, len(self.questions))
+        return [question.id for question in random.sample(self.questions, count)]
+
+    def get_question(self, question_id):
+        position = self.positions.get(question_id)
+        return self.questions[position] if position is not None else None
 
     def get_next_question(self):
         return random.choice(self.questions)
 
-    async def check_answer(self, question_index, answer_index, user_id):
-        try:
-            question = self.questions[question_index % len(self.questions)]
-            return answer_index == question["correct"]
-        except Exception as e:
-            logger.error(f"Error checking answer: {e}")
-            raise
+    def check_answer(self, question_id, answer_index):
+        question = self.get_question(question_id)
+        return question is not None and answer_index == question.correct_index
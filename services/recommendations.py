@@ -0,0 +1,241 @@
+import asyncio
+import heapq
+import math
+from config import (RECS_TOP_K, RECS_POOL_SIZE, RECS_BATCH_SIZE, RECS_INTERVAL, RECS_REFRESH_INTERVAL, RECS_LEASE,
+                    RECS_WEIGHTS, RECS_AGE_SCALE, RECS_RECENCY_HALF_LIFE)
+from metrics import db_method
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAX_INTEREST_BITS = 64
+
+# Пул кандидатов для пересчёта: те же фильтры, что у ленты, плюс признаки для скоринга.
+# Если подходящих больше лимита, берём недавно активных, а не произвольный срез таблицы
+POOL_QUERY = """
+    SELECT u.user_id, u.age, u.gender, u.interests,
+           COALESCE(EXTRACT(EPOCH FROM NOW() - a.last_active)::float8, 'Infinity') AS idle_seconds,
+           EXISTS (SELECT 1 FROM likes l WHERE l.liker = u.user_id AND l.likee = $1) AS liked_me
+    FROM users u LEFT JOIN user_activity a ON a.user_id = u.user_id
+    WHERE u.user_id != $1 AND u.blocked = FALSE AND u.city_norm = LOWER($2)
+    AND u.gender = ANY($3::varchar[])
+    AND u.interests && $4::text[]
+    AND NOT EXISTS (SELECT 1 FROM likes l WHERE l.liker = $1 AND l.likee = u.user_id)
+    ORDER BY a.last_active DESC NULLS LAST, u.user_id
+    LIMIT $5
+"""
+
+# Отметки активности одной пачкой; незарегистрированные пользователи отсеиваются
+ACTIVITY_QUERY = """
+    INSERT INTO user_activity (user_id, last_active)
+    SELECT u.user_id, NOW() FROM users u WHERE u.user_id = ANY($1::bigint[])
+    ORDER BY u.user_id
+    ON CONFLICT (user_id) DO UPDATE SET last_active = EXCLUDED.last_active
+"""
+
+# Забираем пользователей на пересчёт с арендой: упавший воркер не теряет задачу
+CLAIM_QUERY = """
+    UPDATE recommendation_jobs j SET due_at = NOW() + $2 * INTERVAL '1 second'
+    FROM (
+        SELECT user_id FROM recommendation_jobs WHERE due_at <= NOW()
+        ORDER BY due_at LIMIT $1 FOR UPDATE SKIP LOCKED
+    ) due
+    WHERE j.user_id = due.user_id
+    RETURNING j.user_id, j.due_at AS lease
+"""
+
+# Следующий плановый пересчёт, если профиль не менялся, пока считали
+RELEASE_QUERY = """
+    UPDATE recommendation_jobs j SET due_at = NOW() + $3 * INTERVAL '1 second'
+    FROM unnest($1::bigint[], $2::timestamptz[]) AS d(user_id, lease)
+    WHERE j.user_id = d.user_id AND j.due_at = d.lease
+"""
+
+def _popcount_table():
+    return np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+POPCOUNT = _popcount_table() if np is not None else None
+
+def popcount64(bits):
+    """Set bits per element of a uint64 array."""
+    return POPCOUNT[bits.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.int64)
+
+def score_arrays(user_bits, user_age, cand_bits, cand_age, cand_idle, cand_reciprocity,
+                 weights=RECS_WEIGHTS, age_scale=RECS_AGE_SCALE, half_life=RECS_RECENCY_HALF_LIFE):
+    """Vectorized scores for one user against arrays of candidate features."""
+    shared = popcount64(cand_bits & np.uint64(user_bits))
+    union = popcount64(cand_bits | np.uint64(user_bits))
+    jaccard = shared / np.maximum(union, 1)
+    age = np.exp(-np.abs(cand_age - user_age) / age_scale)
+    recency = np.exp2(-np.maximum(cand_idle, 0) / half_life)
+    w_interests, w_age, w_recency, w_reciprocity = weights
+    return w_interests * jaccard + w_age * age + w_recency * recency + w_reciprocity * cand_reciprocity
+
+def top_k(scores, k):
+    """Indices of the k best scores, best first."""
+    if len(scores) > k:
+        best = np.argpartition(-scores, k)[:k]
+    else:
+        best = np.arange(len(scores))
+    return best[np.argsort(-scores[best], kind="stable")]
+
+class RecommendationScorer:
+    """Scores candidates by interest Jaccard, age proximity, recency and reciprocity.
+
+    Interests are encoded as 64-bit bitsets so the NumPy path scores a whole
+    pool in a few array operations; without NumPy (or past 64 distinct
+    interests) the same formula runs in pure Python.
+    """
+
+    def __init__(self, weights=RECS_WEIGHTS, age_scale=RECS_AGE_SCALE, half_life=RECS_RECENCY_HALF_LIFE, use_numpy=True):
+        self.weights = weights
+        self.age_scale = age_scale
+        self.half_life = half_life
+        self.use_numpy = use_numpy and np is not None
+        self.vocabulary = {}
+
+    def bits(self, interests):
+        value = 0
+        for interest in interests:
+            bit = self.vocabulary.get(interest)
+            if bit is None:
+                bit = self.vocabulary[interest] = len(self.vocabulary)
+            value |= 1 << bit
+        return value
+
+    @staticmethod
+    def reciprocity(user_gender, candidate, gender_filter):
+        # Уже лайкнул нас — почти наверняка матч; иначе — видит ли кандидат нас в своей ленте
+        if candidate["liked_me"]:
+            return 1.0
+        return 0.5 if user_gender in gender_filter(candidate["gender"]) else 0.0
+
+    def score(self, user, candidates, gender_filter, k=RECS_TOP_K):
+        """Top-k (candidate_id, score) pairs for a user, best first."""
+        if not candidates:
+            return []
+        user_bits = self.bits(user.interests)
+        cand_bits = [self.bits(c["interests"]) for c in candidates]
+        reciprocity = [self.reciprocity(user.gender, c, gender_filter) for c in candidates]
+        if self.use_numpy and len(self.vocabulary) <= MAX_INTEREST_BITS:
+            scores = score_arrays(
+                user_bits, user.age,
+                np.array(cand_bits, dtype=np.uint64),
+                np.array([c["age"] for c in candidates], dtype=np.float64),
+                np.array([c["idle_seconds"] for c in candidates], dtype=np.float64),
+                np.array(reciprocity, dtype=np.float64),
+                self.weights, self.age_scale, self.half_life)
+            return [(candidates[i]["user_id"], float(scores[i])) for i in top_k(scores, k)]
+        w_interests, w_age, w_recency, w_reciprocity = self.weights
+        scored = []
+        for c, bits, mutual in zip(candidates, cand_bits, reciprocity):
+            union = (bits | user_bits).bit_count()
+            jaccard = (bits & user_bits).bit_count() / union if union else 0.0
+            age = math.exp(-abs(c["age"] - user.age) / self.age_scale)
+            recency = 2 ** (-max(c["idle_seconds"], 0) / self.half_life)
+            scored.append((w_interests * jaccard + w_age * age + w_recency * recency + w_reciprocity * mutual, c["user_id"]))
+        return [(user_id, score) for score, user_id in heapq.nlargest(k, scored)]
+
+class RecommendationService:
+    """Background job that keeps the recommendations table fresh.
+
+    Users are queued in recommendation_jobs by triggers (profile changes,
+    incoming likes) and by a periodic refresh; the job claims due users with
+    SKIP LOCKED, so every worker process can run it. Last-active timestamps
+    are buffered and upserted into the narrow user_activity table in one
+    statement per tick.
+    """
+
+    def __init__(self, db, user_manager, gender_filter, scorer=None, batch_size=RECS_BATCH_SIZE, interval=RECS_INTERVAL,
+                 refresh_interval=RECS_REFRESH_INTERVAL, lease=RECS_LEASE, pool_size=RECS_POOL_SIZE, top_k=RECS_TOP_K):
+        self.db = db
+        self.user_manager = user_manager
+        self.gender_filter = gender_filter
+        self.scorer = scorer or RecommendationScorer()
+        self.batch_size = batch_size
+        self.interval = interval
+        self.refresh_interval = refresh_interval
+        self.lease = lease
+        self.pool_size = pool_size
+        self.top_k = top_k
+        self._active = set()
+        self._task = None
+        self.computed = 0
+
+    def touch(self, user_id):
+        """Record activity; flushed to user_activity on the next tick."""
+        self._active.add(user_id)
+
+    @db_method
+    async def request_refresh(self, user_id):
+        async with self.db.acquire() as conn:
+            await conn.execute("SELECT schedule_recommendations($1, INTERVAL '0')", user_id)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush_activity()
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.flush_activity()
+                # Пока есть просроченные задачи, считаем без паузы
+                while await self.run_once():
+                    await asyncio.sleep(0)
+            except Exception as e:
+                logger.error(f"Error computing recommendations: {e}")
+            await asyncio.sleep(self.interval)
+
+    @db_method
+    async def flush_activity(self):
+        if not self._active:
+            return
+        active, self._active = self._active, set()
+        async with self.db.acquire() as conn:
+            await conn.execute(ACTIVITY_QUERY, list(active))
+
+    @db_method
+    async def run_once(self):
+        """Recompute one batch of due users; returns how many were processed."""
+        async with self.db.acquire() as conn:
+            claimed = await conn.fetch(CLAIM_QUERY, self.batch_size, self.lease)
+        if not claimed:
+            return 0
+        for job in claimed:
+            try:
+                await self.compute(job["user_id"])
+            except Exception as e:
+                logger.error(f"Error computing recommendations for user {job['user_id']}: {e}")
+        async with self.db.acquire() as conn:
+            await conn.execute(RELEASE_QUERY, [job["user_id"] for job in claimed], [job["lease"] for job in claimed],
+                               self.refresh_interval)
+        return len(claimed)
+
+    @db_method
+    async def compute(self, user_id):
+        user = await self.user_manager.get_user(user_id)
+        async with self.db.acquire() as conn:
+            if user is None:
+                await conn.execute("DELETE FROM recommendations WHERE user_id = $1", user_id)
+                return
+            pool = await conn.fetch(POOL_QUERY, user_id, user.city, self.gender_filter(user.gender), user.interests,
+                                    self.pool_size)
+            ranked = self.scorer.score(user, pool, self.gender_filter, self.top_k)
+            async with conn.transaction():
+                await conn.execute("DELETE FROM recommendations WHERE user_id = $1", user_id)
+                await conn.execute("""
+                    INSERT INTO recommendations (user_id, candidate_id, score)
+                    SELECT $1, c.candidate_id, c.score FROM unnest($2::bigint[], $3::real[]) AS c(candidate_id, score)
+                """, user_id, [candidate_id for candidate_id, _ in ranked], [score for _, score in ranked])
+        self.computed += 1
@@ -0,0 +1,134 @@
+import asyncio
+import json
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from metrics import db_method
+import logging
+
+logger = logging.getLogger(__name__)
+
+class PostgresKV:
+    """Redis-compatible subset (get/set/delete/incrby/expire) on an UNLOGGED Postgres table.
+
+    Lets several worker processes or nodes share throttle state without Redis.
+    """
+
+    def __init__(self, db, purge_interval=60.0):
+        self.db = db
+        self.purge_interval = purge_interval
+        self._purge_task = None
+
+    def _ensure_purging(self):
+        if self._purge_task is None and self.purge_interval > 0:
+            self._purge_task = asyncio.create_task(self._purge_loop())
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                await self.purge_expired()
+            except Exception as e:
+                logger.error(f"Error purging kv_store: {e}")
+
+    @db_method
+    async def get(self, key):
+        async with self.db.acquire() as conn:
+            return await conn.fetchval(
+                "SELECT value FROM kv_store WHERE key = $1 AND (expires_at IS NULL OR expires_at > NOW())", key)
+
+    @db_method
+    async def set(self, key, value, ex=None, nx=False):
+        conflict = "DO NOTHING" if nx else "DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at"
+        async with self.db.acquire() as conn:
+            if nx:
+                await conn.execute("DELETE FROM kv_store WHERE key = $1 AND expires_at <= NOW()", key)
+            status = await conn.execute(f"""
+                INSERT INTO kv_store (key, value, expires_at)
+                VALUES ($1, $2, NOW() + $3 * INTERVAL '1 second')
+                ON CONFLICT (key) {conflict}
+            """, key, str(value), ex)
+        return True if status.endswith(" 1") else None
+
+    @db_method
+    async def delete(self, *keys):
+        async with self.db.acquire() as conn:
+            status = await conn.execute("DELETE FROM kv_store WHERE key = ANY($1::text[])", list(keys))
+        return int(status.split()[-1])
+
+    @db_method
+    async def incrby(self, key, amount=1):
+        self._ensure_purging()
+        async with self.db.acquire() as conn:
+            return await conn.fetchval("""
+                INSERT INTO kv_store AS kv (key, value) VALUES ($1, ($2::bigint)::text)
+                ON CONFLICT (key) DO UPDATE SET
+                    value = CASE WHEN kv.expires_at <= NOW() THEN ($2::bigint)::text ELSE (kv.value::bigint + $2::bigint)::text END,
+                    expires_at = CASE WHEN kv.expires_at <= NOW() THEN NULL ELSE kv.expires_at END
+                RETURNING value::bigint
+            """, key, amount)
+
+    @db_method
+    async def expire(self, key, seconds):
+        async with self.db.acquire() as conn:
+            status = await conn.execute(
+                "UPDATE kv_store SET expires_at = NOW() + $2 * INTERVAL '1 second' WHERE key = $1", key, seconds)
+        return status.endswith(" 1")
+
+    @db_method
+    async def purge_expired(self):
+        async with self.db.acquire() as conn:
+            await conn.execute("DELETE FROM kv_store WHERE expires_at <= NOW()")
+
+    async def close(self):
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            self._purge_task = None
+
+class PostgresStorage(BaseStorage):
+    """aiogram FSM storage in the fsm_states table, shared by all workers."""
+
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def _key(key: StorageKey):
+        return (key.bot_id, key.chat_id, key.user_id, key.thread_id or 0, key.destiny)
+
+    @db_method
+    async def set_state(self, key: StorageKey, state=None):
+        state = state.state if isinstance(state, State) else state
+        async with self.db.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO fsm_states (bot_id, chat_id, user_id, thread_id, destiny, state)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny) DO UPDATE SET state = EXCLUDED.state
+            """, *self._key(key), state)
+
+    @db_method
+    async def get_state(self, key: StorageKey):
+        async with self.db.acquire() as conn:
+            return await conn.fetchval("""
+                SELECT state FROM fsm_states
+                WHERE bot_id = $1 AND chat_id = $2 AND user_id = $3 AND thread_id = $4 AND destiny = $5
+            """, *self._key(key))
+
+    @db_method
+    async def set_data(self, key: StorageKey, data):
+        async with self.db.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO fsm_states (bot_id, chat_id, user_id, thread_id, destiny, data)
+                VALUES ($1, $2, $3, $4, $5, $6::jsonb)
+                ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny) DO UPDATE SET data = EXCLUDED.data
+            """, *self._key(key), json.dumps(data))
+
+    @db_method
+    async def get_data(self, key: StorageKey):
+        async with self.db.acquire() as conn:
+            raw = await conn.fetchval("""
+                SELECT data FROM fsm_states
+                WHERE bot_id = $1 AND chat_id = $2 AND user_id = $3 AND thread_id = $4 AND destiny = $5
+            """, *self._key(key))
+        return json.loads(raw) if raw else {}
+
+    async def close(self):
+        pass
@@ -1,52 +1,136 @@
-import asyncpg
-from config import DATABASE_URL
+import json
+import uuid
+from dataclasses import asdict
+from config import USER_CACHE_SIZE, USER_CACHE_TTL, SIGNUP_BONUS, WARMUP_USERS
 from models.user import User
+from services.cache import ObjectCache
+from metrics import db_method
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Канал NOTIFY для сброса кэша профилей в других воркерах
+USER_CACHE_CHANNEL = "user_cache"
+# id в одном уведомлении: payload NOTIFY ограничен 8000 байт
+NOTIFY_BATCH_SIZE = 500
+INSTANCE_ID = uuid.uuid4().hex[:12]
+
+USER_COLUMNS = "user_id, nickname, age, country, city, gender, interests, photo_url, blocked"
+# Профиль вместе с балансом из coin_balances
+USER_SELECT = f"""
+    SELECT {', '.join('u.' + c.strip() for c in USER_COLUMNS.split(','))}, COALESCE(b.balance, 0) AS coins
+    FROM users u LEFT JOIN coin_balances b ON b.user_id = u.user_id
+"""
+USER_BY_ID_QUERY = f"{USER_SELECT} WHERE u.user_id = $1 AND u.blocked = FALSE"
+
+def _dump_user(user):
+    return json.dumps(asdict(user))
+
+def _load_user(raw):
+    return User(**json.loads(raw))
+
 class UserManager:
+    def __init__(self, db, kv=None):
+        self.db = db
+        self.cache = ObjectCache("user", USER_CACHE_SIZE, USER_CACHE_TTL, kv=kv, dumps=_dump_user, loads=_load_user)
+        self.shared_invalidation = False
+
+    async def enable_shared_invalidation(self):
+        """Drop local cache entries when another worker changes a profile (LISTEN/NOTIFY)."""
+        await self.db.listen(USER_CACHE_CHANNEL, self._on_remote_change)
+        self.shared_invalidation = True
+
+    def _on_remote_change(self, payload):
+        instance_id, user_ids = payload.split(":")
+        if instance_id != INSTANCE_ID:
+            for user_id in user_ids.split(","):
+                self.cache.local.delete(int(user_id))
+
+    async def _publish_change(self, conn, *user_ids):
+        if self.shared_invalidation:
+            for i in range(0, len(user_ids), NOTIFY_BATCH_SIZE):
+                batch = ",".join(map(str, user_ids[i:i + NOTIFY_BATCH_SIZE]))
+                await conn.execute("SELECT pg_notify($1, $2)", USER_CACHE_CHANNEL, f"{INSTANCE_ID}:{batch}")
+
+    @db_method
     async def create_user(self, user_id, nickname, age, country, city, gender, interests, photo_url=None):
         try:
-            conn = await asyncpg.connect(DATABASE_URL)
-            await conn.execute("""
-                INSERT INTO users (user_id, nickname, age, country, city, gender, interests, photo_url, coins)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, 10)
-            """, user_id, nickname, age, country, city, gender, interests, photo_url)
-            await conn.close()
-            return User(user_id, nickname, age, country, city, gender, interests, photo_url, 10)
+            async with self.db.acquire() as conn, conn.transaction():
+                await conn.execute("""
+                    INSERT INTO users (user_id, nickname, age, country, city, gender, interests, photo_url)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+                """, user_id, nickname, age, country, city, gender, interests, photo_url)
+                await conn.execute("""
+                    WITH entry AS (
+                        INSERT INTO coin_ledger (user_id, amount, reason, idempotency_key)
+                        VALUES ($1, $2, 'signup', 'signup:' || $1::bigint)
+                        ON CONFLICT DO NOTHING
+                    )
+                    INSERT INTO coin_balances (user_id, balance) VALUES ($1, $2)
+                    ON CONFLICT DO NOTHING
+                """, user_id, SIGNUP_BONUS)
+            user = User(user_id, nickname, age, country, city, gender, interests, photo_url, SIGNUP_BONUS)
+            await self.cache.set(user_id, user)
+            return user
         except Exception as e:
             logger.error(f"Error creating user: {e}")
             raise
 
+    @db_method
     async def get_user(self, user_id):
         try:
-            conn = await asyncpg.connect(DATABASE_URL)
-            row = await conn.fetchrow("SELECT * FROM users WHERE user_id = $1 AND blocked = FALSE", user_id)
-            await conn.close()
-            return User(**row) if row else None
+            user = await self.cache.get(user_id)
+            if user is not None:
+                return user
+            async with self.db.acquire() as conn:
+                row = await conn.fetchrow(USER_BY_ID_QUERY, user_id)
+            if not row:
+                return None
+            user = User.from_record(row)
+            await self.cache.set(user_id, user)
+            return user
         except Exception as e:
             logger.error(f"Error getting user: {e}")
             raise
 
+    @db_method
+    async def warm_cache(self, limit=WARMUP_USERS):
+        """Preload the most recently active profiles into the local cache."""
+        if limit <= 0:
+            return 0
+        async with self.db.acquire() as conn:
+            rows = await conn.fetch(f"{USER_SELECT} JOIN user_activity a ON a.user_id = u.user_id "
+                                    "WHERE u.blocked = FALSE ORDER BY a.last_active DESC LIMIT $1", limit)
+        for row in rows:
+            self.cache.local.set(row["user_id"], User.from_record(row))
+        return len(rows)
+
+    @db_method
     async def update_user(self, user_id, **kwargs):
         try:
-            conn = await asyncpg.connect(DATABASE_URL)
-            query = f"UPDATE users SET {', '.join(f'{k} = ${i+1}' for i, k in enumerate(kwargs.keys()))} WHERE user_id = ${len(kwargs) + 1}"
-            await conn.execute(query, *kwargs.values(), user_id)
-            await conn.close()
+            query = f"UPDATE users SET {', '.join(f'{k} = ${i+1}' for i, k in enumerate(kwargs.keys()))} WHERE user_id = ${len(kwargs) + 1} RETURNING {USER_COLUMNS}"
+            query = f"WITH u AS ({query}) SELECT u.*, COALESCE(b.balance, 0) AS coins FROM u LEFT JOIN coin_balances b ON b.user_id = u.user_id"
+            async with self.db.acquire() as conn:
+                row = await conn.fetchrow(query, *kwargs.values(), user_id)
+                await self._publish_change(conn, user_id)
+            # Write-through: заблокированные и удалённые профили из кэша убираем
+            if row and not row["blocked"]:
+                await self.cache.set(user_id, User.from_record(row))
+            else:
+                await self.cache.invalidate(user_id)
         except Exception as e:
             logger.error(f"Error updating user: {e}")
             raise
 
-    async def get_stats(self):
-        try:
-            conn = await asyncpg.connect(DATABASE_URL)
-            users = await conn.fetchval("SELECT COUNT(*) FROM users WHERE blocked = FALSE")
-            matches = await conn.fetchval("SELECT SUM(ARRAY_LENGTH(matches, 1)) FROM users WHERE blocked = FALSE")
-            chats = 0  # Placeholder for chat count
-            await conn.close()
-            return {"users": users, "matches": matches or 0, "chats": chats}
-        except Exception as e:
-            logger.error(f"Error getting stats: {e}")
-            raise
+    @db_method
+    async def invalidate_users(self, user_ids, conn=None):
+        """Drop cached profiles here and in other workers; pass conn to notify over a connection already held."""
+        user_ids = list(user_ids)
+        await self.cache.invalidate(*user_ids)
+        if not self.shared_invalidation or not user_ids:
+            return
+        if conn is not None:
+            await self._publish_change(conn, *user_ids)
+            return
+        async with self.db.acquire() as conn:
+            await self._publish_change(conn, *user_ids)
@@ -0,0 +1,39 @@
+import asyncio
+from datetime import datetime
+from aiogram.types import CallbackQuery, Chat, Message, User
+from middleware.activity import ActivityMiddleware
+from middleware.throttling import ThrottlingMiddleware
+
+USER = User(id=42, is_bot=False, first_name="Test")
+
+class FakeTracker:
+    def __init__(self):
+        self.touched = []
+
+    def touch(self, user_id):
+        self.touched.append(user_id)
+
+async def handled(event, data):
+    return "handled"
+
+def test_messages_and_callbacks_mark_sender_active():
+    tracker = FakeTracker()
+    middleware = ActivityMiddleware(tracker)
+    message = Message(message_id=1, date=datetime.now(), chat=Chat(id=42, type="private"), from_user=USER, text="hi")
+    callback = CallbackQuery(id="1", from_user=USER, chat_instance="42", data="view_profile")
+    assert asyncio.run(middleware(handled, message, {})) == "handled"
+    asyncio.run(middleware(handled, callback, {}))
+    assert tracker.touched == [42, 42]
+
+def test_throttled_updates_still_count_as_activity():
+    tracker = FakeTracker()
+    activity = ActivityMiddleware(tracker)
+    throttling = ThrottlingMiddleware(rate=0.001, burst=1)
+    message = Message(message_id=1, date=datetime.now(), chat=Chat(id=42, type="private"), from_user=USER, text="hi")
+
+    async def chain(event, data):
+        return await throttling(handled, event, data)
+
+    results = [asyncio.run(activity(chain, message, {})) for _ in range(3)]
+    assert results == ["handled", None, None]
+    assert tracker.touched == [42, 42, 42]
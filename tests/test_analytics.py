@@ -0,0 +1,69 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+from handlers.admin import format_stats
+from services.analytics import DAILY_METRICS, AnalyticsService
+
+DAYS = [date(2026, 1, 1) + timedelta(days=i) for i in range(3)]
+
+def stats(**overrides):
+    return {"users": 3, "likes": 5, "matches": 1, "messages": 7, "quiz_plays": 2,
+            "cities": [("berlin", 2)], "genders": [("Female", 2), ("Male", 1)], "days": DAYS,
+            "series": {metric: [0, 1, 2] for metric in DAILY_METRICS}, **overrides}
+
+def test_format_stats_escapes_user_supplied_dimensions():
+    text = format_stats(stats(cities=[("<b>evil</b> & co", 4)], genders=[("<i>x</i>", 1)]))
+    assert "&lt;B&gt;Evil&lt;/B&gt; &amp; Co 4" in text
+    assert "&lt;i&gt;x&lt;/i&gt; 1" in text
+    assert "<b>evil" not in text.lower()
+
+def test_format_stats_lists_daily_series_and_today_active():
+    lines = format_stats(stats()).splitlines()
+    assert "Users: 3 (active today: 2)" in lines
+    assert "01-03: " + " / ".join(["2"] * len(DAILY_METRICS)) in lines
+    assert "Top cities: Berlin 2" in lines
+
+def test_format_stats_without_breakdowns():
+    text = format_stats(stats(cities=[], genders=[]))
+    assert "Top cities: -" in text and "Genders: -" in text
+
+class FakeConn:
+    def __init__(self, totals, daily):
+        self.results = [totals, daily]
+
+    async def fetch(self, query, *args):
+        return self.results.pop(0)
+
+class FakeDatabase:
+    def __init__(self, totals, daily):
+        self.conn = FakeConn(totals, daily)
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        return False
+
+def test_load_stats_sums_shards_into_report():
+    today = datetime.now(timezone.utc).date()
+    totals = [
+        {"metric": "users", "dimension": "", "value": 10},
+        {"metric": "users", "dimension": "city:berlin", "value": 6},
+        {"metric": "users", "dimension": "city:riga", "value": 0},
+        {"metric": "users", "dimension": "gender:Male", "value": 4},
+        {"metric": "likes", "dimension": "", "value": 9},
+    ]
+    daily = [
+        {"day": today, "metric": "active_users", "value": 5},
+        {"day": today - timedelta(days=30), "metric": "active_users", "value": 99},
+        {"day": today, "metric": "unknown", "value": 1},
+    ]
+    service = AnalyticsService(FakeDatabase(totals, daily), days=3)
+    report = asyncio.run(service.get_stats())
+    assert (report["users"], report["likes"], report["matches"]) == (10, 9, 0)
+    # Города с нулём после удалений в отчёт не попадают
+    assert report["cities"] == [("berlin", 6)]
+    assert report["days"][-1] == today
+    assert report["series"]["active_users"] == [0, 0, 5]
@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import urlencode
+import asyncpg
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from api import InitDataValidator, parse_profile, setup_api
+from models.user import User
+
+TOKEN = "123456:test"
+PHOTO = "https://example.org/static/uploads/" + "a" * 64 + ".jpg"
+
+def sign(fields, token=TOKEN):
+    secret = hmac.new(b"WebAppData", token.encode(), hashlib.sha256).digest()
+    check_string = "\n".join(f"{key}={value}" for key, value in sorted(fields.items()))
+    return urlencode({**fields, "hash": hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()})
+
+def init_data(user_id=42, auth_date=None):
+    return sign({"auth_date": str(int(auth_date or time.time())), "query_id": "q", "user": json.dumps({"id": user_id})})
+
+def profile(**overrides):
+    return {"nickname": "Ann", "age": 25, "country": "Germany", "city": "Berlin", "gender": "Female",
+            "interests": ["Music"], **overrides}
+
+class FakePhotos:
+    def is_stored(self, url):
+        return url == PHOTO
+
+def test_valid_init_data():
+    assert InitDataValidator(TOKEN).validate(init_data(42)) == {"id": 42}
+
+def test_tampered_or_foreign_init_data_is_rejected():
+    validator = InitDataValidator(TOKEN)
+    assert validator.validate(init_data(42).replace("42", "43")) is None
+    assert validator.validate(sign({"auth_date": str(int(time.time())), "user": "{}"}, token="654321:other")) is None
+    assert validator.validate("") is None
+
+def test_expired_init_data_is_rejected():
+    assert InitDataValidator(TOKEN, ttl=60).validate(init_data(auth_date=time.time() - 61)) is None
+
+def test_cached_init_data_expires_with_auth_date(monkeypatch):
+    validator = InitDataValidator(TOKEN, ttl=60)
+    raw = init_data(auth_date=time.time() - 50)
+    assert validator.validate(raw) == {"id": 42}
+    # Кэш не продлевает строку: через 11 с она протухла, хотя закэширована 11 с назад
+    wall, monotonic = time.time(), time.monotonic()
+    monkeypatch.setattr(time, "time", lambda: wall + 11)
+    monkeypatch.setattr(time, "monotonic", lambda: monotonic + 11)
+    assert validator.validate(raw) is None
+
+def test_parse_profile_accepts_valid_payload():
+    parsed = parse_profile(profile(interests=["Music", "Music"], photo=PHOTO), FakePhotos())
+    assert parsed["interests"] == ["Music"]
+    assert parsed["photo_url"] == PHOTO
+
+@pytest.mark.parametrize("overrides", [
+    {"age": 17}, {"age": 121}, {"age": 10 ** 12}, {"age": "old"},
+    {"gender": "Robot"}, {"interests": []}, {"interests": ["Knitting"]}, {"nickname": "x" * 51},
+    {"photo": "https://evil.example/track.png"}, {"photo_url": PHOTO.replace("a" * 64, "../../etc/passwd")},
+])
+def test_parse_profile_rejects_bad_fields(overrides):
+    with pytest.raises(web.HTTPBadRequest):
+        parse_profile(profile(**overrides), FakePhotos())
+
+class FakeUserManager:
+    def __init__(self):
+        self.users = {}
+
+    async def get_user(self, user_id):
+        return self.users.get(user_id)
+
+    async def create_user(self, user_id, nickname, age, country, city, gender, interests, photo_url=None):
+        self.users[user_id] = User(user_id, nickname, age, country, city, gender, interests, photo_url, 10)
+
+class FakeMatching:
+    def __init__(self, existing):
+        self.existing = existing
+
+    async def add_like(self, user_id, target_id):
+        if target_id not in self.existing:
+            raise asyncpg.ForeignKeyViolationError("likes_likee_fkey")
+        return target_id == 7
+
+class FakeActivity:
+    def __init__(self):
+        self.touched = []
+
+    def touch(self, user_id):
+        self.touched.append(user_id)
+
+def call(method, path, json_body, headers=None, activity=None):
+    async def run():
+        app = web.Application()
+        setup_api(app, FakeUserManager(), FakeMatching({7, 8}), FakePhotos(), validator=InitDataValidator(TOKEN),
+                  activity=activity)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.request(method, path, json=json_body, headers=headers)
+            return response.status, await response.text()
+    return asyncio.run(run())
+
+def test_requests_without_init_data_are_unauthorized():
+    assert call("POST", "/api/register", profile())[0] == 401
+
+def test_register_rejects_huge_age_with_400():
+    status, _ = call("POST", "/api/register", profile(age=10 ** 12), {"X-Telegram-Init-Data": init_data()})
+    assert status == 400
+
+def test_register_creates_profile():
+    status, body = call("POST", "/api/register", profile(photo=PHOTO), {"X-Telegram-Init-Data": init_data()})
+    assert status == 201
+    assert json.loads(body)["photo_url"] == PHOTO
+
+def test_bulk_likes_report_unknown_ids():
+    status, body = call("POST", "/api/likes", {"user_ids": [7, 999, 8]}, {"X-Telegram-Init-Data": init_data()})
+    assert status == 200
+    assert json.loads(body) == {"matches": [7], "invalid": [999]}
+
+def test_authorized_requests_mark_user_active():
+    activity = FakeActivity()
+    call("POST", "/api/likes", {"user_ids": [7]}, {"X-Telegram-Init-Data": init_data()}, activity=activity)
+    call("POST", "/api/likes", {"user_ids": [7]}, {"X-Telegram-Init-Data": "hash=forged"}, activity=activity)
+    assert activity.touched == [42]
@@ -0,0 +1,61 @@
+import asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from assets import IMMUTABLE, REVALIDATE, AssetBundle
+
+CSS = b"body { background: url(static/img/logo.png); }\n" * 50
+
+def make_bundle(tmp_path):
+    static = tmp_path / "static"
+    (static / "img").mkdir(parents=True)
+    (static / "uploads").mkdir()
+    (static / "img" / "logo.png").write_bytes(b"\x89PNG logo")
+    (static / "app.css").write_bytes(CSS)
+    (static / "app.js").write_bytes(b'fetch("/webapp/static/missing.json"); const logo = "static/img/logo.png";')
+    (static / "uploads" / "photo.jpg").write_bytes(b"user photo")
+    (tmp_path / "index.html").write_bytes(
+        b'<link href="/webapp/static/app.css"><script src="static/app.js"></script><a href="mystatic/app.js">')
+    return AssetBundle(root=str(tmp_path)).build()
+
+def test_references_point_to_fingerprinted_names(tmp_path):
+    bundle = make_bundle(tmp_path)
+    logo, css, js = (bundle.fingerprints[name] for name in ("img/logo.png", "app.css", "app.js"))
+    assert logo.startswith("img/logo.") and logo.endswith(".png")
+    assert f"url(/webapp/static/{logo})".encode() in bundle.assets[css].variants["identity"]
+    js_body = bundle.assets[js].variants["identity"]
+    # Неизвестные файлы остаются как есть
+    assert f'"/webapp/static/{logo}"'.encode() in js_body and b"/webapp/static/missing.json" in js_body
+    index = bundle.index.variants["identity"]
+    assert f'href="/webapp/static/{css}"'.encode() in index and f'src="/webapp/static/{js}"'.encode() in index
+    assert b'href="mystatic/app.js"' in index
+
+def test_fingerprint_follows_rewritten_dependencies(tmp_path):
+    before = make_bundle(tmp_path).fingerprints["app.css"]
+    (tmp_path / "static" / "img" / "logo.png").write_bytes(b"\x89PNG new logo")
+    # CSS не менялся, но ссылается на новое имя картинки — значит, и его имя новое
+    assert AssetBundle(root=str(tmp_path)).build().fingerprints["app.css"] != before
+
+def test_excluded_directories_are_not_loaded(tmp_path):
+    bundle = make_bundle(tmp_path)
+    assert not any(name.startswith("uploads/") for name in bundle.assets)
+    assert bundle.assets[bundle.fingerprints["app.css"]].cache_control == IMMUTABLE
+    assert bundle.assets["app.css"].cache_control == REVALIDATE
+
+def test_static_handler_negotiates_encoding_and_revalidates(tmp_path):
+    bundle = make_bundle(tmp_path)
+    hashed, logo = bundle.fingerprints["app.css"], bundle.fingerprints["img/logo.png"]
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/webapp/static/{path:.*}", bundle.handle_static)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.get(f"/webapp/static/{hashed}", headers={"Accept-Encoding": "gzip"})
+            etag = response.headers["ETag"]
+            assert response.headers["Content-Encoding"] == "gzip"
+            assert await response.read() == CSS.replace(b"static/img/logo.png", f"/webapp/static/{logo}".encode())
+            response = await client.get(f"/webapp/static/{hashed}", headers={"If-None-Match": etag})
+            assert response.status == 304
+            response = await client.get("/webapp/static/uploads/photo.jpg")
+            assert response.status == 404
+
+    asyncio.run(run())
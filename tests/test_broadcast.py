@@ -0,0 +1,136 @@
+import asyncio
+import pytest
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramNetworkError
+from aiogram.methods import SendMessage
+from services import broadcast
+from services.broadcast import BroadcastService
+
+METHOD = SendMessage(chat_id=1, text="hi")
+
+class FakeBot:
+    """send_message that raises the scripted errors for a user before succeeding."""
+
+    def __init__(self, errors=None):
+        self.errors = {user_id: list(items) for user_id, items in (errors or {}).items()}
+        self.calls = []
+        self.delivered = []
+
+    async def send_message(self, chat_id, text):
+        self.calls.append(chat_id)
+        pending = self.errors.get(chat_id)
+        if pending:
+            raise pending.pop(0)
+        self.delivered.append(chat_id)
+
+class FakeConn:
+    def __init__(self, db):
+        self.db = db
+
+    async def fetchval(self, query, *args):
+        assert "pg_try_advisory_lock" in query
+        return True
+
+    async def fetchrow(self, query, *args):
+        return dict(self.db.row)
+
+    async def fetch(self, query, *args):
+        if "FROM broadcasts" in query:
+            return [dict(self.db.row)] if self.db.row["status"] == "running" else []
+        last_user_id, limit = args
+        self.db.chunks.append(last_user_id)
+        return [{"user_id": user_id} for user_id in self.db.users if user_id > last_user_id][:limit]
+
+    async def execute(self, query, *args):
+        if "UPDATE broadcasts" in query:
+            job_id, sent, failed, last_user_id, status = args
+            self.db.row.update(sent=sent, failed=failed, last_user_id=last_user_id, status=status)
+            self.db.checkpoints.append((last_user_id, status))
+
+class FakeAcquire:
+    def __init__(self, db):
+        self.db = db
+
+    async def __aenter__(self):
+        return FakeConn(self.db)
+
+    async def __aexit__(self, *exc):
+        return False
+
+class FakeDatabase:
+    """Broadcast row and users table in memory; no transactions, so a long one would fail loudly."""
+
+    def __init__(self, users, **row):
+        self.users = sorted(users)
+        self.row = {"id": 1, "text": "hello", "total": len(users), "sent": 0, "failed": 0,
+                    "last_user_id": 0, "status": "running", **row}
+        self.chunks = []
+        self.checkpoints = []
+
+    def acquire(self):
+        return FakeAcquire(self)
+
+@pytest.fixture(autouse=True)
+def delays(monkeypatch):
+    """Backoff delays requested by the service; nothing actually waits."""
+    sleep, requested = asyncio.sleep, []
+
+    def fake_sleep(delay):
+        requested.append(delay)
+        return sleep(0)
+
+    monkeypatch.setattr(broadcast.asyncio, "sleep", fake_sleep)
+    return requested
+
+def make_service(db=None, bot=None):
+    return BroadcastService(db or FakeDatabase([]), bot or FakeBot(), rate=10000, concurrency=2, chunk_size=3)
+
+def test_send_retries_after_flood_limit(delays):
+    bot = FakeBot({1: [TelegramRetryAfter(METHOD, "Too Many Requests", retry_after=3)]})
+    service = make_service(bot=bot)
+    paused = []
+    service.limiter.pause = paused.append
+    assert asyncio.run(service._send(1, "hi")) is True
+    assert bot.calls == [1, 1]
+    # Ждёт только лимитер, откладывая всех отправителей на retry_after; свой sleep удвоил бы паузу
+    assert paused == [3]
+    assert not [delay for delay in delays if delay >= 1]
+
+def test_limiter_pause_delays_next_acquire(delays):
+    limiter = broadcast.AsyncRateLimiter(rate=1000)
+    limiter.pause(0.01)
+    asyncio.run(limiter.acquire())
+    # Токенов минус 10 — ждать 11 интервалов по 1 мс
+    assert delays[0] == pytest.approx(0.011, rel=0.1)
+
+def test_send_retries_network_errors_up_to_max_retries(delays):
+    bot = FakeBot({1: [TelegramNetworkError(METHOD, "timeout")] * 2,
+                   2: [TelegramNetworkError(METHOD, "timeout")] * 5})
+    service = make_service(bot=bot)
+    assert asyncio.run(service._send(1, "hi")) is True
+    assert asyncio.run(service._send(2, "hi")) is False
+    assert bot.calls.count(1) == 3
+    assert bot.calls.count(2) == service.max_retries
+    # После последней попытки не ждём; лимитер тоже спит, но доли миллисекунды
+    assert [delay for delay in delays if delay >= 1] == [1, 2, 1, 2, 4, 8]
+
+def test_send_gives_up_on_forbidden():
+    bot = FakeBot({1: [TelegramForbiddenError(METHOD, "bot was blocked by the user")]})
+    service = make_service(bot=bot)
+    assert asyncio.run(service._send(1, "hi")) is False
+    assert bot.calls == [1]
+
+def test_resume_continues_after_last_checkpoint():
+    db = FakeDatabase(range(1, 11), sent=2, failed=1, last_user_id=3)
+    bot = FakeBot({5: [TelegramForbiddenError(METHOD, "bot was blocked by the user")]})
+    service = make_service(db, bot)
+
+    async def run():
+        await service.resume()
+        await asyncio.gather(*(job.task for job in list(service.jobs.values())))
+
+    asyncio.run(run())
+    assert sorted(bot.delivered) == [4, 6, 7, 8, 9, 10]
+    # Каждый чанк — отдельный запрос по ключу от последнего user_id
+    assert db.chunks == [3, 6, 9]
+    assert db.checkpoints == [(6, "running"), (9, "running"), (10, "done")]
+    assert (db.row["sent"], db.row["failed"]) == (8, 2)
@@ -0,0 +1,73 @@
+import asyncio
+import types
+import pytest
+from services import cache
+from services.cache import LRUCache, MemoryKV, ObjectCache
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+def test_lru_evicts_least_recently_used(clock):
+    lru = LRUCache(max_size=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+    assert lru.get("b") is None
+    assert (lru.get("a"), lru.get("c")) == (1, 3)
+    assert lru.stats()["evictions"] == 1
+
+def test_lru_entries_expire_after_their_own_ttl(clock):
+    lru = LRUCache(max_size=10, ttl=60)
+    lru.set("default", 1)
+    lru.set("short", 2, ttl=5)
+    clock[0] += 10
+    assert lru.get("short") is None
+    assert lru.get("default") == 1
+    clock[0] += 60
+    assert lru.get("default") is None
+    stats = lru.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 2, 0)
+
+def test_memory_kv_set_nx_and_expiry(clock):
+    async def run():
+        kv = MemoryKV()
+        assert await kv.set("k", "v", ex=5)
+        assert await kv.set("k", "other", nx=True) is None
+        assert await kv.get("k") == "v"
+        clock[0] += 6
+        assert await kv.get("k") is None
+        assert await kv.set("k", "new", nx=True)
+        assert await kv.delete("k", "missing") == 1
+
+    asyncio.run(run())
+
+def test_memory_kv_incrby_keeps_ttl(clock):
+    async def run():
+        kv = MemoryKV()
+        assert await kv.incrby("n") == 1
+        assert await kv.expire("n", 10)
+        assert await kv.incrby("n", 5) == 6
+        clock[0] += 11
+        assert await kv.get("n") is None
+        assert not await kv.expire("n", 10)
+        assert await kv.incrby("n") == 1
+
+    asyncio.run(run())
+
+def test_object_cache_reads_through_shared_store(clock):
+    async def run():
+        kv = MemoryKV()
+        writer = ObjectCache("user", 10, 60, kv=kv)
+        reader = ObjectCache("user", 10, 60, kv=kv)
+        await writer.set(1, {"nickname": "Ann"})
+        assert await reader.get(1) == {"nickname": "Ann"}
+        assert reader.local.get(1) == {"nickname": "Ann"}
+        await writer.invalidate(1)
+        assert await kv.get("user:1") is None
+        assert await writer.get(1) is None
+
+    asyncio.run(run())
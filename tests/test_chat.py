@@ -0,0 +1,79 @@
+import asyncio
+import json
+from services.chat import ChatService, MAX_MATCH_BUTTONS, render_matches
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        self.sent.append((chat_id, text))
+
+class FakeConn:
+    def __init__(self, db):
+        self.db = db
+
+    async def fetch(self, query, *args):
+        self.db.claims.append(args)
+        rows, self.db.rows = self.db.rows, []
+        return rows
+
+    async def execute(self, query, *args):
+        self.db.executed.append((query, args))
+
+    def transaction(self):
+        return self.db
+
+class FakeDatabase:
+    """Claim returns the scripted rows once; record statements are kept for inspection."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.claims = []
+        self.executed = []
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return FakeConn(self)
+
+    async def __aexit__(self, *exc):
+        return False
+
+def row(row_id, chat_id, kind="message", payload=None, attempts=1):
+    payload = payload if payload is not None else json.dumps({"user_id": 7, "nickname": "Ann", "text": "hi"})
+    return {"id": row_id, "chat_id": chat_id, "kind": kind, "payload": payload, "attempts": attempts}
+
+def match(nickname, user_id=7):
+    return {"user_id": user_id, "nickname": nickname}
+
+def test_single_match_names_the_user():
+    text, markup = render_matches([match("<Ann>")])
+    assert "&lt;Ann&gt;" in text and "<Ann>" not in text
+    assert [button.callback_data for [button] in markup.inline_keyboard] == ["chat_7"]
+
+def test_pending_matches_are_coalesced_into_one_message():
+    payloads = [match(f"user{i}", i) for i in range(MAX_MATCH_BUTTONS + 2)]
+    text, markup = render_matches(payloads)
+    assert text.startswith(f"🎉 You have {MAX_MATCH_BUTTONS + 2} new matches")
+    assert text.endswith(" and 2 more!")
+    assert len(markup.inline_keyboard) == MAX_MATCH_BUTTONS
+
+def test_claim_caps_rows_per_chat_within_lease():
+    db = FakeDatabase([])
+    service = ChatService(db, FakeBot(), chat_interval=1.0, lease=60.0)
+    asyncio.run(service.run_once())
+    # 30 отправок по секунде — половина аренды
+    assert db.claims == [(service.batch_size, 60.0, 30)]
+
+def test_failing_chat_does_not_lose_outcomes_of_others():
+    bot = FakeBot()
+    db = FakeDatabase([row(1, 100), row(2, 200, payload="not json"), row(3, 300),
+                       row(4, 300, kind="match", payload=json.dumps(match("Bob")))])
+    service = ChatService(db, bot, rate=10000, chat_interval=0)
+    assert asyncio.run(service.run_once()) == 4
+    assert sorted(chat_id for chat_id, _ in bot.sent) == [100, 300, 300]
+    sent = [args[0] for query, args in db.executed if "status = 'sent'" in query]
+    assert sorted(sent[0]) == [1, 3, 4]
+    assert service.sent == 3
@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+from services.coins import CREDIT_QUERY, CoinsService
+
+class FakeConn:
+    def __init__(self, db):
+        self.db = db
+
+    async def execute(self, query, *args):
+        if self.db.fail:
+            raise ConnectionError("connection lost")
+        assert query == CREDIT_QUERY
+        self.db.batches.append(args)
+
+class FakeDatabase:
+    def __init__(self):
+        self.batches = []
+        self.checkouts = 0
+        self.fail = False
+
+    def acquire(self):
+        self.checkouts += 1
+        return self
+
+    async def __aenter__(self):
+        return FakeConn(self)
+
+    async def __aexit__(self, *exc):
+        return False
+
+class FakeUserManager:
+    def __init__(self):
+        self.invalidated = []
+
+    async def invalidate_users(self, user_ids, conn=None):
+        assert conn is not None
+        self.invalidated.append(set(user_ids))
+
+def test_flush_writes_one_batch_and_invalidates_on_same_checkout():
+    db, user_manager = FakeDatabase(), FakeUserManager()
+    coins = CoinsService(db, user_manager)
+    coins.credit_later(1, 5, idempotency_key="quiz:1")
+    coins.credit_later(2, 1)
+    coins.credit_later(1, 5, idempotency_key="quiz:1")
+    asyncio.run(coins.flush())
+    assert db.batches == [([1, 2], [5, 1], ["reward", "reward"], ["quiz:1", None])]
+    assert db.checkouts == 1
+    assert user_manager.invalidated == [{1, 2}]
+
+def test_failed_flush_keeps_credits_for_the_next_one():
+    db = FakeDatabase()
+    coins = CoinsService(db)
+    coins.credit_later(1, 5, idempotency_key="quiz:1")
+    db.fail = True
+    with pytest.raises(ConnectionError):
+        asyncio.run(coins.flush())
+    # Повтор того же ключа до сброса по-прежнему отбрасывается
+    coins.credit_later(1, 5, idempotency_key="quiz:1")
+    db.fail = False
+    asyncio.run(coins.flush())
+    assert db.batches == [([1], [5], ["reward"], ["quiz:1"])]
+
+def test_credit_must_be_positive():
+    with pytest.raises(ValueError):
+        CoinsService(FakeDatabase()).credit_later(1, 0)
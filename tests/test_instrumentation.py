@@ -0,0 +1,25 @@
+from datetime import datetime
+import pytest
+from aiogram.types import CallbackQuery, Chat, Message, User
+from middleware.instrumentation import get_prefix
+
+USER = User(id=42, is_bot=False, first_name="Test")
+
+def callback(data):
+    return CallbackQuery(id="1", from_user=USER, chat_instance="42", data=data)
+
+def message(text):
+    return Message(message_id=1, date=datetime.now(), chat=Chat(id=42, type="private"), from_user=USER, text=text)
+
+@pytest.mark.parametrize("data, prefix", [
+    ("like_123", "like"), ("quiz_0_2", "quiz"), ("find_users", "find_users"),
+    ("like_abc", "other"), ("forged", "other"), ("", "other"),
+])
+def test_callback_prefix(data, prefix):
+    assert get_prefix(callback(data)) == prefix
+
+@pytest.mark.parametrize("text, prefix", [
+    ("/start", "/start"), ("/start@SomeBot ref", "/start"), ("/whatever", "other"), ("hello", "message"),
+])
+def test_message_prefix(text, prefix):
+    assert get_prefix(message(text)) == prefix
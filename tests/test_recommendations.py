@@ -0,0 +1,55 @@
+import random
+import pytest
+from models.user import User
+from services.matching import MatchingService
+from services.recommendations import RecommendationScorer, popcount64, top_k
+
+np = pytest.importorskip("numpy")
+
+INTERESTS = ["Music", "Travel", "Sports", "Movies", "Books", "Art", "Food", "Tech"]
+USER = User(1, "Ann", 30, "Germany", "Berlin", "Female", ["Music", "Travel", "Books"])
+gender_filter = MatchingService.get_gender_filter
+
+def candidate(user_id, interests, age=30, gender="Male", idle_seconds=0.0, liked_me=False):
+    return {"user_id": user_id, "age": age, "gender": gender, "interests": interests,
+            "idle_seconds": idle_seconds, "liked_me": liked_me}
+
+def random_pool(rng, size):
+    return [candidate(user_id, rng.sample(INTERESTS, rng.randint(1, 4)), age=rng.randint(18, 60),
+                      gender=rng.choice(["Male", "Female", "Bi", "Gay"]), idle_seconds=rng.uniform(0, 10 ** 6),
+                      liked_me=rng.random() < 0.1)
+            for user_id in range(100, 100 + size)]
+
+def test_popcount64_counts_all_bits():
+    values = np.array([0, 1, 0b1011, 2 ** 63, 2 ** 64 - 1], dtype=np.uint64)
+    assert popcount64(values).tolist() == [0, 1, 3, 1, 64]
+
+def test_top_k_returns_best_first():
+    scores = np.array([0.1, 0.9, 0.5, 0.7, 0.3])
+    assert top_k(scores, 3).tolist() == [1, 3, 2]
+    assert top_k(scores, 10).tolist() == [1, 3, 2, 4, 0]
+
+def test_numpy_and_python_paths_agree():
+    pool = random_pool(random.Random(1), 500)
+    fast = RecommendationScorer().score(USER, pool, gender_filter, k=50)
+    slow = RecommendationScorer(use_numpy=False).score(USER, pool, gender_filter, k=50)
+    assert [user_id for user_id, _ in fast] == [user_id for user_id, _ in slow]
+    assert [score for _, score in fast] == pytest.approx([score for _, score in slow])
+
+def test_score_prefers_shared_interests_and_reciprocity():
+    pool = [
+        candidate(2, ["Music", "Travel", "Books"]),
+        candidate(3, ["Sports"]),
+        candidate(4, ["Sports"], liked_me=True),
+        # Никогда не заходил: нет строки в user_activity
+        candidate(5, ["Music", "Travel", "Books"], idle_seconds=float("inf")),
+    ]
+    ranked = [user_id for user_id, _ in RecommendationScorer().score(USER, pool, gender_filter)]
+    assert ranked == [2, 5, 4, 3]
+
+def test_more_interests_than_bits_fall_back_to_python():
+    scorer = RecommendationScorer()
+    pool = [candidate(user_id, [f"interest{user_id}", "Music"]) for user_id in range(2, 80)]
+    ranked = scorer.score(USER, pool, gender_filter, k=5)
+    assert len(scorer.vocabulary) > 64
+    assert len(ranked) == 5 and all(score == pytest.approx(ranked[0][1]) for _, score in ranked)
@@ -0,0 +1,66 @@
+import asyncio
+from datetime import datetime
+import pytest
+from aiogram.types import CallbackQuery, Chat, Message, User
+from middleware import throttling
+from middleware.throttling import LocalTokenBuckets, SharedTokenBuckets, ThrottlingMiddleware
+from services.cache import MemoryKV
+
+USER = User(id=42, is_bot=False, first_name="Test")
+
+def message():
+    return Message(message_id=1, date=datetime.now(), chat=Chat(id=42, type="private"), from_user=USER, text="hi")
+
+def callback():
+    return CallbackQuery(id="1", from_user=USER, chat_instance="42", data="find_users")
+
+@pytest.fixture(autouse=True)
+def frozen_window(monkeypatch):
+    # Окно SharedTokenBuckets не должно смениться посреди теста
+    monkeypatch.setattr(throttling.time, "time", lambda: 1_000_000.0)
+
+@pytest.fixture(params=["local", "shared"])
+def middlewares(request):
+    kv = MemoryKV() if request.param == "shared" else None
+    return ThrottlingMiddleware(rate=0.5, burst=2, kv=kv), ThrottlingMiddleware(rate=1.0, burst=4, kv=kv)
+
+async def passed(middleware, event, count):
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event)
+
+    for _ in range(count):
+        await middleware(handler, event, {})
+    return len(handled)
+
+def test_token_bucket_allows_burst_then_rejects():
+    for buckets in (LocalTokenBuckets(), SharedTokenBuckets(MemoryKV())):
+        results = [asyncio.run(buckets.consume("k", 1.0, 3)) for _ in range(5)]
+        assert results == [True, True, True, False, False]
+
+def test_local_buckets_evict_refilled_entries(monkeypatch):
+    buckets = LocalTokenBuckets()
+    now = [100.0]
+    monkeypatch.setattr(throttling.time, "monotonic", lambda: now[0])
+    asyncio.run(buckets.consume("a", 1.0, 2))
+    now[0] += 5
+    asyncio.run(buckets.consume("b", 1.0, 2))
+    assert len(buckets) == 1
+
+def test_messages_and_callbacks_have_separate_limits(middlewares):
+    messages, callbacks = middlewares
+    assert asyncio.run(passed(messages, message(), 3)) == 2
+    assert asyncio.run(passed(callbacks, callback(), 4)) == 4
+
+def test_callbacks_do_not_use_up_message_limit(middlewares):
+    messages, callbacks = middlewares
+    assert asyncio.run(passed(callbacks, callback(), 4)) == 4
+    assert asyncio.run(passed(messages, message(), 3)) == 2
+
+def test_store_errors_fail_open():
+    class BrokenKV:
+        async def incrby(self, key, amount):
+            raise ConnectionError("store is down")
+
+    assert asyncio.run(passed(ThrottlingMiddleware(rate=0.5, burst=1, kv=BrokenKV()), message(), 3)) == 3
@@ -0,0 +1,84 @@
+import asyncio
+from webhook import UpdateQueue, get_chat_key
+
+def message(update_id, chat_id):
+    return {"update_id": update_id, "message": {"message_id": update_id, "chat": {"id": chat_id}, "from": {"id": chat_id}}}
+
+def callback(update_id, user_id):
+    return {"update_id": update_id, "callback_query": {"id": str(update_id), "from": {"id": user_id},
+                                                       "message": {"message_id": 1, "chat": {"id": user_id}}}}
+
+class FakeDispatcher:
+    """Records updates per chat; earlier updates of a chat take longer, so a reorder would show."""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.seen = {}
+
+    async def feed_raw_update(self, bot, update):
+        chat_id = get_chat_key(update)
+        await asyncio.sleep(0.001 * (10 - update["update_id"] % 10))
+        self.seen.setdefault(chat_id, []).append(update["update_id"])
+        if update["update_id"] in self.fail:
+            raise RuntimeError("handler failed")
+
+def test_chat_key_of_messages_and_callbacks():
+    assert get_chat_key(message(1, 42)) == 42
+    assert get_chat_key(callback(2, 43)) == 43
+    assert get_chat_key({"update_id": 3, "poll": {"id": "x"}}) == 0
+
+def test_updates_of_one_chat_are_processed_in_order():
+    dp = FakeDispatcher(fail={5})
+
+    async def run():
+        queue = UpdateQueue(dp, bot=None, workers=4, max_size=100)
+        queue.start()
+        for update_id in range(1, 31):
+            assert await queue.put(message(update_id, chat_id=update_id % 3))
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(run())
+    assert dp.seen == {chat_id: [u for u in range(1, 31) if u % 3 == chat_id] for chat_id in range(3)}
+    # Ошибка обработчика не останавливает шард
+    assert (queue.processed, queue.failed) == (30, 1)
+
+def test_redelivered_updates_are_dropped():
+    dp = FakeDispatcher()
+
+    async def run():
+        queue = UpdateQueue(dp, bot=None, workers=2, max_size=10)
+        queue.start()
+        for update in (message(1, 42), message(1, 42), callback(2, 42), callback(2, 42)):
+            assert await queue.put(update)
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(run())
+    assert dp.seen == {42: [1, 2]}
+    assert queue.duplicates == 2
+
+def test_dedup_window_is_bounded():
+    async def run():
+        queue = UpdateQueue(FakeDispatcher(), bot=None, workers=1, max_size=10, dedup_size=2)
+        for update_id in (1, 2, 3):
+            await queue.put(message(update_id, 42))
+        return queue
+
+    queue = asyncio.run(run())
+    assert list(queue._seen) == [2, 3]
+
+def test_full_queue_rejects_without_remembering_the_update():
+    async def run():
+        # Воркеры не запущены: очередь на одно место заполняется первым апдейтом
+        queue = UpdateQueue(FakeDispatcher(), bot=None, workers=1, max_size=1, enqueue_timeout=0.01)
+        assert await queue.put(message(1, 42))
+        assert not await queue.put(message(2, 42))
+        queue.start()
+        # Telegram повторит отклонённый апдейт — он не должен считаться дубликатом
+        assert await queue.put(message(2, 42))
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(run())
+    assert (queue.rejected, queue.duplicates, queue.processed) == (1, 0, 2)
@@ -10,6 +10,15 @@ const steps = [
 
 let currentStep = 0;
 let userData = {};
+let feed = [];
+let feedCursor = null;
+let feedExhausted = false;
+let currentCandidate = null;
+
+function api(path, options = {}) {
+    const headers = { ...(options.headers || {}), "X-Telegram-Init-Data": Telegram.WebApp.initData };
+    return fetch(path, { ...options, headers });
+}
 
 function init() {
     Telegram.WebApp.onEvent("mainButtonClicked", submitStep);
@@ -18,11 +27,7 @@ function init() {
 
 async function checkUser() {
     try {
-        const response = await fetch("/api/user", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ user_id: Telegram.WebApp.initDataUnsafe.user.id })
-        });
+        const response = await api("/api/user");
         const user = await response.json();
         if (user) {
             showProfile(user);
@@ -86,7 +91,7 @@ async function submitStep() {
 async function uploadPhoto(file) {
     const formData = new FormData();
     formData.append("photo", file);
-    const response = await fetch("/api/upload", {
+    const response = await api("/api/upload", {
         method: "POST",
         body: formData
     });
@@ -96,10 +101,10 @@ async function uploadPhoto(file) {
 
 async function submitProfile() {
     try {
-        const response = await fetch("/api/register", {
+        const response = await api("/api/register", {
             method: "POST",
             headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ user_id: Telegram.WebApp.initDataUnsafe.user.id, ...userData })
+            body: JSON.stringify(userData)
         });
         if (response.ok) {
             showProfile(await response.json());
@@ -122,20 +127,85 @@ function skipPhoto() {
     }
 }
 
+// Поля профиля вводят пользователи — в разметку только экранированными
+function escapeHtml(value) {
+    const div = document.createElement("div");
+    div.textContent = String(value);
+    return div.innerHTML;
+}
+
 function showProfile(user) {
     document.getElementById("registration").classList.add("hidden");
     document.getElementById("profile").classList.remove("hidden");
     document.getElementById("profile-photo").src = user.photo_url || "static/images/avatar-placeholder.png";
     document.getElementById("profile-info").innerHTML = `
-        <p><b>Nickname:</b> ${user.nickname}</p>
-        <p><b>Age:</b> ${user.age}</p>
-        <p><b>City:</b> ${user.city}</p>
-        <p><b>Gender:</b> ${user.gender}</p>
-        <p><b>Interests:</b> ${user.interests.join(", ")}</p>
-        <p><b>Coins:</b> ${user.coins}</p>
+        <p><b>Nickname:</b> ${escapeHtml(user.nickname)}</p>
+        <p><b>Age:</b> ${escapeHtml(user.age)}</p>
+        <p><b>City:</b> ${escapeHtml(user.city)}</p>
+        <p><b>Gender:</b> ${escapeHtml(user.gender)}</p>
+        <p><b>Interests:</b> ${escapeHtml(user.interests.join(", "))}</p>
+        <p><b>Coins:</b> ${escapeHtml(user.coins)}</p>
     `;
 }
 
+async function loadFeed() {
+    const query = feedCursor ? `?cursor=${encodeURIComponent(feedCursor)}` : "";
+    const response = await api(`/api/feed${query}`);
+    const page = await response.json();
+    feed.push(...page.users);
+    feedCursor = page.next_cursor;
+    feedExhausted = !feedCursor;
+}
+
+async function nextUser() {
+    try {
+        // Профили приходят пачкой, следующую подгружаем заранее
+        if (feed.length < 5 && !feedExhausted) {
+            await loadFeed();
+        }
+        currentCandidate = feed.shift() || null;
+        document.getElementById("profile").classList.add("hidden");
+        document.getElementById("find-users").classList.remove("hidden");
+        if (!currentCandidate) {
+            document.getElementById("user-info").innerHTML = "<p>No more users to show.</p>";
+            return;
+        }
+        document.getElementById("user-photo").src = currentCandidate.photo_url || "static/images/avatar-placeholder.png";
+        document.getElementById("user-info").innerHTML = `
+            <p><b>${escapeHtml(currentCandidate.nickname)}</b>, ${escapeHtml(currentCandidate.age)}, ${escapeHtml(currentCandidate.city)}</p>
+            <p><b>Interests:</b> ${escapeHtml(currentCandidate.interests.join(", "))}</p>
+        `;
+    } catch (e) {
+        console.error("Error loading feed:", e);
+        showError("Failed to load users.");
+    }
+}
+
+async function likeUser() {
+    if (!currentCandidate) {
+        return;
+    }
+    const liked = currentCandidate;
+    try {
+        const response = await api("/api/likes", {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ user_ids: [liked.user_id] })
+        });
+        const result = await response.json();
+        if (result.matches.includes(liked.user_id)) {
+            document.getElementById("find-users").classList.add("hidden");
+            document.getElementById("match").classList.remove("hidden");
+            document.getElementById("match-name").textContent = liked.nickname;
+            return;
+        }
+    } catch (e) {
+        console.error("Error liking user:", e);
+        showError("Failed to like user.");
+    }
+    await nextUser();
+}
+
 function showError(message) {
     Telegram.WebApp.showAlert(message);
 }
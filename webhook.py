@@ -0,0 +1,176 @@
+import asyncio
+import time
+from collections import OrderedDict
+import aiohttp
+from aiohttp import web
+from config import WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_ENQUEUE_TIMEOUT, WEBHOOK_DEDUP_SIZE, WEB_INTERNAL_PORT
+import logging
+
+logger = logging.getLogger(__name__)
+
+def get_chat_key(update):
+    """Chat (or user) an update belongs to, used to keep per-chat ordering."""
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        if "chat" in value:
+            return value["chat"]["id"]
+        if "message" in value and isinstance(value["message"], dict) and "chat" in value["message"]:
+            return value["message"]["chat"]["id"]
+        if "from" in value:
+            return value["from"]["id"]
+    return 0
+
+class UpdateQueue:
+    """Bounded webhook ingestion queue drained by a fixed pool of workers.
+
+    Updates are sharded by chat, one worker per shard, so updates of the same
+    chat are processed in order while different chats run concurrently.
+    Recently seen update_ids are remembered to drop Telegram redeliveries.
+    """
+
+    def __init__(self, dp, bot, workers=WEBHOOK_WORKERS, max_size=WEBHOOK_QUEUE_SIZE,
+                 enqueue_timeout=WEBHOOK_ENQUEUE_TIMEOUT, dedup_size=WEBHOOK_DEDUP_SIZE):
+        self.dp = dp
+        self.bot = bot
+        self.enqueue_timeout = enqueue_timeout
+        self.dedup_size = dedup_size
+        self._shards = [asyncio.Queue(maxsize=max(1, max_size // workers)) for _ in range(workers)]
+        self._workers = []
+        self._seen = OrderedDict()
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self.wait_time = 0.0
+        self.processing_time = 0.0
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker(shard)) for shard in self._shards]
+
+    async def put(self, update):
+        """Queue an update. Returns False if the queue stayed full (caller should ask Telegram to retry)."""
+        update_id = update.get("update_id")
+        if update_id is not None and update_id in self._seen:
+            self.duplicates += 1
+            return True
+        # Помечаем до ожидания места в очереди, чтобы параллельный повтор тоже отбросился
+        if update_id is not None:
+            self._seen[update_id] = None
+            if len(self._seen) > self.dedup_size:
+                self._seen.popitem(last=False)
+        shard = self._shards[hash(get_chat_key(update)) % len(self._shards)]
+        try:
+            await asyncio.wait_for(shard.put((time.monotonic(), update)), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self._seen.pop(update_id, None)
+            self.rejected += 1
+            logger.warning(f"Update queue full, rejecting update {update_id}")
+            return False
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        return True
+
+    @property
+    def depth(self):
+        return sum(shard.qsize() for shard in self._shards)
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "avg_wait_time": self.wait_time / self.processed if self.processed else 0.0,
+            "avg_processing_time": self.processing_time / self.processed if self.processed else 0.0,
+        }
+
+    async def _worker(self, shard):
+        while True:
+            enqueued_at, update = await shard.get()
+            started = time.monotonic()
+            self.wait_time += started - enqueued_at
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error processing update {update.get('update_id')}: {e}")
+            finally:
+                self.processed += 1
+                self.processing_time += time.monotonic() - started
+                shard.task_done()
+
+    async def stop(self, timeout=10.0):
+        """Drain queued updates (up to timeout), then stop the workers."""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(shard.join() for shard in self._shards)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Update queue not drained in {timeout}s, {self.depth} updates dropped")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+class UpdateRouter:
+    """Sends every chat's updates to one pre-fork worker.
+
+    With SO_REUSEPORT the kernel spreads webhook connections over all workers,
+    but UpdateQueue orders and deduplicates updates only within its process.
+    Each worker therefore also listens on 127.0.0.1:(base_port + worker_id);
+    an update whose chat belongs to another worker (chat id modulo workers) is
+    forwarded there and that worker's answer is returned to Telegram, so a
+    failed or draining owner still makes Telegram redeliver.
+    """
+
+    def __init__(self, app, worker_id, workers, base_port=WEB_INTERNAL_PORT, timeout=WEBHOOK_ENQUEUE_TIMEOUT + 5.0):
+        self.app = app
+        self.worker_id = worker_id
+        self.workers = workers
+        self.base_port = base_port
+        self.timeout = timeout
+        self.forwarded = 0
+        self._session = None
+        self._runner = None
+
+    def owner(self, update):
+        return get_chat_key(update) % self.workers
+
+    async def start(self):
+        internal = web.Application()
+        internal.router.add_post('/update', self.handle_forwarded)
+        self._runner = web.AppRunner(internal, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, '127.0.0.1', self.base_port + self.worker_id).start()
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def stop(self):
+        if self._session:
+            await self._session.close()
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def route(self, update):
+        """HTTP status for Telegram: queue locally, or forward to the worker that owns the chat."""
+        owner = self.owner(update)
+        if owner == self.worker_id:
+            return await self._put(update)
+        try:
+            async with self._session.post(f"http://127.0.0.1:{self.base_port + owner}/update", json=update) as response:
+                self.forwarded += 1
+                return response.status
+        except Exception as e:
+            logger.warning(f"Error forwarding update {update.get('update_id')} to worker {owner}: {e}")
+            return 503
+
+    async def handle_forwarded(self, request):
+        return web.Response(status=await self._put(await request.json()))
+
+    async def _put(self, update):
+        if self.app['state'] == 'draining':
+            return 503
+        return 200 if await self.app['updates'].put(update) else 503